@@ -0,0 +1,94 @@
+"""Compare the numpy feature kernel with the pandas reference implementation
+
+usage: python benchmarks/bench_features.py [rows ...]
+       python benchmarks/bench_features.py --panel [tickers rows]
+"""
+
+import os
+import sys
+import time
+import numpy
+import pandas
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import cache  # noqa: E402
+import processing  # noqa: E402
+
+defaultSizes = [1_000, 10_000, 100_000, 1_000_000]
+
+
+def syntheticSeries(rows, seed=0):
+    """Random-walk daily bars laid out like a cleaned download"""
+    rng = numpy.random.default_rng(seed)
+    close = 100 * numpy.exp(numpy.cumsum(rng.normal(0, 0.01, rows)))
+    return pandas.DataFrame(
+        {
+            "Price": pandas.date_range("1900-01-01", periods=rows, freq="h"),
+            "Close": close,
+            "High": close * 1.01,
+            "Low": close * 0.99,
+            "Open": close,
+            "Volume": rng.integers(1_000_000, 100_000_000, rows),
+        }
+    )
+
+
+def timeIt(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(sizes):
+    print(
+        f"{'rows':>10} {'pandas s':>10} {'kernel s':>10} {'speedup':>8} {'max rel err':>12}"
+    )
+    for rows in sizes:
+        data = syntheticSeries(rows)
+        repeat = 5 if rows <= 100_000 else 2
+        pandasTime, expected = timeIt(
+            lambda: processing.addFeaturesPandas(data).dropna(), repeat
+        )
+        kernelTime, result = timeIt(
+            lambda: processing.addFeatures(data, None, None, None, persist=False),
+            repeat,
+        )
+        columns = expected.columns.drop("Price")
+        a = result[columns].to_numpy()
+        b = expected[columns].to_numpy()
+        err = numpy.max(numpy.abs(a - b) / numpy.maximum(numpy.abs(b), 1))
+        print(
+            f"{rows:>10} {pandasTime:>10.4f} {kernelTime:>10.4f} "
+            f"{pandasTime / kernelTime:>7.1f}x {err:>12.2e}"
+        )
+
+
+def panel(tickers, rows):
+    """One addFeatures call per ticker against one addPanelFeatures call"""
+    series = {
+        f"T{i}": syntheticSeries(rows, seed=i).iloc[i % 50 :] for i in range(tickers)
+    }
+    loopTime, _ = timeIt(
+        lambda: {
+            t: processing.addFeatures(d, None, None, None, persist=False)
+            for t, d in series.items()
+        },
+        2,
+    )
+    panelTime, _ = timeIt(lambda: processing.addPanelFeatures(series), 2)
+    print(f"{tickers} tickers x {rows} rows")
+    print(
+        f"per ticker {loopTime:.3f}s, panel {panelTime:.3f}s, {loopTime / panelTime:.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    # repeats would otherwise time feature cache hits, not the computation
+    cache.cacheConfig["enabled"] = False
+    if sys.argv[1:2] == ["--panel"]:
+        panel(*([int(a) for a in sys.argv[2:4]] or [300, 1000]))
+    else:
+        main([int(a) for a in sys.argv[1:]] or defaultSizes)
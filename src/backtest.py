@@ -0,0 +1,313 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy
+from prophet import Prophet
+import model
+import storage
+import trainset
+import executor
+from config import loadConfig
+
+# the last 12 refits, 21 days apart on daily bars
+defaultFolds = 12
+defaultStep = 21
+defaultMinTrain = 250
+# training rows of a sliding window
+defaultTrainRows = 500
+defaultHorizons = [1, 5, 10, 20]
+defaultDir = "/persistent/backtest"
+# fold results are a few hundred bytes each
+defaultMaxFolds = 2000
+
+backtestConfig = loadConfig().get("backtest", {})
+
+# fold key -> horizon -> [sum of squared errors, of absolute errors, of absolute
+# percentage errors, right directions, predictions], least recently used first
+_folds = OrderedDict()
+_loaded = False
+_lock = threading.Lock()
+
+
+def backtestDir():
+    return backtestConfig.get("dir", defaultDir)
+
+
+def _foldsPath():
+    return os.path.join(backtestDir(), "folds.json")
+
+
+def _loadFolds():
+    # caller holds _lock
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    try:
+        with open(_foldsPath(), "r") as f:
+            _folds.update(json.load(f).get("folds", {}))
+    except FileNotFoundError:
+        pass
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ignoring unreadable backtest folds {_foldsPath()}: {e}")
+
+
+def _saveFolds():
+    # caller holds _lock
+    while len(_folds) > backtestConfig.get("max_folds", defaultMaxFolds):
+        _folds.popitem(last=False)
+    path = _foldsPath()
+    try:
+        os.makedirs(backtestDir(), exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"version": 1, "folds": _folds}, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        print(f"Could not write backtest folds {path}: {e}")
+
+
+def clearFolds():
+    """Forget the fold results in memory, the stored ones are read again"""
+    global _loaded
+    with _lock:
+        _folds.clear()
+        _loaded = False
+
+
+def makeFolds(
+    stamps, horizons, folds, step, minTrain, window="expanding", trainRows=None
+):
+    """(start, cutoff, end, origins) rows of the walk-forward folds over bars at stamps
+
+    A fold's model is trained on bars [start, cutoff) and predicts from the origins
+    [cutoff, cutoff + origins), end leaves room for the longest horizon. Cutoffs are
+    the first bars of a calendar grid of step times the usual bar spacing, counted
+    from the epoch, so a series that gains bars at the end or loses them at the
+    front keeps the cutoff times of its earlier folds.
+    """
+    stamps = numpy.asarray(stamps, dtype=numpy.int64)
+    rows = len(stamps)
+    if rows < 2:
+        return []
+    trainRows = trainRows or defaultTrainRows
+    first = minTrain if window == "expanding" else trainRows
+    spacing = max(int(numpy.median(numpy.diff(stamps))), 1)
+    grid = stamps // (step * spacing)
+    starts = (numpy.flatnonzero(numpy.diff(grid)) + 1).tolist() + [rows]
+    cutoffs = [
+        (cutoff, following)
+        for cutoff, following in zip(starts, starts[1:])
+        if first <= cutoff < rows - min(horizons)
+    ][-folds:]
+    return [
+        (
+            0 if window == "expanding" else cutoff - trainRows,
+            cutoff,
+            min(following + max(horizons), rows),
+            following - cutoff,
+        )
+        for cutoff, following in cutoffs
+    ]
+
+
+def _score(predictions, actuals, lastCloses):
+    errors = predictions - actuals
+    rightDirection = numpy.sign(predictions - lastCloses) == numpy.sign(
+        actuals - lastCloses
+    )
+    return [
+        float(numpy.sum(errors**2)),
+        float(numpy.sum(numpy.abs(errors))),
+        float(numpy.sum(numpy.abs(errors / actuals))),
+        int(numpy.sum(rightDirection)),
+        len(errors),
+    ]
+
+
+def _treeFold(modelName, frame, cutoff, step, horizons, seed):
+    params = dict(model.boosterParams[modelName])
+    if modelName == "lightgbm":
+        params["random_state"] = seed
+    kit = model.boosters[modelName]
+    close = frame["Close"].to_numpy(dtype=numpy.float64)
+    results = {}
+    base = None
+    for horizon in sorted(horizons):
+        # train rows pair bar t with the close of t + horizon < cutoff, the test
+        # rows start at cutoff - horizon so the origins are from test row horizon on
+        dataset = trainset.TrainingSet(frame, horizon, len(frame) - cutoff, base=base)
+        base = base or dataset
+        origins = slice(horizon, horizon + step)
+        actuals = dataset.testY[origins]
+        if dataset.trainRows < 1 or not len(actuals):
+            continue
+        booster = kit["boost"](params, dataset, model.boostRounds, None)
+        predictions = kit["predict"](booster, dataset.testX[origins])
+        lastCloses = close[cutoff : cutoff + len(actuals)]
+        results[str(horizon)] = _score(predictions, actuals, lastCloses)
+    return results
+
+
+def _prophetFold(frame, cutoff, step, horizons):
+    prophetData, regressorFeatures = model.prophetFrame(frame)
+    prophet = Prophet()
+    for feature in regressorFeatures:
+        prophet.add_regressor(feature)
+    prophet.fit(prophetData.iloc[:cutoff])
+
+    # regressors stay at their last known value, as in a real forecast
+    future = prophetData.iloc[cutoff:].drop(columns="y")
+    for feature in regressorFeatures:
+        future[feature] = prophetData[feature].iloc[cutoff - 1]
+    forecast = prophet.predict(future)["yhat"].to_numpy()
+
+    close = prophetData["y"].to_numpy(dtype=numpy.float64)
+    results = {}
+    for horizon in sorted(horizons):
+        origins = numpy.arange(cutoff, min(cutoff + step, len(frame) - horizon))
+        if not len(origins):
+            continue
+        predictions = forecast[origins + horizon - cutoff]
+        results[str(horizon)] = _score(
+            predictions, close[origins + horizon], close[origins]
+        )
+    return results
+
+
+def evaluateFold(modelName, frame, cutoff, step, horizons, seed=42):
+    """Per horizon error sums of one fold, see _folds, runs in a training worker"""
+    if modelName == "prophet":
+        return _prophetFold(frame, cutoff, step, horizons)
+    return _treeFold(modelName, frame, cutoff, step, horizons, seed)
+
+
+def _foldKey(modelName, frame, stamps, cutoff, step, horizons, seed, window):
+    # bars before the cutoff are taken as final, the ones after it are hashed so a
+    # revised or still forming bar recomputes the fold. an expanding fold keeps its
+    # key when bars are trimmed from the front of the series
+    fields = [modelName, window, int(stamps[cutoff]), step, sorted(horizons), seed]
+    if window != "expanding":
+        fields.append(int(stamps[0]))
+    if modelName != "prophet":
+        fields.append(model.boosterParams[modelName])
+    evaluated = frame.iloc[cutoff:][["Close"]].set_axis(stamps[cutoff:])
+    fields.append(storage.hashFrame(evaluated))
+    text = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def runBacktest(
+    data,
+    modelName,
+    horizons=None,
+    folds=None,
+    step=None,
+    window=None,
+    minTrain=None,
+    trainRows=None,
+    seed=42,
+):
+    """Walk-forward backtest of a model over a feature frame
+
+    Every fold retrains the model on the bars before its cutoff and predicts each
+    horizon from the bars up to the next cutoff, see makeFolds. Folds already
+    computed for the same cutoff time and bars after it are reused, the others run
+    in parallel as training jobs. Returns a dict with the folds used, how many were
+    computed and the error table, horizon -> rmse, mae, mape, direction (share of
+    predictions moving the right way) and predictions.
+    """
+    config = backtestConfig
+    modelName = modelName.lower()
+    horizons = sorted(set(horizons or config.get("horizons", defaultHorizons)))
+    step = step or config.get("step", defaultStep)
+    window = window or config.get("window", "expanding")
+    # the configured training sizes are for long histories, a short period still
+    # gets folds over its second half
+    half = len(data) // 2
+    stamps = storage.barStamps(data)
+    foldRanges = makeFolds(
+        stamps,
+        horizons,
+        folds or config.get("folds", defaultFolds),
+        step,
+        minTrain or min(config.get("min_train", defaultMinTrain), half),
+        window,
+        trainRows or min(config.get("train_rows", defaultTrainRows), half),
+    )
+    if not foldRanges:
+        raise ValueError(f"Not enough rows ({len(data)}) for a backtest")
+
+    # days since the epoch instead of linspace(0, 1) over the series, so bars keep
+    # their values when the series grows or is trimmed. trees and prophet's
+    # standardized regressors fit the same model on a linear rescaling
+    if "timeFeature" in data.columns:
+        data = data.assign(timeFeature=stamps / 86400e9)
+
+    jobs = []
+    for start, cutoff, end, origins in foldRanges:
+        frame = data.iloc[start:end].reset_index(drop=True)
+        args = (modelName, frame, cutoff - start, origins, horizons, seed)
+        key = _foldKey(modelName, frame, stamps[start:end], *args[2:], window)
+        jobs.append((key, args))
+
+    with _lock:
+        _loadFolds()
+        results = {key: _folds[key] for key, _ in jobs if key in _folds}
+    missing = [(key, args) for key, args in jobs if key not in results]
+
+    if executor.workerCount() <= 0:
+        for key, args in missing:
+            results[key] = evaluateFold(*args)
+    else:
+        running = [
+            (
+                key,
+                executor.submit(
+                    evaluateFold,
+                    *args,
+                    description=f"backtest {modelName} fold {args[2]}",
+                ),
+            )
+            for key, args in missing
+        ]
+        try:
+            for key, job in running:
+                results[key] = job.result()
+        finally:
+            for _, job in running:
+                job.cancel()  # the others are pointless once one fold failed
+
+    with _lock:
+        for key, _ in jobs:
+            _folds[key] = results[key]
+            _folds.move_to_end(key)
+        if missing:
+            _saveFolds()
+
+    table = {}
+    for horizon in horizons:
+        sums = [
+            results[key][str(horizon)]
+            for key, _ in jobs
+            if str(horizon) in results[key]
+        ]
+        if not sums:
+            continue
+        sse, sae, sape, right, count = numpy.sum(sums, axis=0)
+        table[horizon] = {
+            "rmse": float(numpy.sqrt(sse / count)),
+            "mae": float(sae / count),
+            "mape": float(sape / count),
+            "direction": float(right / count),
+            "predictions": int(count),
+            "folds": len(sums),
+        }
+    return {
+        "model": modelName,
+        "window": window,
+        "folds": len(jobs),
+        "computed": len(missing),
+        "table": table,
+    }
@@ -0,0 +1,506 @@
+import json
+import os
+import time
+import threading
+from collections import OrderedDict
+from config import loadConfig
+import storage
+import features
+
+# seconds a downloaded series stays fresh, per interval
+# intraday bars change every few minutes, daily and longer bars only once per session
+defaultTtl = {
+    "1m": 60,
+    "2m": 120,
+    "5m": 300,
+    "15m": 900,
+    "30m": 1800,
+    "60m": 3600,
+    "90m": 5400,
+    "1h": 3600,
+    "1d": 6 * 3600,
+    "5d": 12 * 3600,
+    "1wk": 24 * 3600,
+    "1mo": 24 * 3600,
+    "3mo": 24 * 3600,
+}
+defaultMaxEntries = 32
+defaultFeatureEntries = 16
+# frames whose training sets are kept, one per horizon trained on the frame. they
+# also hold the native datasets of the tree models
+defaultDatasetEntries = 4
+# periods ordered by how much history they hold, a series contains every period before it
+# ytd is never longer than 1y but may be longer than 6mo, so it is only ever served
+# from a cached 1y or longer series
+periodOrder = ["1d", "5d", "1mo", "3mo", "6mo", "1y", "2y", "5y", "10y", "max"]
+# warm copies live on the kubernetes persistent volume (50Mi, shared with users.json)
+defaultDir = "/persistent/cache"
+defaultDiskMaxBytes = 40 * 1024 * 1024
+
+# (ticker, period, interval) -> {"data": DataFrame, "fetchedAt": epoch seconds}
+_entries = OrderedDict()
+# key -> manifest entry of the copy on the persistent volume
+_disk = {}
+# (input hash, feature spec version, feature names) -> feature frame
+_features = OrderedDict()
+# (input hash, dayTarget, testSize, shuffle, seed) -> trainset.TrainingSet
+_datasets = OrderedDict()
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "diskHits": 0,
+    "sliceHits": 0,
+    "featureHits": 0,
+    "featureMisses": 0,
+    "datasetHits": 0,
+    "datasetMisses": 0,
+}
+# commands run their pipelines on worker threads
+_lock = threading.Lock()
+
+cacheConfig = loadConfig().get("cache", {})
+
+
+def getTtl(tinterval):
+    overrides = cacheConfig.get("ttl", {})
+    return overrides.get(tinterval, defaultTtl.get(tinterval, 300))
+
+
+def makeKey(ticker, tperiod, tinterval):
+    return (ticker.upper(), tperiod, tinterval)
+
+
+def cacheDir():
+    return cacheConfig.get("dir", defaultDir)
+
+
+def _diskEnabled():
+    return cacheConfig.get("enabled", True) and cacheConfig.get("persistent", True)
+
+
+def _manifestPath():
+    return os.path.join(cacheDir(), "manifest.json")
+
+
+def _writeManifest():
+    # caller holds _lock
+    path = _manifestPath()
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"version": 1, "entries": list(_disk.values())}, f, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+
+def _statePath(basePath):
+    return f"{basePath}.state.json"
+
+
+def featuresPath(basePath):
+    """Base path of the features computed block by block from a copy on the volume"""
+    return f"{basePath}.features"
+
+
+def _sidecars(entry):
+    # files stored next to the series: its feature state and chunked features
+    chunked = storage.filePaths(featuresPath(entry["path"]), entry["format"])
+    return [_statePath(entry["path"])] + chunked
+
+
+def _removeFiles(entry):
+    paths = storage.filePaths(entry["path"], entry["format"])
+    for path in paths + _sidecars(entry):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _entryBytes(entry):
+    # the series files and the sidecars saved next to them
+    size = entry["bytes"]
+    for path in _sidecars(entry):
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass  # not written
+    return size
+
+
+def _evictDisk():
+    # caller holds _lock, drops the oldest downloads until the volume budget fits
+    maxBytes = cacheConfig.get("disk_max_bytes", defaultDiskMaxBytes)
+    byAge = sorted(_disk.items(), key=lambda item: item[1]["fetchedAt"])
+    sizes = {key: _entryBytes(entry) for key, entry in byAge}
+    total = sum(sizes.values())
+    for key, entry in byAge:
+        if total <= maxBytes:
+            break
+        _removeFiles(entry)
+        del _disk[key]
+        total -= sizes[key]
+
+
+def _persist(key, data, fetchedAt):
+    fmt = storage.getFormat()
+    basePath = os.path.join(cacheDir(), "_".join(key))
+    try:
+        os.makedirs(cacheDir(), exist_ok=True)
+        storage.saveFrame(data, basePath, fmt)
+        size = sum(os.path.getsize(p) for p in storage.filePaths(basePath, fmt))
+    except OSError as e:
+        print(f"Could not write {basePath} to the persistent cache: {e}")
+        return
+
+    entry = {
+        "ticker": key[0],
+        "period": key[1],
+        "interval": key[2],
+        "hash": storage.hashFrame(data),
+        "fetchedAt": fetchedAt,
+        "bytes": size,
+        "path": basePath,
+        "format": fmt,
+    }
+    with _lock:
+        _disk[key] = entry
+        _evictDisk()
+        try:
+            _writeManifest()
+        except OSError as e:
+            print(f"Could not write the cache manifest: {e}")
+
+
+def _loadFromDisk(key):
+    with _lock:
+        entry = _disk.get(key)
+    if entry is None:
+        return None, None
+    data = storage.loadFrame(entry["path"], entry["format"])
+    return data, entry
+
+
+def loadManifest():
+    """Validate the persistent cache and serve its series, returns how many are warm"""
+    if not _diskEnabled():
+        return 0
+    try:
+        with open(_manifestPath(), "r") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ignoring unreadable cache manifest {_manifestPath()}: {e}")
+        return 0
+
+    valid = {}
+    frames = {}
+    for entry in manifest.get("entries", []):
+        try:
+            key = makeKey(entry["ticker"], entry["period"], entry["interval"])
+            data = storage.loadFrame(entry["path"], entry["format"])
+            intact = data is not None and storage.hashFrame(data) == entry["hash"]
+        except (KeyError, TypeError):
+            continue
+        if not intact:
+            print(f"Dropping corrupt cache entry {entry['path']}")
+            _removeFiles(entry)
+            continue
+        valid[key] = entry
+        frames[key] = data
+
+    maxEntries = cacheConfig.get("max_entries", defaultMaxEntries)
+    newest = sorted(valid, key=lambda k: valid[k]["fetchedAt"])[-maxEntries:]
+    with _lock:
+        _disk.clear()
+        _disk.update(valid)
+        for key in newest:
+            _entries[key] = {"data": frames[key], "fetchedAt": valid[key]["fetchedAt"]}
+        try:
+            _writeManifest()
+        except OSError as e:
+            print(f"Could not write the cache manifest: {e}")
+    return len(valid)
+
+
+def isFresh(entry, tinterval, now=None):
+    now = time.time() if now is None else now
+    return now - entry["fetchedAt"] < getTtl(tinterval)
+
+
+def getSeries(ticker, tperiod, tinterval, now=None, count=True):
+    """Return the cached series for the key if it is still fresh, otherwise None
+
+    Lookups made on behalf of another key pass count=False to keep the hit rate honest.
+    """
+    if not cacheConfig.get("enabled", True):
+        return None
+
+    key = makeKey(ticker, tperiod, tinterval)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and isFresh(entry, tinterval, now):
+            _entries.move_to_end(key)  # mark as recently used
+            _stats["hits"] += count
+            return entry["data"]
+        diskEntry = _disk.get(key)
+
+    # evicted from memory but still fresh on the persistent volume
+    if diskEntry is not None and isFresh(diskEntry, tinterval, now):
+        data, _ = _loadFromDisk(key)
+        if data is not None:
+            putSeries(*key, data, fetchedAt=diskEntry["fetchedAt"], persist=False)
+            with _lock:
+                _stats["hits"] += count
+                _stats["diskHits"] += 1
+            return data
+
+    with _lock:
+        _stats["misses"] += count
+    return None
+
+
+def widerPeriods(tperiod):
+    """Periods whose series contain the whole tperiod window, widest first"""
+    if tperiod == "ytd":
+        start = periodOrder.index("1y")
+    elif tperiod in periodOrder:
+        start = periodOrder.index(tperiod) + 1
+    else:
+        return []
+    return periodOrder[start:][::-1]
+
+
+def findCovering(ticker, tperiod, tinterval, now=None, allowStale=False):
+    """Return (period, data, fresh) of the widest cached series containing tperiod
+
+    Only series of the same ticker and interval are considered, fresh ones first.
+    With allowStale the widest stale series is returned when none is fresh.
+    Returns None when nothing cached covers the period.
+    """
+    if not cacheConfig.get("enabled", True):
+        return None
+
+    stale = None
+    for widePeriod in widerPeriods(tperiod):
+        key = makeKey(ticker, widePeriod, tinterval)
+        with _lock:
+            entry = _entries.get(key) or _disk.get(key)
+        if entry is None:
+            continue
+        fresh = isFresh(entry, tinterval, now)
+        if not fresh and (not allowStale or stale is not None):
+            continue
+        data = entry.get("data")
+        if data is None:
+            data, _ = _loadFromDisk(key)
+            if data is None:
+                continue
+            putSeries(*key, data, fetchedAt=entry["fetchedAt"], persist=False)
+        if not fresh:
+            stale = (widePeriod, data, False)
+            continue
+        with _lock:
+            _stats["sliceHits"] += 1
+        return widePeriod, data, True
+    return stale
+
+
+def peekSeries(ticker, tperiod, tinterval):
+    """Return the cached series regardless of freshness, without counting a lookup"""
+    key = makeKey(ticker, tperiod, tinterval)
+    with _lock:
+        entry = _entries.get(key)
+    if entry is not None:
+        return entry["data"]
+    data, _ = _loadFromDisk(key)
+    return data
+
+
+def putSeries(ticker, tperiod, tinterval, data, fetchedAt=None, persist=True):
+    if not cacheConfig.get("enabled", True):
+        return
+
+    key = makeKey(ticker, tperiod, tinterval)
+    fetchedAt = time.time() if fetchedAt is None else fetchedAt
+    entry = {"data": data, "fetchedAt": fetchedAt}
+    maxEntries = cacheConfig.get("max_entries", defaultMaxEntries)
+    with _lock:
+        previous = _entries.get(key)
+        if previous is not None and previous.get("state") is not None:
+            # the state of the older version tells refreshFeatures where to continue
+            entry["state"] = previous["state"]
+        _entries[key] = entry
+        _entries.move_to_end(key)
+
+        # drop least recently used series so the pod stays under its memory limit
+        while len(_entries) > maxEntries:
+            _entries.popitem(last=False)
+            _stats["evictions"] += 1
+
+    if persist and _diskEnabled():
+        _persist(key, data, fetchedAt)
+
+
+def diskCopy(ticker, tperiod, tinterval):
+    """(base path, format) of the series' copy on the persistent volume, or None"""
+    with _lock:
+        entry = _disk.get(makeKey(ticker, tperiod, tinterval))
+    if entry is None:
+        return None
+    return entry["path"], entry["format"]
+
+
+def putFeatureState(ticker, tperiod, tinterval, state):
+    """Keep the streaming feature state of a cached series, next to its copy on disk"""
+    key = makeKey(ticker, tperiod, tinterval)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            entry["state"] = state
+        diskEntry = _disk.get(key)
+    if diskEntry is None:
+        return
+
+    path = _statePath(diskEntry["path"])
+    try:
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(state.toDict(), f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        print(f"Could not write {path} to the persistent cache: {e}")
+        return
+    with _lock:
+        # the state counts towards the volume budget of the cached series
+        entries = len(_disk)
+        _evictDisk()
+        if len(_disk) < entries:
+            try:
+                _writeManifest()
+            except OSError as e:
+                print(f"Could not write the cache manifest: {e}")
+
+
+def getFeatureState(ticker, tperiod, tinterval):
+    """Return the stored FeatureState of a cached series, or None
+
+    The state may lag the series after an incremental fetch, its lastTimestamp
+    tells from which bar on it has to be advanced.
+    """
+    key = makeKey(ticker, tperiod, tinterval)
+    with _lock:
+        entry = _entries.get(key)
+        diskEntry = _disk.get(key)
+    if entry is not None and entry.get("state") is not None:
+        return entry["state"]
+    if diskEntry is None:
+        return None
+    try:
+        with open(_statePath(diskEntry["path"]), "r") as f:
+            return features.FeatureState.fromDict(json.load(f))
+    except (OSError, ValueError, KeyError) as e:
+        if not isinstance(e, FileNotFoundError):
+            print(f"Ignoring unreadable feature state of {diskEntry['path']}: {e}")
+        return None
+
+
+def getFeatures(key):
+    """Return the feature frame computed for key, or None"""
+    if not cacheConfig.get("enabled", True):
+        return None
+    with _lock:
+        data = _features.get(key)
+        if data is None:
+            _stats["featureMisses"] += 1
+            return None
+        _features.move_to_end(key)
+        _stats["featureHits"] += 1
+        return data
+
+
+def putFeatures(key, data):
+    if not cacheConfig.get("enabled", True):
+        return
+    maxEntries = cacheConfig.get("feature_entries", defaultFeatureEntries)
+    with _lock:
+        _features[key] = data
+        _features.move_to_end(key)
+        while len(_features) > maxEntries:
+            _features.popitem(last=False)
+
+
+def getDataset(key):
+    """Return the training set built for key, or None"""
+    if not cacheConfig.get("enabled", True):
+        return None
+    with _lock:
+        dataset = _datasets.get(key)
+        if dataset is None:
+            _stats["datasetMisses"] += 1
+            return None
+        _datasets.move_to_end(key)
+        _stats["datasetHits"] += 1
+        return dataset
+
+
+def putDataset(key, dataset):
+    """Keep a training set, key starts with the hash of the frame it was built from"""
+    if not cacheConfig.get("enabled", True):
+        return
+    maxEntries = cacheConfig.get("dataset_entries", defaultDatasetEntries)
+    with _lock:
+        _datasets[key] = dataset
+        _datasets.move_to_end(key)
+        # a multi-horizon fit builds a set per horizon of the same frame, the
+        # frames are evicted whole so the next request finds all of its sets
+        recent = list(dict.fromkeys(k[0] for k in reversed(_datasets)))
+        for frame in recent[maxEntries:]:
+            for k in [k for k in _datasets if k[0] == frame]:
+                del _datasets[k]
+
+
+def invalidate(ticker=None):
+    with _lock:
+        if ticker is None:
+            _entries.clear()
+            _features.clear()
+            _datasets.clear()
+            return
+        for key in [k for k in _entries if k[0] == ticker.upper()]:
+            del _entries[key]
+
+
+def clearCache():
+    """Forget everything in memory, copies on the persistent volume stay on disk"""
+    with _lock:
+        _entries.clear()
+        _disk.clear()
+        _features.clear()
+        _datasets.clear()
+        for name in _stats:
+            _stats[name] = 0
+
+
+def getStats():
+    with _lock:
+        stats = dict(_stats)
+        entries = len(_entries)
+        featureEntries = len(_features)
+        datasetEntries = len(_datasets)
+        diskEntries = len(_disk)
+        diskBytes = sum(_entryBytes(entry) for entry in _disk.values())
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        "hits": stats["hits"],
+        "misses": stats["misses"],
+        "evictions": stats["evictions"],
+        "hitRate": stats["hits"] / lookups if lookups else 0.0,
+        "entries": entries,
+        "diskHits": stats["diskHits"],
+        "sliceHits": stats["sliceHits"],
+        "diskEntries": diskEntries,
+        "diskBytes": diskBytes,
+        "featureHits": stats["featureHits"],
+        "featureMisses": stats["featureMisses"],
+        "featureEntries": featureEntries,
+        "datasetHits": stats["datasetHits"],
+        "datasetMisses": stats["datasetMisses"],
+        "datasetEntries": datasetEntries,
+    }
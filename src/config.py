@@ -44,6 +44,67 @@ def loadConfig():
             ],
             "short_intervals": ["1m", "2m", "5m", "15m", "30m", "60m", "90m", "1h"],
         },
+        "storage": {
+            "format": "npy",
+            "persist": False,
+            "compact": False,
+            "max_frame_bytes": 67108864,
+        },
+        "fetch_many": {"chunk_size": 100, "max_tickers": 500},
+        "cache": {
+            "enabled": True,
+            "max_entries": 32,
+            "incremental": True,
+            "resample": True,
+            "ttl": {},
+            "persistent": True,
+            "dir": "/persistent/cache",
+            "disk_max_bytes": 41943040,
+        },
+        "models": {
+            "registry": True,
+            "dir": "/persistent/models",
+            "max_entries": 32,
+            "max_bytes": 8388608,
+            "warm_start": True,
+            "max_new_fraction": 0.1,
+            "max_updates": 5,
+            "drift_tolerance": 0.05,
+            "multi_horizon": False,
+            "horizons": [1, 5, 10, 20, 30, 60],
+        },
+        "training": {
+            "workers": 1,
+            "timeout": 600,
+            "start_method": "forkserver",
+            "max_jobs_per_worker": 20,
+        },
+        "backtest": {
+            "folds": 12,
+            "step": 21,
+            "min_train": 250,
+            "window": "expanding",
+            "train_rows": 500,
+            "horizons": [1, 5, 10, 20],
+            "dir": "/persistent/backtest",
+            "max_folds": 2000,
+        },
+        "tuning": {
+            "budget_seconds": 600,
+            "candidates": 27,
+            "eta": 3,
+            "min_rounds": 25,
+            "max_rounds": 675,
+            "validation": 0.2,
+            "patience": 20,
+            "days_ahead": 5,
+            "test_size": 0.2,
+        },
+        "resources": {
+            "threads": None,
+            "workers": None,
+            "worker_memory_bytes": 157286400,
+        },
     }
 
 
@@ -1,13 +1,15 @@
 import discord
 from discord.ext import commands
+import asyncio
 import os
-import pandas as pd
-import matplotlib.pyplot as plt
 import io
-from PIL import Image
-import ingestion, preprocessing, processing, utils, model, news
+import ingestion, utils, news, cache, singleflight, storage
+import modelregistry
+import executor
+import resources
 from config import loadConfig, validateArgs
 from utils import getUserPreference, saveUserPreferences
+from pipeline import StockPipeline
 
 # configure Discord bot based on config
 config = loadConfig()
@@ -30,6 +32,31 @@ allowed_args = config.get("allowed_arguments", {})
 allowed_intervals = allowed_args.get("intervals", [])
 allowed_periods = allowed_args.get("periods", [])
 
+# append new bars to stored history instead of downloading the whole period
+incremental_fetch = config.get("cache", {}).get("incremental", True)
+# build 5d/1wk/1mo/3mo bars from cached daily bars, false always downloads them
+resample_fetch = config.get("cache", {}).get("resample", True)
+# write raw/processed series to ./data, the pipeline itself only needs memory
+persist_data = config.get("storage", {}).get("persist", False)
+# float32 frames and downcast volume to fit long intraday histories in the pod limit
+compact_data = config.get("storage", {}).get("compact", False)
+
+
+def makePipeline(ticker, period, interval):
+    return StockPipeline(
+        ticker,
+        period,
+        interval,
+        persist=persist_data,
+        incremental=incremental_fetch,
+        resample=resample_fetch,
+        compact=compact_data,
+    )
+
+
+# limits for bulk downloads
+fetch_many_config = config.get("fetch_many", {})
+
 
 @bot.event
 async def on_ready():
@@ -46,6 +73,9 @@ async def helpStock(ctx):
    - period: 1d, 5d, 1mo, 3mo, 6mo, 1y, 2y, 5y, 10y, ytd, max (default: 1y or user preference)
    - interval: 1m, 2m, 5m, 15m, 30m, 60m, 90m, 1h, 1d, 5d, 1wk, 1mo, 3mo (default: 1d or user preference)
 
+`!fetchMany <tickers> [period] [interval]` - Fetch stock data for many tickers at once
+   - tickers: Comma separated symbols (e.g., AAPL,MSFT,GOOG)
+
 `!stockChart <ticker> [period] [interval]` - Get stock price chart (uses defaults or user preferences)
 
 `!stockFeatures <ticker> [period] [interval]` - Get feature table for stock (uses defaults or user preferences)
@@ -74,6 +104,17 @@ async def helpStock(ctx):
 `!newsEnabled <true/false>` - Toggle news sentiment analysis on/off
 
 `!cleanup [yes/no]` - Clean up memory and optionally delete old files to reduce memory usage
+
+`!memoryReport [ticker] [period] [interval]` - Show memory held by each pipeline stage
+`!cacheStats` - Show hit/miss counts of the stock data cache, trained models and coalesced requests
+`!backtest [ticker] [model] [period] [interval] [window]` - Walk-forward backtest of a model
+   - model: xgboost, lightgbm or prophet (default: xgboost)
+   - window: expanding or sliding (default: expanding)
+`!tune [ticker] [model] [period] [interval] [minutes]` - Search better XGBoost/LightGBM settings for a ticker
+   - minutes: time budget of the search (default: 10)
+`!trainingJobs` - List queued and running training jobs
+`!resources` - Show the CPU and memory limits and the thread counts used for training
+`!cancelTraining <job id>` - Cancel a queued or running training job
     """
     await ctx.send(help_text)
 
@@ -191,11 +232,12 @@ async def fetchStockCmd(ctx, ticker=None, period=None, interval=None):
         os.makedirs("./data/raw", exist_ok=True)
         os.makedirs("./data/processed", exist_ok=True)
 
-        ingestion.fetchStock(ticker, period, interval)
+        # blocking work runs on a worker thread, identical fetches are coalesced
+        data = await asyncio.to_thread(makePipeline(ticker, period, interval).fetch)
         await ctx.send(f"Successfully fetched {ticker} data!")
 
         file = discord.File(
-            f"./data/raw/{ticker}_{period}_{interval}.png",
+            utils.generateStockChart(data, ticker, period, interval),
             filename=f"{ticker}_chart.png",
         )
         await ctx.send(file=file)
@@ -203,6 +245,55 @@ async def fetchStockCmd(ctx, ticker=None, period=None, interval=None):
         await ctx.send(f"Error fetching stock data: {str(e)}")
 
 
+@bot.command(name="fetchMany")
+async def fetchManyCmd(ctx, tickers=None, period=None, interval=None):
+    """Fetch stock data for a comma separated list of tickers"""
+    userId = ctx.author.id
+    period = period or getUserPreference(userId, "period", default_period)
+    interval = interval or getUserPreference(userId, "interval", default_interval)
+
+    if not tickers:
+        await ctx.send(
+            "Please provide a comma separated list of tickers, e.g. `!fetchMany AAPL,MSFT,GOOG 1y 1d`"
+        )
+        return
+
+    # args validation
+    valid, error_msg = validateArgs(period, interval)
+    if not valid:
+        await ctx.send(f"❌ {error_msg}")
+        return
+
+    symbols = [t.strip() for t in tickers.split(",") if t.strip()]
+    maxTickers = fetch_many_config.get("max_tickers", 500)
+    if len(symbols) > maxTickers:
+        await ctx.send(f"❌ At most {maxTickers} tickers can be fetched at once.")
+        return
+
+    await ctx.send(
+        f"Fetching {len(symbols)} tickers for {period} with {interval} interval..."
+    )
+
+    try:
+        results = await asyncio.to_thread(
+            ingestion.fetchMany,
+            symbols,
+            period,
+            interval,
+            chunkSize=fetch_many_config.get("chunk_size", 100),
+            incremental=incremental_fetch,
+            persist=persist_data,
+            compact=compact_data,
+        )
+        failed = [symbol for symbol, data in results.items() if data.empty]
+        message = f"Successfully fetched {len(results) - len(failed)} of {len(results)} tickers."
+        if failed:
+            message += f"\nNo data for: {', '.join(failed)}"
+        await ctx.send(message)
+    except Exception as e:
+        await ctx.send(f"Error fetching stock data: {str(e)}")
+
+
 @bot.command(name="stockChart")
 async def stockChart(ctx, ticker=None, period=None, interval=None):
     """Send stock chart for the given ticker"""
@@ -219,9 +310,10 @@ async def stockChart(ctx, ticker=None, period=None, interval=None):
 
     try:
         await ctx.send(f"Fetching latest {ticker} data...")
-        ingestion.fetchStock(ticker, period, interval)
+        # blocking work runs on a worker thread, identical fetches are coalesced
+        data = await asyncio.to_thread(makePipeline(ticker, period, interval).fetch)
 
-        chartPath = f"./data/raw/{ticker}_{period}_{interval}.png"
+        chartPath = utils.generateStockChart(data, ticker, period, interval)
         file = discord.File(chartPath, filename=f"{ticker}_chart.png")
         await ctx.send(file=file)
     except Exception as e:
@@ -244,17 +336,11 @@ async def stockFeatures(ctx, ticker=None, period=None, interval=None):
 
     try:
         await ctx.send(f"Fetching latest {ticker} data...")
-        ingestion.fetchStock(ticker, period, interval)
-
-        raw_path = f"./data/raw/{ticker}_{period}_{interval}.csv"
-        processed_path = f"./data/processed/{ticker}_{period}_{interval}.csv"
+        stockPipeline = makePipeline(ticker, period, interval)
+        await asyncio.to_thread(stockPipeline.fetch)
 
         await ctx.send("Calculating features...")
-        data = utils.loadData(raw_path)
-        data = preprocessing.cleanData(data, ticker, period, interval)
-        data = processing.addFeatures(data, ticker, period, interval)
-
-        data = pd.read_csv(processed_path)
+        data = await asyncio.to_thread(stockPipeline.withFeatures)
 
         # last 10 rows for display
         last_rows = data.tail(10)
@@ -267,8 +353,7 @@ async def stockFeatures(ctx, ticker=None, period=None, interval=None):
         if len(features_str) > 2000:
             # in case too long for Discord, send as a CSV file
             buffer = io.StringIO()
-            last_rows.to_csv(buffer, index=False)
-            buffer.seek(0)
+            storage.exportCsv(last_rows, buffer)
 
             file = discord.File(
                 fp=io.BytesIO(buffer.getvalue().encode()),
@@ -319,31 +404,18 @@ async def predictXgboost(
             raise ValueError("test_size must be between 0 and 1")
 
         await ctx.send(f"Fetching latest {ticker} data...")
-        ingestion.fetchStock(ticker, period, interval)
-
-        raw_path = f"./data/raw/{ticker}_{period}_{interval}.csv"
-        processed_path = f"./data/processed/{ticker}_{period}_{interval}.csv"
+        stockPipeline = makePipeline(ticker, period, interval)
+        await asyncio.to_thread(stockPipeline.fetch)
 
         await ctx.send("Processing data with features...")
-        data = utils.loadData(raw_path)
-        data = preprocessing.cleanData(data, ticker, period, interval)
-        data = processing.addFeatures(data, ticker, period, interval)
-
-        data = pd.read_csv(processed_path)
+        data = await asyncio.to_thread(stockPipeline.withFeatures)
         # prediction start
         shuffleMsg = ", with shuffled data" if shuffleData else ""
         await ctx.send(
             f"Running XGBoost prediction for {ticker}, {daysAhead} days ahead{shuffleMsg}..."
         )
-        result = model.trainXGBoost(
-            data,
-            ticker,
-            period,
-            interval,
-            daysAhead,
-            test_size,
-            return_result=True,
-            shuffle=shuffleData,
+        result = await asyncio.to_thread(
+            stockPipeline.train, "xgboost", daysAhead, test_size, shuffle=shuffleData
         )
 
         # pred message
@@ -430,31 +502,18 @@ async def predictLightgbm(
             raise ValueError("test_size must be between 0 and 1")
 
         await ctx.send(f"Fetching latest {ticker} data...")
-        ingestion.fetchStock(ticker, period, interval)
-
-        raw_path = f"./data/raw/{ticker}_{period}_{interval}.csv"
-        processed_path = f"./data/processed/{ticker}_{period}_{interval}.csv"
+        stockPipeline = makePipeline(ticker, period, interval)
+        await asyncio.to_thread(stockPipeline.fetch)
 
         await ctx.send("Processing data with features...")
-        data = utils.loadData(raw_path)
-        data = preprocessing.cleanData(data, ticker, period, interval)
-        data = processing.addFeatures(data, ticker, period, interval)
-
-        data = pd.read_csv(processed_path)
+        data = await asyncio.to_thread(stockPipeline.withFeatures)
         # run prediction
         shuffleMsg = ", with shuffled data" if shuffleData else ""
         await ctx.send(
             f"Running LightGBM prediction for {ticker}, {daysAhead} days ahead{shuffleMsg}..."
         )
-        result = model.trainLightGBM(
-            data,
-            ticker,
-            period,
-            interval,
-            daysAhead,
-            test_size,
-            return_result=True,
-            shuffle=shuffleData,
+        result = await asyncio.to_thread(
+            stockPipeline.train, "lightgbm", daysAhead, test_size, shuffle=shuffleData
         )
 
         # output message
@@ -533,24 +592,18 @@ async def predictProphet(
             raise ValueError("test_size must be between 0 and 1")
 
         await ctx.send(f"Fetching latest {ticker} data...")
-        ingestion.fetchStock(ticker, period, interval)
-
-        raw_path = f"./data/raw/{ticker}_{period}_{interval}.csv"
-        processed_path = f"./data/processed/{ticker}_{period}_{interval}.csv"
+        stockPipeline = makePipeline(ticker, period, interval)
+        await asyncio.to_thread(stockPipeline.fetch)
 
         await ctx.send("Processing data with features...")
-        data = utils.loadData(raw_path)
-        data = preprocessing.cleanData(data, ticker, period, interval)
-        data = processing.addFeatures(data, ticker, period, interval)
-
-        data = pd.read_csv(processed_path)
+        data = await asyncio.to_thread(stockPipeline.withFeatures)
 
         # run prediction
         await ctx.send(
             f"Running Prophet prediction for {ticker}, {daysAhead} days ahead..."
         )
-        result = model.trainProphet(
-            data, ticker, period, interval, daysAhead, test_size, return_result=True
+        result = await asyncio.to_thread(
+            stockPipeline.train, "prophet", daysAhead, test_size
         )
 
         # output message
@@ -722,6 +775,195 @@ async def cleanup(ctx, delete_files="no"):
     await ctx.send("Collection complete! Memory has been freed.")
 
 
+@bot.command(name="memoryReport")
+async def memoryReport(ctx, ticker=None, period=None, interval=None):
+    """Show how much memory each pipeline stage of a stock holds"""
+    userId = ctx.author.id
+    ticker = ticker or getUserPreference(userId, "ticker", default_ticker)
+    period = period or getUserPreference(userId, "period", default_period)
+    interval = interval or getUserPreference(userId, "interval", default_interval)
+
+    valid, error_msg = validateArgs(period, interval)
+    if not valid:
+        await ctx.send(f"❌ {error_msg}")
+        return
+
+    try:
+        stockPipeline = makePipeline(ticker, period, interval)
+        data = await asyncio.to_thread(stockPipeline.withFeatures)
+        report = stockPipeline.memoryReport()
+        lines = [f"{stage}: {size / 1e6:.2f} MB" for stage, size in report.items()]
+        mode = "compact (float32)" if compact_data else "full (float64)"
+        await ctx.send(
+            f"**{ticker} {period} {interval}** - {len(data)} rows, {mode}\n"
+            + "\n".join(lines)
+        )
+    except Exception as e:
+        await ctx.send(f"Error building memory report: {str(e)}")
+
+
+@bot.command(name="backtest")
+async def backtestCommand(
+    ctx, ticker=None, modelName="xgboost", period=None, interval=None, window=None
+):
+    """Walk-forward backtest of a model, errors per days-ahead horizon"""
+    userId = ctx.author.id
+    ticker = ticker or getUserPreference(userId, "ticker", default_ticker)
+    period = period or getUserPreference(userId, "period", default_period)
+    interval = interval or getUserPreference(userId, "interval", default_interval)
+
+    valid, error_msg = validateArgs(period, interval)
+    if not valid:
+        await ctx.send(f"❌ {error_msg}")
+        return
+    if modelName.lower() not in ("xgboost", "lightgbm", "prophet"):
+        await ctx.send("❌ Model must be xgboost, lightgbm or prophet")
+        return
+    if window not in (None, "expanding", "sliding"):
+        await ctx.send("❌ Window must be expanding or sliding")
+        return
+
+    try:
+        await ctx.send(f"Fetching latest {ticker} data...")
+        stockPipeline = makePipeline(ticker, period, interval)
+        data = await asyncio.to_thread(stockPipeline.withFeatures)
+
+        await ctx.send(f"Backtesting {modelName} on {len(data)} bars of {ticker}...")
+        # the model libraries are only loaded into the bot by a backtest
+        import backtest
+
+        result = await asyncio.to_thread(
+            backtest.runBacktest, data, modelName, window=window
+        )
+        rows = [
+            f"{horizon:>7} {row['rmse']:>9.3f} {row['mae']:>9.3f} "
+            f"{row['mape']:>7.2%} {row['direction']:>9.1%} {row['predictions']:>6}"
+            for horizon, row in result["table"].items()
+        ]
+        await ctx.send(
+            f"**{result['model']} walk-forward backtest for {ticker} {period} {interval}**\n"
+            f"{result['folds']} {result['window']} folds, {result['computed']} computed, "
+            f"the rest reused\n```\n"
+            f"horizon      rmse       mae    mape direction  preds\n"
+            + "\n".join(rows)
+            + "\n```"
+        )
+    except Exception as e:
+        await ctx.send(f"Error running backtest: {str(e)}")
+
+
+@bot.command(name="tune")
+async def tune(
+    ctx, ticker=None, modelName="xgboost", period=None, interval=None, minutes=None
+):
+    """Tune the hyperparameters of a tree model for a ticker and interval"""
+    userId = ctx.author.id
+    ticker = ticker or getUserPreference(userId, "ticker", default_ticker)
+    period = period or getUserPreference(userId, "period", default_period)
+    interval = interval or getUserPreference(userId, "interval", default_interval)
+
+    valid, error_msg = validateArgs(period, interval)
+    if not valid:
+        await ctx.send(f"❌ {error_msg}")
+        return
+    if modelName.lower() not in ("xgboost", "lightgbm"):
+        await ctx.send("❌ Model must be xgboost or lightgbm")
+        return
+
+    try:
+        budget = float(minutes) * 60 if minutes is not None else None
+        await ctx.send(f"Fetching latest {ticker} data...")
+        stockPipeline = makePipeline(ticker, period, interval)
+        await asyncio.to_thread(stockPipeline.withFeatures)
+
+        await ctx.send(f"Tuning {modelName} for {ticker} {interval}...")
+        result = await asyncio.to_thread(stockPipeline.tune, modelName, budget)
+        used = (
+            "predictions now use it"
+            if result["rmse"] < result["defaultRmse"]
+            else "keeping the default settings"
+        )
+        settings = ", ".join(
+            f"{name}={value:.4g}" if isinstance(value, float) else f"{name}={value}"
+            for name, value in result["params"].items()
+            if name in result["searched"]
+        )
+        await ctx.send(
+            f"**{modelName} tuned for {ticker} {interval}** in {result['seconds']:.0f}s, "
+            f"{result['fits']} fits of {result['candidates']} candidates\n"
+            f"- Test RMSE: {result['rmse']:.4f} (default {result['defaultRmse']:.4f}), {used}\n"
+            f"- Rounds: {result['rounds']}, {settings}"
+        )
+    except Exception as e:
+        await ctx.send(f"Error tuning model: {str(e)}")
+
+
+@bot.command(name="cacheStats")
+async def cacheStats(ctx):
+    """Show hit/miss counts of the stock data cache"""
+    stats = cache.getStats()
+    models = modelregistry.getStats()
+    flights = singleflight.getStats()
+    drift = ""
+    if models["drift"] is not None:
+        drift = f", continued models {models['drift']:+.1%} rmse vs refits"
+    await ctx.send(
+        f"Cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hitRate']:.1%} hit rate), "
+        f"{stats['entries']} series cached, {stats['evictions']} evicted\n"
+        f"Disk: {stats['diskEntries']} series, {stats['diskBytes'] / 1e6:.1f} MB, "
+        f"{stats['diskHits']} warm loads, {stats['sliceHits']} served from longer periods\n"
+        f"Features: {stats['featureHits']} reused, {stats['featureMisses']} computed\n"
+        f"Training sets: {stats['datasetHits']} reused, {stats['datasetMisses']} built\n"
+        f"Models: {models['hits']} reused, {models['misses']} trained, "
+        f"{models['entries']} stored ({models['bytes'] / 1e6:.1f} MB), "
+        f"{models['warmStarts']} warm starts, {models['refits']} full fits{drift}\n"
+        f"Coalesced: {flights['merged']} requests joined {flights['executions']} computations"
+    )
+
+
+@bot.command(name="trainingJobs")
+async def trainingJobs(ctx):
+    """List queued and running training jobs"""
+    stats = executor.getStats()
+    lines = [
+        f"#{jobId} {description}: {state}" + (f" for {seconds:.0f}s" if seconds else "")
+        for jobId, description, state, seconds in executor.listJobs()
+    ]
+    await ctx.send(
+        f"Training workers: {stats['workers']}, {stats['completed']} jobs done, "
+        f"{stats['failed']} failed, {stats['timeouts']} timed out, "
+        f"{stats['crashed']} crashed, {stats['cancelled']} cancelled\n"
+        + ("\n".join(lines) if lines else "No training jobs running")
+    )
+
+
+@bot.command(name="resources")
+async def resourcesCommand(ctx):
+    """Show the pod limits and the effective worker and thread counts"""
+    limits = resources.settings()
+    if limits is None:
+        await ctx.send("Resource limits were not applied, libraries use every core")
+        return
+    quota = limits["cpuQuota"]
+    memory = limits["memoryLimit"]
+    await ctx.send(
+        f"CPU quota: {f'{quota:g} cores' if quota else 'none'} "
+        f"({limits['hostCpus']} host CPUs)\n"
+        f"Memory limit: {f'{memory / 2**20:.0f} MiB' if memory else 'none'}\n"
+        f"Training workers: {limits['workers']}, "
+        f"threads per job: {limits['threads']} (from {limits['source']})"
+    )
+
+
+@bot.command(name="cancelTraining")
+async def cancelTraining(ctx, jobId: int):
+    """Cancel a queued or running training job"""
+    if executor.cancel(jobId):
+        await ctx.send(f"Cancelling training job #{jobId}")
+    else:
+        await ctx.send(f"No queued or running training job #{jobId}")
+
+
 def runDiscordBot(token=None):
     """Run the Discord bot with the given token or from config"""
     if token is None:
@@ -0,0 +1,296 @@
+import itertools
+import os
+import multiprocessing
+import multiprocessing.connection
+import threading
+import time
+from concurrent.futures import Future
+from config import loadConfig
+
+# the pod has a fraction of a core, one fit at a time keeps the bot responsive
+defaultWorkers = 1
+defaultTimeout = 600  # seconds
+# a worker is replaced after this many jobs, so leaks in the model libraries stay bounded
+defaultMaxJobsPerWorker = 20
+# how often a waiting job checks for cancellation
+pollInterval = 0.2
+# imported by the fork server, so a worker starts with the model libraries loaded
+preloadModules = ["model", "pipeline", "backtest", "tuning"]
+
+executorConfig = loadConfig().get("training", {})
+
+# job id -> Job, queued and running
+_jobs = {}
+# workers waiting for their next job
+_idle = []
+_ids = itertools.count(1)
+_stats = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "cancelled": 0,
+    "crashed": 0,
+    "workersStarted": 0,
+}
+_lock = threading.Lock()
+_slots = None
+_context = None
+
+
+class JobTimeout(TimeoutError):
+    pass
+
+
+class WorkerCrashed(RuntimeError):
+    pass
+
+
+class JobCancelled(RuntimeError):
+    pass
+
+
+class Job:
+    """A training job, result() blocks until the worker process is done"""
+
+    def __init__(self, jobId, description, timeout):
+        self.id = jobId
+        self.description = description
+        self.timeout = timeout
+        self.future = Future()
+        self.process = None
+        self.startedAt = None
+        self._cancel = threading.Event()
+
+    @property
+    def state(self):
+        if self.future.done():
+            return "done"
+        return "running" if self.startedAt is not None else "queued"
+
+    def cancel(self):
+        """Stop the job, a running worker is killed"""
+        self._cancel.set()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+def workerCount():
+    """Worker processes, 0 runs jobs inline in the calling thread"""
+    return int(executorConfig.get("workers", defaultWorkers))
+
+
+def _getContext():
+    # caller holds _lock
+    global _context, _slots
+    if _context is None:
+        method = executorConfig.get("start_method", "forkserver")
+        _context = multiprocessing.get_context(method)
+        if method == "forkserver":
+            # the fork server runs python -c and only finds these modules through
+            # PYTHONPATH, its sys_path argument is ignored before python 3.12
+            srcDir = os.path.dirname(os.path.abspath(__file__))
+            paths = os.environ.get("PYTHONPATH", "").split(os.pathsep)
+            if srcDir not in paths:
+                os.environ["PYTHONPATH"] = os.pathsep.join(
+                    [srcDir] + [p for p in paths if p]
+                )
+            _context.set_forkserver_preload(preloadModules)
+        _slots = threading.BoundedSemaphore(max(workerCount(), 1))
+    return _context
+
+
+class _Worker:
+    """A worker process that runs jobs one after another, keeping its caches"""
+
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self.jobs = 0
+
+    def stop(self):
+        self.connection.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+
+def _serve(connection):
+    # runs in the worker process until the bot closes the pipe
+    while True:
+        try:
+            fn, args, kwargs = connection.recv()
+        except EOFError:
+            return
+        try:
+            message = ("ok", fn(*args, **kwargs))
+        except BaseException as e:
+            message = ("error", e)
+        try:
+            connection.send(message)
+        except Exception as e:  # the result or exception could not be pickled
+            connection.send(("error", RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+def _takeWorker(context):
+    with _lock:
+        while _idle:
+            worker = _idle.pop()
+            if worker.process.is_alive():
+                return worker
+            worker.stop()
+        _stats["workersStarted"] += 1
+    return _Worker(context)
+
+
+def _releaseWorker(worker):
+    worker.jobs += 1
+    maxJobs = executorConfig.get("max_jobs_per_worker", defaultMaxJobsPerWorker)
+    with _lock:
+        if worker.jobs < maxJobs and len(_idle) < max(workerCount(), 1):
+            _idle.append(worker)
+            return
+    worker.stop()
+
+
+def _finish(job, outcome, value):
+    with _lock:
+        _jobs.pop(job.id, None)
+        _stats[outcome] += 1
+    if outcome == "completed":
+        job.future.set_result(value)
+    else:
+        job.future.set_exception(value)
+
+
+def _supervise(job, fn, args, kwargs):
+    context = _context
+    # wait for a free worker, a queued job can be cancelled meanwhile
+    while not _slots.acquire(timeout=pollInterval):
+        if job._cancel.is_set():
+            _finish(job, "cancelled", JobCancelled(f"{job.description} was cancelled"))
+            return
+    try:
+        job.startedAt = time.monotonic()
+        try:
+            worker = _takeWorker(context)
+        except Exception as e:
+            _finish(job, "failed", e)
+            return
+        job.process = worker.process
+        try:
+            worker.connection.send((fn, args, kwargs))
+        except Exception as e:  # fn or its arguments could not be pickled
+            _releaseWorker(worker)
+            _finish(job, "failed", e)
+            return
+
+        outcome, value = None, None
+        deadline = job.startedAt + job.timeout if job.timeout else None
+        while outcome is None:
+            ready = multiprocessing.connection.wait(
+                [worker.connection, worker.process.sentinel], pollInterval
+            )
+            if worker.connection in ready:
+                try:
+                    status, value = worker.connection.recv()
+                    outcome = "completed" if status == "ok" else "failed"
+                except EOFError:  # exited without sending anything
+                    ready = [worker.process.sentinel]
+            if outcome is None and worker.process.sentinel in ready:
+                worker.process.join()
+                outcome = "crashed"
+                value = WorkerCrashed(
+                    f"{job.description} worker died "
+                    f"(exit code {worker.process.exitcode}), "
+                    "e.g. killed for running out of memory"
+                )
+            elif outcome is None and job._cancel.is_set():
+                outcome = "cancelled"
+                value = JobCancelled(f"{job.description} was cancelled")
+            elif outcome is None and deadline and time.monotonic() > deadline:
+                outcome = "timeouts"
+                value = JobTimeout(
+                    f"{job.description} took longer than {job.timeout:g} seconds"
+                )
+
+        if outcome in ("completed", "failed"):
+            _releaseWorker(worker)
+        else:  # a worker busy with a stopped job or a dead one is not reused
+            worker.stop()
+    finally:
+        _slots.release()
+    _finish(job, outcome, value)
+
+
+def submit(fn, *args, description=None, timeout=None, **kwargs):
+    """Run fn(*args, **kwargs) in a worker process, returns its Job
+
+    fn, its arguments and its result are pickled between the processes, frames
+    travel in memory. At most workerCount() jobs run at once, the rest queue.
+    Workers stay up between jobs, so their caches of training matrices and loaded
+    models carry over, and are replaced after training.max_jobs_per_worker jobs. A
+    job that runs over timeout seconds (training.timeout by default) is killed with
+    its worker, as is a cancelled one. A worker dying, even from a segfault or the
+    OOM killer, only fails its own job with WorkerCrashed.
+    """
+    if timeout is None:
+        timeout = executorConfig.get("timeout", defaultTimeout)
+    description = description or getattr(fn, "__name__", "job")
+    with _lock:
+        _getContext()
+        job = Job(next(_ids), description, timeout)
+        _jobs[job.id] = job
+        _stats["submitted"] += 1
+    thread = threading.Thread(
+        target=_supervise, args=(job, fn, args, kwargs), daemon=True
+    )
+    thread.start()
+    return job
+
+
+def run(fn, *args, description=None, timeout=None, **kwargs):
+    """Run fn in a worker process and wait for its result, inline with 0 workers"""
+    if workerCount() <= 0:
+        return fn(*args, **kwargs)
+    job = submit(fn, *args, description=description, timeout=timeout, **kwargs)
+    return job.result()
+
+
+def cancel(jobId):
+    """Cancel a queued or running job, False when there is no such job"""
+    with _lock:
+        job = _jobs.get(jobId)
+    if job is None:
+        return False
+    job.cancel()
+    return True
+
+
+def listJobs():
+    """(id, description, state, seconds running) of queued and running jobs"""
+    with _lock:
+        jobs = list(_jobs.values())
+    now = time.monotonic()
+    return [
+        (
+            job.id,
+            job.description,
+            job.state,
+            now - job.startedAt if job.startedAt is not None else 0.0,
+        )
+        for job in jobs
+    ]
+
+
+def getStats():
+    with _lock:
+        stats = dict(_stats)
+        stats["running"] = sum(1 for job in _jobs.values() if job.state == "running")
+        stats["queued"] = sum(1 for job in _jobs.values() if job.state == "queued")
+        stats["idle"] = len(_idle)
+    stats["workers"] = workerCount()
+    return stats
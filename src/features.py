@@ -0,0 +1,617 @@
+import hashlib
+import inspect
+import math
+import numpy
+from collections import deque
+from scipy.signal import lfilter
+
+# columns added by default, in the order processing.addFeatures always produced them
+featureColumns = [
+    "priceChange",
+    "ma10",
+    "ma50",
+    "ema10",
+    "ema50",
+    "macd",
+    "macdSignal",
+    "volitStd1w",
+    "volitStd1mo",
+    "bollingerUp",
+    "bollingerDown",
+    "volma10",
+    "timeFeature",
+    "RSI",
+]
+# bump when feature output changes outside the registered formulas and kernels below
+featureVersion = 1
+# rows per block of the rolling sums, bounds their rounding error on long series
+blockRows = 16384
+
+
+def spanAlpha(span):
+    return 2.0 / (span + 1.0)
+
+
+def comAlpha(com):
+    return 1.0 / (1.0 + com)
+
+
+def ewm(values, alpha, initial=None):
+    """Exponential moving average along the last axis, same as pandas ewm(adjust=False)
+
+    initial is the average before the first value, to continue an earlier block.
+    """
+    values = numpy.asarray(values)
+    # y[0] = x[0], then y[t] = alpha * x[t] + (1 - alpha) * y[t - 1]
+    previous = values[..., :1] if initial is None else numpy.asarray(initial)[..., None]
+    zi = (1.0 - alpha) * previous
+    out, _ = lfilter([alpha], [1.0, alpha - 1.0], values, axis=-1, zi=zi)
+    return out.astype(values.dtype, copy=False)
+
+
+def _prefixSums(values):
+    sums = numpy.cumsum(values, axis=-1)
+    return numpy.concatenate([numpy.zeros_like(sums[..., :1]), sums], axis=-1)
+
+
+def rollingMoments(values, windows, withStd=False):
+    """Rolling means and sample stds along the last axis, NaN until a full window is valid
+
+    Returns {window: (mean, std)}, std is None unless withStd is set. All windows
+    share one pass of prefix sums per block of rows. Each block is shifted by its
+    own mean first so squares of large prices do not cancel out.
+    """
+    values = numpy.asarray(values)
+    n = values.shape[-1]
+    maxWindow = max(windows)
+    results = {}
+    for window in windows:
+        mean = numpy.full(values.shape, numpy.nan, dtype=values.dtype)
+        std = (
+            numpy.full(values.shape, numpy.nan, dtype=values.dtype) if withStd else None
+        )
+        results[window] = (mean, std)
+
+    for start in range(0, n, blockRows):
+        stop = min(start + blockRows, n)
+        lead = min(
+            start, maxWindow - 1
+        )  # rows before the block the windows reach back to
+        chunk = values[..., start - lead : stop]
+        valid = ~numpy.isnan(chunk)
+        complete = valid.all()
+        if complete:
+            shift = chunk.mean(axis=-1, keepdims=True)
+            centered = chunk - shift
+        else:
+            count = numpy.maximum(valid.sum(axis=-1, keepdims=True), 1)
+            shift = numpy.where(valid, chunk, 0).sum(axis=-1, keepdims=True) / count
+            centered = numpy.where(valid, chunk - shift, 0)
+        sums = _prefixSums(centered)
+        squares = _prefixSums(centered * centered) if withStd else None
+        counts = None if complete else _prefixSums(valid)
+
+        for window, (mean, std) in results.items():
+            first = max(start, window - 1)  # first row of the block with a full window
+            if first >= stop:
+                continue
+            hi = slice(first - start + lead + 1, stop - start + lead + 1)
+            lo = slice(hi.start - window, hi.stop - window)
+            windowSums = sums[..., hi] - sums[..., lo]
+            blockMean = windowSums / window + shift
+            if withStd:
+                var = squares[..., hi] - squares[..., lo]
+                var = (var - windowSums * windowSums / window) / (window - 1)
+                blockStd = numpy.sqrt(numpy.maximum(var, 0))
+            if not complete:
+                full = counts[..., hi] - counts[..., lo] == window
+                blockMean = numpy.where(full, blockMean, numpy.nan)
+                if withStd:
+                    blockStd = numpy.where(full, blockStd, numpy.nan)
+            mean[..., first:stop] = blockMean
+            if withStd:
+                std[..., first:stop] = blockStd
+    return results
+
+
+def pctChange(values):
+    out = numpy.full(values.shape, numpy.nan, dtype=values.dtype)
+    out[..., 1:] = values[..., 1:] / values[..., :-1] - 1
+    return out
+
+
+def _barDelta(close):
+    # the first bar counts as no change
+    delta = numpy.zeros_like(close)
+    delta[..., 1:] = numpy.diff(close, axis=-1)
+    return delta
+
+
+def _rsi(avgGain, avgLoss):
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return 100 - (100 / (1 + avgGain / avgLoss))
+
+
+def _timeFeature(close):
+    # 0..1 over each series' own bars, panel rows shorter than the block end in NaN padding
+    bars = (~numpy.isnan(close)).sum(axis=-1, keepdims=True)
+    steps = numpy.arange(close.shape[-1], dtype=close.dtype)
+    return numpy.where(steps < bars, steps / numpy.maximum(bars - 1, 1), numpy.nan)
+
+
+def cumulative(values, initial=None):
+    """Running sum along the last axis, initial is the sum before the first value"""
+    out = numpy.cumsum(values, axis=-1)
+    if initial is not None:
+        out += numpy.asarray(initial)[..., None]
+    return out
+
+
+# raw columns the registered features are computed from
+inputColumns = ("Close", "Volume")
+# feature name -> spec from rolling, ema, running or derived
+registry = {}
+
+
+def rolling(source, window, stat="mean"):
+    return {"kind": "rolling", "inputs": (source,), "window": window, "stat": stat}
+
+
+def ema(source, alpha):
+    return {"kind": "ewm", "inputs": (source,), "alpha": alpha}
+
+
+def running(source):
+    return {"kind": "cumsum", "inputs": (source,)}
+
+
+def derived(inputs, compute, window=0):
+    """compute gets the input arrays in order, window is how many more leading rows it leaves NaN"""
+    return {
+        "kind": "derived",
+        "inputs": tuple(inputs),
+        "compute": compute,
+        "window": window,
+    }
+
+
+def register(name, spec):
+    """Add a feature, it can be requested by name once its inputs are registered"""
+    registry[name] = spec
+    _versions.clear()
+
+
+# tuple of feature names -> spec version, filled by specVersion
+_versions = {}
+
+
+def _source(fn):
+    try:
+        return inspect.getsource(fn)
+    except (TypeError, OSError):  # numpy ufuncs and code typed into a shell
+        return getattr(fn, "__name__", repr(fn))
+
+
+def specVersion(names):
+    """Stamp of the definitions behind the named features, changes with any formula
+
+    Covers each feature in the subgraph (its spec and the source of its compute
+    function) and the source of the shared kernels.
+    """
+    names = tuple(names)
+    if names not in _versions:
+        digest = hashlib.sha1(str(featureVersion).encode())
+        for kernel in (ewm, cumulative, rollingMoments, _prefixSums, pctChange):
+            digest.update(_source(kernel).encode())
+        for name in resolve(names):
+            spec = registry[name]
+            fields = {k: v for k, v in spec.items() if k != "compute"}
+            digest.update(f"{name}:{sorted(fields.items())}".encode())
+            if "compute" in spec:
+                digest.update(_source(spec["compute"]).encode())
+        _versions[names] = digest.hexdigest()[:16]
+    return _versions[names]
+
+
+def resolve(names):
+    """The requested features and everything they depend on, dependencies first"""
+    order = []
+    done = set()
+    visiting = set()
+
+    def visit(name):
+        if name in done or name in inputColumns:
+            return
+        if name not in registry:
+            raise ValueError(f"Unknown feature: {name}")
+        if name in visiting:
+            raise ValueError(f"Feature {name} depends on itself")
+        visiting.add(name)
+        for dependency in registry[name]["inputs"]:
+            visit(dependency)
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+
+    for name in names:
+        visit(name)
+    return order
+
+
+def warmup(names):
+    """Leading rows the named features leave NaN, the rows addFeatures drops"""
+    rows = dict.fromkeys(inputColumns, 0)
+    for name in resolve(names):
+        spec = registry[name]
+        base = max(rows[i] for i in spec["inputs"])
+        if spec["kind"] == "rolling":
+            rows[name] = base + spec["window"] - 1
+        else:
+            rows[name] = base + spec.get("window", 0)
+    return max((rows[name] for name in names), default=0)
+
+
+def overlap(names):
+    """Input rows each block of evaluateBlock repeats from the one before
+
+    One more than the warm-up, bar to bar features like delta read the previous bar
+    even where they leave no NaN.
+    """
+    return warmup(names) + 1
+
+
+def evaluate(inputs, names):
+    """Compute the named features from input arrays, only their part of the graph
+
+    inputs maps inputColumns to float arrays (1-D, or one series per row).
+    Returns name -> array in the order of names.
+    """
+    values = _evaluate(dict(inputs), resolve(names))
+    return {name: values[name] for name in names}
+
+
+# kinds whose value depends on every earlier bar, not just a window of them
+recursiveKinds = ("ewm", "cumsum")
+
+
+def evaluateBlock(inputs, names, carry=None):
+    """Continue the named features over the next block of a long series
+
+    inputs start with the last overlap(names) input rows of the previous block
+    (fewer only while the series is still shorter), carry is what the call for the
+    previous block returned and None for the first one. Returns (name -> array,
+    carry); values over the repeated rows are the same as in the previous block.
+    """
+    order = resolve(names)
+    repeated = overlap(names)
+    values = _evaluate(dict(inputs), order, carry)
+    # recursive features keep their values over the rows the next block repeats,
+    # and their last value to continue from
+    carry = {
+        name: (
+            values[name][..., max(values[name].shape[-1] - repeated, 0) :],
+            values[name][..., -1],
+        )
+        for name in order
+        if registry[name]["kind"] in recursiveKinds
+    }
+    return {name: values[name] for name in names}, carry
+
+
+def _recurse(spec, source, initial=None):
+    if spec["kind"] == "ewm":
+        return ewm(source, spec["alpha"], initial)
+    return cumulative(source, initial)
+
+
+def _evaluate(values, order, carry=None):
+    for name in order:
+        if name in values:
+            continue
+        spec = registry[name]
+        source = values[spec["inputs"][0]]
+        if spec["kind"] == "rolling":
+            # every window needed over the same source shares one pass of prefix sums
+            group = [
+                n
+                for n in order
+                if registry[n]["kind"] == "rolling"
+                and registry[n]["inputs"] == spec["inputs"]
+            ]
+            windows = sorted({registry[n]["window"] for n in group})
+            withStd = any(registry[n]["stat"] == "std" for n in group)
+            moments = rollingMoments(source, windows, withStd)
+            for n in group:
+                mean, std = moments[registry[n]["window"]]
+                values[n] = std if registry[n]["stat"] == "std" else mean
+        elif spec["kind"] in recursiveKinds:
+            if not carry or name not in carry:
+                values[name] = _recurse(spec, source)
+                continue
+            # the repeated rows keep the previous block's values, which also holds
+            # where their inputs differ (the first repeated bar has no earlier close)
+            repeated, last = carry[name]
+            offset = repeated.shape[-1]
+            out = numpy.empty(source.shape, dtype=numpy.result_type(source, repeated))
+            out[..., :offset] = repeated
+            out[..., offset:] = _recurse(spec, source[..., offset:], last)
+            values[name] = out
+        else:
+            values[name] = spec["compute"](*(values[i] for i in spec["inputs"]))
+    return values
+
+
+def computeFeatures(close, volume, names=None):
+    """Indicator columns for a close and volume series (or rows of series)
+
+    names defaults to featureColumns. Rows are not dropped yet.
+    """
+    inputs = {"Close": numpy.asarray(close), "Volume": numpy.asarray(volume)}
+    return evaluate(inputs, featureColumns if names is None else names)
+
+
+def computePanel(close, volume, names=None):
+    """Features for many tickers at once from (ticker x time) blocks on a shared calendar
+
+    NaN closes mark dates a ticker has no bar, before its listing or on its own
+    holidays. Each row is packed onto its own bars before the single pass, so every
+    ticker gets the same values as computeFeatures on its series alone. Returns
+    name -> (ticker x time) array, NaN wherever the ticker has no bar.
+    """
+    close = numpy.asarray(close, dtype=numpy.float64)
+    volume = numpy.asarray(volume, dtype=numpy.float64)
+    names = featureColumns if names is None else names
+    valid = ~numpy.isnan(close)
+    if valid.all():
+        return evaluate({"Close": close, "Volume": volume}, names)
+    # stable sort moves each row's bars to the front in time order, padding to the back
+    order = numpy.argsort(~valid, axis=1, kind="stable")
+    width = int(valid.sum(axis=1).max(initial=0))
+    order = order[:, :width]
+    packed = evaluate(
+        {
+            "Close": numpy.take_along_axis(close, order, axis=1),
+            "Volume": numpy.take_along_axis(volume, order, axis=1),
+        },
+        names,
+    )
+
+    panel = {}
+    for name, values in packed.items():
+        out = numpy.full(close.shape, numpy.nan)
+        numpy.put_along_axis(out, order, values, axis=1)
+        out[~valid] = numpy.nan  # padding was scattered onto dates without a bar
+        panel[name] = out
+    return panel
+
+
+register("returns", derived(["Close"], pctChange, window=1))
+register("priceChange", derived(["returns"], lambda returns: returns * 100))
+register("ma10", rolling("Close", 10))
+register("ma20", rolling("Close", 20))
+register("std20", rolling("Close", 20, "std"))
+register("ma50", rolling("Close", 50))
+register("ema10", ema("Close", spanAlpha(10)))
+register("ema12", ema("Close", spanAlpha(12)))
+register("ema26", ema("Close", spanAlpha(26)))
+register("ema50", ema("Close", spanAlpha(50)))
+register("macd", derived(["ema12", "ema26"], numpy.subtract))
+register("macdSignal", ema("macd", spanAlpha(9)))
+register("volitStd1w", rolling("returns", 7, "std"))
+register("volitStd1mo", rolling("returns", 30, "std"))
+register("bollingerUp", derived(["ma20", "std20"], lambda ma, std: ma + std * 2))
+register("bollingerDown", derived(["ma20", "std20"], lambda ma, std: ma - std * 2))
+register("volma10", rolling("Volume", 10))
+register("timeFeature", derived(["Close"], _timeFeature))
+register("delta", derived(["Close"], _barDelta))
+register("gain", derived(["delta"], lambda delta: numpy.where(delta > 0, delta, 0)))
+register("loss", derived(["delta"], lambda delta: numpy.where(delta < 0, -delta, 0)))
+# wilders smoothing
+register("avgGain", ema("gain", comAlpha(13)))
+register("avgLoss", ema("loss", comAlpha(13)))
+register("RSI", derived(["avgGain", "avgLoss"], _rsi))
+# on-balance volume, not part of featureColumns so models only get it on request
+register(
+    "signedVolume",
+    derived(["delta", "Volume"], lambda delta, volume: numpy.sign(delta) * volume),
+)
+register("OBV", running("signedVolume"))
+
+
+def _step(previous, value, alpha):
+    # one step of ewm, in the same order as the lfilter recursion
+    return alpha * value + (1.0 - alpha) * previous
+
+
+class RollingWindow:
+    """Ring buffer with running sums of one rolling window, O(1) per push
+
+    Sums are taken relative to a shift and recomputed from the buffer once per
+    window length of pushes, so they cannot drift on long streams.
+    """
+
+    def __init__(self, window, values=()):
+        self.window = window
+        self.values = deque((float(v) for v in values), maxlen=window)
+        self.pushes = 0
+        self._resum()
+
+    def _resum(self):
+        self.shift = sum(self.values) / len(self.values) if self.values else 0.0
+        centered = [v - self.shift for v in self.values]
+        self.total = sum(centered)
+        self.squares = sum(c * c for c in centered)
+
+    def push(self, value):
+        if not self.values:
+            self.shift = value
+        if len(self.values) == self.window:
+            old = self.values[0] - self.shift
+            self.total -= old
+            self.squares -= old * old
+        self.values.append(value)
+        centered = value - self.shift
+        self.total += centered
+        self.squares += centered * centered
+        self.pushes += 1
+        if self.pushes % self.window == 0:
+            self._resum()
+
+    def mean(self):
+        if len(self.values) < self.window:
+            return math.nan
+        return self.total / self.window + self.shift
+
+    def std(self):
+        if len(self.values) < self.window:
+            return math.nan
+        var = (self.squares - self.total * self.total / self.window) / (self.window - 1)
+        return math.sqrt(max(var, 0.0))
+
+
+class FeatureState:
+    """Indicator state after the last bar seen, the next feature row costs O(1)
+
+    Rows from update match computeFeatures over the whole series, except
+    timeFeature which is always 1.0 for the newest bar. toDict/fromDict give
+    a json-safe copy to store next to the series.
+    """
+
+    emaSpans = (10, 50, 12, 26)
+    closeWindows = (10, 20, 50)
+    returnWindows = (7, 30)
+    volumeWindow = 10
+
+    def __init__(self):
+        self.bars = 0
+        self.lastClose = None
+        self.lastTimestamp = None
+        # content hashes of the bars seen and of the series whose feature frame
+        # the state continues, set by processing.refreshFeatures
+        self.seriesHash = None
+        self.featuresHash = None
+        self.ema = {}
+        self.macdSignal = None
+        self.avgGain = 0.0
+        self.avgLoss = 0.0
+        self.close = {w: RollingWindow(w) for w in self.closeWindows}
+        self.returns = {w: RollingWindow(w) for w in self.returnWindows}
+        self.volume = RollingWindow(self.volumeWindow)
+
+    @classmethod
+    def fromSeries(cls, close, volume):
+        """State after the last bar of a series, computed with the vectorized kernels"""
+        close = numpy.asarray(close, dtype=numpy.float64)
+        volume = numpy.asarray(volume, dtype=numpy.float64)
+        state = cls()
+        if len(close) == 0:
+            return state
+        if numpy.isnan(close).any():
+            raise ValueError("FeatureState needs a series without missing closes")
+
+        state.bars = len(close)
+        state.lastClose = float(close[-1])
+        for span in cls.emaSpans:
+            state.ema[span] = float(ewm(close, spanAlpha(span))[-1])
+        macd = ewm(close, spanAlpha(12)) - ewm(close, spanAlpha(26))
+        state.macdSignal = float(ewm(macd, spanAlpha(9))[-1])
+
+        delta = numpy.diff(close, prepend=close[0])
+        gains = numpy.stack([numpy.maximum(delta, 0), numpy.maximum(-delta, 0)])
+        state.avgGain, state.avgLoss = (
+            float(v) for v in ewm(gains, comAlpha(13))[:, -1]
+        )
+
+        returns = pctChange(close)[1:]
+        state.close = {w: RollingWindow(w, close[-w:]) for w in cls.closeWindows}
+        state.returns = {w: RollingWindow(w, returns[-w:]) for w in cls.returnWindows}
+        state.volume = RollingWindow(cls.volumeWindow, volume[-cls.volumeWindow :])
+        return state
+
+    def update(self, close, volume):
+        """Advance by one bar and return its feature row as featureColumns -> float"""
+        close = float(close)
+        volume = float(volume)
+        if math.isnan(close):
+            raise ValueError("FeatureState needs a finite close")
+
+        first = self.bars == 0
+        ret = math.nan if first else close / self.lastClose - 1
+        delta = 0.0 if first else close - self.lastClose
+        for span in self.emaSpans:
+            previous = close if first else self.ema[span]
+            self.ema[span] = _step(previous, close, spanAlpha(span))
+        macd = self.ema[12] - self.ema[26]
+        previous = macd if first else self.macdSignal
+        self.macdSignal = _step(previous, macd, spanAlpha(9))
+        self.avgGain = _step(self.avgGain, max(delta, 0.0), comAlpha(13))
+        self.avgLoss = _step(self.avgLoss, max(-delta, 0.0), comAlpha(13))
+
+        for window in self.close.values():
+            window.push(close)
+        if not first:
+            for window in self.returns.values():
+                window.push(ret)
+        self.volume.push(volume)
+        self.bars += 1
+        self.lastClose = close
+
+        if self.avgLoss == 0:
+            rsi = math.nan if self.avgGain == 0 else 100.0
+        else:
+            rsi = 100 - (100 / (1 + self.avgGain / self.avgLoss))
+        ma20 = self.close[20].mean()
+        std20 = self.close[20].std()
+        return {
+            "priceChange": ret * 100,
+            "ma10": self.close[10].mean(),
+            "ma50": self.close[50].mean(),
+            "ema10": self.ema[10],
+            "ema50": self.ema[50],
+            "macd": macd,
+            "macdSignal": self.macdSignal,
+            "volitStd1w": self.returns[7].std(),
+            "volitStd1mo": self.returns[30].std(),
+            "bollingerUp": ma20 + std20 * 2,
+            "bollingerDown": ma20 - std20 * 2,
+            "volma10": self.volume.mean(),
+            "timeFeature": 1.0,
+            "RSI": rsi,
+        }
+
+    def toDict(self):
+        return {
+            "bars": self.bars,
+            "lastClose": self.lastClose,
+            "lastTimestamp": self.lastTimestamp,
+            "seriesHash": self.seriesHash,
+            "featuresHash": self.featuresHash,
+            "ema": {str(span): value for span, value in self.ema.items()},
+            "macdSignal": self.macdSignal,
+            "avgGain": self.avgGain,
+            "avgLoss": self.avgLoss,
+            "close": {str(w): list(r.values) for w, r in self.close.items()},
+            "returns": {str(w): list(r.values) for w, r in self.returns.items()},
+            "volume": list(self.volume.values),
+        }
+
+    @classmethod
+    def fromDict(cls, saved):
+        state = cls()
+        state.bars = saved["bars"]
+        state.lastClose = saved["lastClose"]
+        state.lastTimestamp = saved["lastTimestamp"]
+        state.seriesHash = saved.get("seriesHash")
+        state.featuresHash = saved.get("featuresHash")
+        state.ema = {int(span): value for span, value in saved["ema"].items()}
+        state.macdSignal = saved["macdSignal"]
+        state.avgGain = saved["avgGain"]
+        state.avgLoss = saved["avgLoss"]
+        state.close = {
+            int(w): RollingWindow(int(w), v) for w, v in saved["close"].items()
+        }
+        state.returns = {
+            int(w): RollingWindow(int(w), v) for w, v in saved["returns"].items()
+        }
+        state.volume = RollingWindow(cls.volumeWindow, saved["volume"])
+        return state
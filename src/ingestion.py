@@ -1,5 +1,6 @@
+import pandas
 import yfinance as yf
-import matplotlib.pyplot as plt
+import cache, storage, resampling
 
 ticker = "AAPL"
 # 1d, 5d, 1mo, 3mo, 6mo, 1y, 2y, 5y, 10y, ytd, max
@@ -7,20 +8,237 @@ period = "5y"
 interval = "1d"
 
 
+# calendar length of each period, "ytd" and "max" are handled separately
+periodOffsets = {
+    "1mo": pandas.DateOffset(months=1),
+    "3mo": pandas.DateOffset(months=3),
+    "6mo": pandas.DateOffset(months=6),
+    "1y": pandas.DateOffset(years=1),
+    "2y": pandas.DateOffset(years=2),
+    "5y": pandas.DateOffset(years=5),
+    "10y": pandas.DateOffset(years=10),
+}
+# column order of a single-ticker yfinance download
+priceColumns = ["Close", "High", "Low", "Open", "Volume"]
+# periods counted in trading sessions rather than calendar days
+periodSessions = {"1d": 1, "5d": 5}
+
+
+def trimToPeriod(data, tperiod, now=None):
+    """Drop bars that fall outside the rolling period window ending at now"""
+    if data.empty or tperiod == "max":
+        return data
+
+    if tperiod in periodSessions:
+        sessions = data.index.normalize().unique()
+        if len(sessions) <= periodSessions[tperiod]:
+            return data
+        return data[data.index >= sessions[-periodSessions[tperiod]]]
+
+    now = pandas.Timestamp.now(tz=data.index.tz) if now is None else now
+    if tperiod == "ytd":
+        start = now.normalize().replace(month=1, day=1)
+    elif tperiod in periodOffsets:
+        start = now.normalize() - periodOffsets[tperiod]
+    else:
+        return data
+    return data[data.index >= start]
+
+
+def flattenDownload(data):
+    """Drop the Ticker column level yfinance adds, leaving Close/High/Low/Open/Volume"""
+    if isinstance(data.columns, pandas.MultiIndex):
+        data = data.set_axis(data.columns.get_level_values(0), axis=1)
+    return data.rename_axis("Date").rename_axis(None, axis=1)
+
+
+def loadStoredHistory(ticker, tperiod, tinterval):
+    return storage.loadSeries("raw", ticker, tperiod, tinterval)
+
+
+def fetchDelta(ticker, tperiod, tinterval, stored):
+    """Download only the bars from the last stored timestamp onwards and merge them"""
+    lastTimestamp = stored.index[-1]
+    # the last stored bar is requested again, it may have been an unfinished bar
+    delta = yf.download(ticker, start=lastTimestamp, interval=tinterval)
+    if delta.empty:
+        return stored
+    return mergeDelta(stored, flattenDownload(delta), tperiod)
+
+
+def mergeDelta(stored, delta, tperiod):
+    """Append newly downloaded bars to a stored history, downloaded bars win"""
+    if delta.empty:
+        return stored
+    merged = pandas.concat([stored, delta])
+    merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+    return trimToPeriod(merged, tperiod)
+
+
+def sliceCovering(ticker, tperiod, tinterval, refresh=False):
+    """Answer tperiod from the widest cached series of the same ticker and interval
+
+    With refresh a stale covering series is brought up to date with a delta
+    download first. Returns None when no cached series covers the period.
+    """
+    found = cache.findCovering(ticker, tperiod, tinterval, allowStale=refresh)
+    if found is None:
+        return None
+    widePeriod, wide, fresh = found
+    if not fresh:
+        wide = fetchDelta(ticker, widePeriod, tinterval, wide)
+        cache.putSeries(ticker, widePeriod, tinterval, wide)
+    return trimToPeriod(wide, tperiod)
+
+
+def resampleCached(ticker, tperiod, tinterval):
+    """Build tinterval bars from a fresh cached series with finer bars, None when there is none"""
+    for source in resampling.finerIntervals.get(tinterval, []):
+        finer = cache.getSeries(ticker, tperiod, source, count=False)
+        if finer is None:
+            finer = sliceCovering(ticker, tperiod, source)
+        if finer is not None and not finer.empty:
+            return resampling.resampleBars(finer, tinterval)
+    return None
+
+
 # 1m, 2m, 5m, 15m, 30m, 60m, 90m, 1h, 1d, 5d, 1wk, 1mo, 3mo
-def fetchStock(ticker, tperiod, tinterval):
-    tickerData = yf.download(ticker, period=tperiod, interval=tinterval)
+def fetchStock(
+    ticker,
+    tperiod,
+    tinterval,
+    useCache=True,
+    incremental=False,
+    persist=True,
+    resample=False,
+    compact=False,
+):
+    rawPath = storage.seriesPath("raw", ticker, tperiod, tinterval)
+
+    tickerData = None
+    if useCache:
+        tickerData = cache.getSeries(ticker, tperiod, tinterval)
+        if tickerData is None:
+            tickerData = sliceCovering(ticker, tperiod, tinterval)
+        if tickerData is None and resample and resampling.canResample(tinterval):
+            # without finer cached bars this falls through to a remote fetch
+            tickerData = resampleCached(ticker, tperiod, tinterval)
+    cacheHit = tickerData is not None
+    if not cacheHit:
+        refreshed = False
+        stored = None
+        if incremental:
+            stored = cache.peekSeries(ticker, tperiod, tinterval)
+            if stored is None:
+                stored = loadStoredHistory(ticker, tperiod, tinterval)
+
+        if stored is not None and not stored.empty:
+            tickerData = fetchDelta(ticker, tperiod, tinterval, stored)
+        elif incremental and useCache:
+            # a stale wider series only needs its newest bars, it is cached under its own key
+            tickerData = sliceCovering(ticker, tperiod, tinterval, refresh=True)
+            refreshed = tickerData is not None
+        if tickerData is None:
+            tickerData = yf.download(ticker, period=tperiod, interval=tinterval)
+            tickerData = flattenDownload(tickerData)
+        if compact:
+            tickerData = storage.compactFrame(tickerData)
+        if not refreshed and not tickerData.empty:
+            cache.putSeries(ticker, tperiod, tinterval, tickerData)
+    elif compact:
+        tickerData = storage.compactFrame(tickerData)  # no-op once cached compact
+
     if not tickerData.empty:
-        tickerData.to_csv(f"./data/raw/{ticker}_{tperiod}_{tinterval}.csv", mode="w")
-        plt.figure(figsize=(10, 5))
-        plt.plot(tickerData.index, tickerData["Close"], label="Close Price")
-        plt.plot(tickerData.index, tickerData["Open"], label="Open Price")
-        plt.title(f"{ticker} Stock Price - {tperiod} at {tinterval} interval")
-        plt.xlabel("Date")
-        plt.ylabel("Price (USD)")
-        plt.legend()
-        plt.tight_layout()
-        plt.savefig(f"./data/raw/{ticker}_{tperiod}_{tinterval}.png")
-        plt.close()
+        # files from the original download are still valid on a cache hit
+        if persist and (not cacheHit or not storage.exists(rawPath)):
+            storage.saveSeries(tickerData, "raw", ticker, tperiod, tinterval)
     else:
         print(f"No data downloaded for ticker: {ticker}")
+
+    return tickerData
+
+
+def splitGrouped(grouped, tickers):
+    """Split a group_by="ticker" download into per-ticker frames laid out like fetchStock"""
+    series = {}
+    for symbol in tickers:
+        if symbol not in grouped.columns.get_level_values(0):
+            series[symbol] = pandas.DataFrame()
+            continue
+        frame = grouped[symbol].dropna(how="all")  # dates only other tickers traded
+        frame = frame[[c for c in priceColumns if c in frame.columns]]
+        series[symbol] = flattenDownload(frame)
+    return series
+
+
+def fetchMany(
+    tickers,
+    tperiod,
+    tinterval,
+    chunkSize=100,
+    useCache=True,
+    incremental=False,
+    persist=True,
+    compact=False,
+):
+    """Fetch many tickers with one grouped download per chunk, returns ticker -> DataFrame
+
+    incremental, persist and compact work as in fetchStock. With incremental,
+    tickers with a stored history are downloaded together from the oldest of
+    their last bars on and merged into it.
+    """
+    tickers = list(dict.fromkeys(t.upper() for t in tickers))  # dedupe, keep order
+    results = {}
+    stored = {}
+    pending = []
+    for symbol in tickers:
+        cached = None
+        if useCache:
+            cached = cache.getSeries(symbol, tperiod, tinterval)
+            if cached is None:
+                cached = sliceCovering(symbol, tperiod, tinterval)
+        if cached is not None:
+            results[symbol] = storage.compactFrame(cached) if compact else cached
+            continue
+        history = None
+        if incremental:
+            history = cache.peekSeries(symbol, tperiod, tinterval)
+            if history is None:
+                history = loadStoredHistory(symbol, tperiod, tinterval)
+        if history is not None and not history.empty:
+            stored[symbol] = history
+        else:
+            pending.append(symbol)
+
+    def keep(symbol, tickerData):
+        # same handling as a fetchStock download
+        if tickerData.empty:
+            print(f"No data downloaded for ticker: {symbol}")
+        else:
+            if compact:
+                tickerData = storage.compactFrame(tickerData)
+            cache.putSeries(symbol, tperiod, tinterval, tickerData)
+            if persist:
+                storage.saveSeries(tickerData, "raw", symbol, tperiod, tinterval)
+        results[symbol] = tickerData
+
+    deltas = list(stored)
+    for start in range(0, len(deltas), chunkSize):
+        chunk = deltas[start : start + chunkSize]
+        # the last stored bars are requested again, they may have been unfinished
+        since = min(stored[symbol].index[-1] for symbol in chunk)
+        grouped = yf.download(
+            chunk, start=since, interval=tinterval, group_by="ticker", threads=True
+        )
+        for symbol, delta in splitGrouped(grouped, chunk).items():
+            keep(symbol, mergeDelta(stored[symbol], delta, tperiod))
+
+    for start in range(0, len(pending), chunkSize):
+        chunk = pending[start : start + chunkSize]
+        grouped = yf.download(
+            chunk, period=tperiod, interval=tinterval, group_by="ticker", threads=True
+        )
+        for symbol, tickerData in splitGrouped(grouped, chunk).items():
+            keep(symbol, tickerData)
+
+    return results
@@ -1,25 +1,36 @@
 import os
 import sys
-import shutil
+import resources
+
+# thread counts have to be in the environment before numpy and the model libraries load
+resources.govern()
 from discord_bot import runDiscordBot
 from config import loadConfig
+import cache
+import modelregistry
 
 if __name__ == "__main__":
     # load configuration
     config = loadConfig()
 
-    # reset data directories
-    if os.path.exists("./data/raw"):
-        shutil.rmtree("./data/raw")
-    if os.path.exists("./data/processed"):
-        shutil.rmtree("./data/processed")
-    if os.path.exists("./data/predictions"):
-        shutil.rmtree("./data/predictions")
-
-    # create fresh data directories
+    # data directories are kept between restarts, stored series are reused
     os.makedirs("./data/raw", exist_ok=True)
     os.makedirs("./data/processed", exist_ok=True)
     os.makedirs("./data/predictions", exist_ok=True)
+    os.makedirs("./data/charts", exist_ok=True)
+
+    limits = resources.settings()
+    print(
+        f"Using {limits['workers']} training workers with {limits['threads']} threads each "
+        f"(from {limits['source']}, CPU quota {limits['cpuQuota']}, "
+        f"memory limit {limits['memoryLimit']})"
+    )
+
+    # warm the series cache from the persistent volume
+    warm = cache.loadManifest()
+    print(f"Loaded {warm} cached series from {cache.cacheDir()}")
+    models = modelregistry.loadManifest()
+    print(f"Loaded {models} trained models from {modelregistry.registryDir()}")
 
     # get token from config with fallback to environment
     token = config.get("discord", {}).get("token") or os.getenv("CHRONOX_DISCORD_TOKEN")
@@ -1,9 +1,381 @@
+import functools
+import hashlib
+import math
 import pandas, numpy, xgboost, lightgbm
-from sklearn import model_selection as sklS
 from sklearn import metrics as sklM
 import utils
+import storage
 from prophet import Prophet
+from prophet.serialize import model_to_json, model_from_json
 import news
+import features
+import trainset
+import modelregistry
+import singleflight
+import resources
+
+# warm starts continue the booster of an earlier version of the series, see _refitReason
+defaultMaxNewFraction = 0.1
+defaultMaxUpdates = 5
+defaultDriftTolerance = 0.05
+# runs of stored bars hashed separately, so bars trimmed from the front only skip runs
+barBlocks = 16
+seriesFields = ("ticker", "period", "interval", "daysAhead", "testSize")
+# daysAhead fitted together in multi-horizon mode, others are interpolated between them
+defaultHorizons = [1, 5, 10, 20, 30, 60]
+
+
+def _fitRegistered(modelName, dataHash, params, fit, save, load, *series):
+    """Fitted model and its test rmse, from the model registry or from fit()
+
+    fit returns (model, rmse) and save turns the model into bytes that load reads
+    back. series is (ticker, period, interval, dayTarget, testSize). A dataHash of
+    None (random splits) is never registered.
+    """
+    key = None
+    if dataHash is not None:
+        key = modelregistry.makeKey(modelName, *series, dataHash, params)
+        registered = modelregistry.getModel(key, load)
+        if registered is not None:
+            model, metrics = registered
+            return model, metrics["rmse"]
+
+    model, error = fit()
+    if key is not None:
+        info = dict(zip(seriesFields, series), model=modelName)
+        modelregistry.putModel(key, model, save(model), {"rmse": float(error)}, info)
+    return model, error
+
+
+def _hashBars(stamps, close):
+    return hashlib.sha1(stamps.tobytes() + close.tobytes()).hexdigest()
+
+
+def _barBlocks(data):
+    """[first time, last time, hash] of runs of the bars, all but the last bar
+
+    Only the times and closes, features like timeFeature change on old rows when
+    bars are added. The last bar is left out, it may still be forming.
+    """
+    stamps = storage.barStamps(data)[:-1]
+    close = data["Close"].to_numpy(dtype=numpy.float64)[:-1]
+    bounds = numpy.linspace(0, len(stamps), min(barBlocks, len(stamps)) + 1)
+    bounds = bounds.astype(int).tolist()
+    return [
+        [int(stamps[a]), int(stamps[b - 1]), _hashBars(stamps[a:b], close[a:b])]
+        for a, b in zip(bounds, bounds[1:])
+        if b > a
+    ]
+
+
+def _historyChanged(entry, data):
+    # stored runs are compared by time, runs partly trimmed from the front are skipped
+    blocks = entry.get("barBlocks")
+    stamps = storage.barStamps(data)
+    if not blocks or not len(stamps) or stamps[-1] < entry["lastBar"]:
+        return True
+    close = data["Close"].to_numpy(dtype=numpy.float64)
+    compared = 0
+    for first, last, digest in blocks:
+        if first < stamps[0]:
+            continue
+        a = numpy.searchsorted(stamps, first, side="left")
+        b = numpy.searchsorted(stamps, last, side="right")
+        if _hashBars(stamps[a:b], close[a:b]) != digest:
+            return True
+        compared += 1
+    return compared == 0
+
+
+def _newRows(entry, data):
+    return int((storage.barStamps(data) > entry["lastBar"]).sum())
+
+
+def _refitReason(entry, data, dataset):
+    """Why the previously registered booster must not be continued, None if it may"""
+    config = modelregistry.registryConfig
+    if entry is None:
+        return "no earlier model"
+    if _historyChanged(entry, data):
+        return "history changed"
+    newRows = _newRows(entry, data)
+    maxNew = config.get("max_new_fraction", defaultMaxNewFraction) * entry["trainRows"]
+    if newRows > maxNew:
+        return "too many new bars"
+    if entry["updates"] >= config.get("max_updates", defaultMaxUpdates):
+        return "update limit"
+    drift = entry.get("drift")
+    if drift is not None and drift > config.get(
+        "drift_tolerance", defaultDriftTolerance
+    ):
+        return "drift"
+    return None
+
+
+def _fitBoosted(
+    modelName,
+    data,
+    dataset,
+    params,
+    rounds,
+    warmStart,
+    boost,
+    predict,
+    save,
+    load,
+    *series,
+):
+    """Booster and its test rmse, from the registry, continued or fitted from scratch
+
+    boost(rounds, previous) trains rounds more trees on the training rows on top of
+    previous, or a new booster when it is None. With warmStart the booster of an
+    earlier version of the same series is continued with rounds in proportion to
+    the new training rows, unless _refitReason asks for a full refit. Full refits
+    that could have been continued measure the drift of continuing against them.
+    Returns (booster, rmse, report).
+    """
+
+    def rmse(booster):
+        predictions = predict(booster, dataset.testX)
+        return float(numpy.sqrt(sklM.mean_squared_error(dataset.testY, predictions)))
+
+    report = {"warmStart": False, "refitReason": None, "drift": None}
+    if dataset.dataHash is None:
+        booster = boost(rounds, None)
+        return booster, rmse(booster), report
+    key = modelregistry.makeKey(modelName, *series, dataset.dataHash, params)
+    registered = modelregistry.getModel(key, load)
+    if registered is not None:
+        booster, metrics = registered
+        return booster, metrics["rmse"], report
+
+    lineage = modelregistry.makeKey(modelName, *series, None, params)
+    entry = previous = None
+    if warmStart:
+        previousKey = modelregistry.findLatest(lineage)
+        registered = modelregistry.getModel(previousKey, load) if previousKey else None
+        if registered is not None:
+            previous = registered[0]
+            entry = modelregistry.entryOf(previousKey)
+    reason = _refitReason(entry, data, dataset) if warmStart else "warm start off"
+
+    extra = 0
+    continuable = entry is not None and reason != "history changed"
+    if continuable:
+        newRows = _newRows(entry, data)
+        extra = min(rounds, math.ceil(rounds * newRows / max(entry["trainRows"], 1)))
+    if reason is None:
+        booster = boost(extra, previous) if extra > 0 else previous
+        error = rmse(booster)
+        updates = entry["updates"] + 1
+        drift = entry.get("drift")  # as last measured
+        modelregistry.recordTraining(True)
+    else:
+        booster = boost(rounds, None)
+        error = rmse(booster)
+        updates = 0
+        drift = None
+        if continuable:
+            continued = boost(extra, previous) if extra > 0 else previous
+            drift = (rmse(continued) - error) / error if error else 0.0
+        modelregistry.recordTraining(False, drift)
+    report = {"warmStart": reason is None, "refitReason": reason, "drift": drift}
+
+    info = dict(zip(seriesFields, series), model=modelName, lineage=lineage)
+    info.update(
+        rows=len(data),
+        trainRows=dataset.trainRows,
+        barBlocks=_barBlocks(data),
+        lastBar=int(storage.barStamps(data)[-1]),
+        updates=updates,
+        drift=drift,
+    )
+    modelregistry.putModel(key, booster, save(booster), {"rmse": error}, info)
+    return booster, error, report
+
+
+def _loadXGBoost(artifact):
+    booster = xgboost.Booster()
+    booster.load_model(bytearray(artifact))
+    return booster
+
+
+def withThreads(params, name):
+    """params with the thread count of resources.threads() under the library's name
+
+    Passed explicitly, thread limits set on the main thread do not reach the bot's
+    executor threads.
+    """
+    count = resources.threads()
+    return dict(params, **{name: count}) if count else params
+
+
+def _boostXGBoost(params, dataset, rounds, previous):
+    return xgboost.train(
+        withThreads(params, "nthread"),
+        dataset.xgbTrain(),
+        num_boost_round=rounds,
+        xgb_model=previous,
+    )
+
+
+def _boostLightGBM(params, dataset, rounds, previous):
+    params = withThreads(params, "num_threads")
+    if previous is None:
+        return lightgbm.train(params, dataset.lgbTrain(params), num_boost_round=rounds)
+    return lightgbm.train(
+        params,
+        dataset.lgbContinue(params),
+        num_boost_round=rounds,
+        init_model=previous,
+    )
+
+
+# how each tree library trains, predicts and (de)serializes a booster
+boosters = {
+    "xgboost": {
+        "boost": _boostXGBoost,
+        "predict": lambda booster, x: booster.inplace_predict(x),
+        "save": lambda booster: bytes(booster.save_raw("ubj")),
+        "load": _loadXGBoost,
+    },
+    "lightgbm": {
+        "boost": _boostLightGBM,
+        "predict": lambda booster, x: booster.predict(
+            x, **withThreads({}, "num_threads")
+        ),
+        "save": lambda booster: booster.model_to_string().encode(),
+        "load": lambda artifact: lightgbm.Booster(model_str=artifact.decode()),
+    },
+}
+boostRounds = 200  # adjust rounds
+# hyperparameters of the tree models, LightGBM also gets the caller's random_state
+boosterParams = {
+    "xgboost": {"objective": "reg:squarederror", "learning_rate": 0.05},
+    "lightgbm": {"objective": "regression", "learning_rate": 0.05, "verbosity": -1},
+}
+
+
+def boosterConfig(modelName, ticker, tinterval):
+    """(params, rounds) of a tree model, the tuned ones of the series if tuning found better"""
+    params, rounds = dict(boosterParams[modelName]), boostRounds
+    tuned = modelregistry.getTuned(modelName, ticker, tinterval)
+    if tuned is not None:
+        params.update(tuned["params"])
+        rounds = tuned["rounds"]
+    return params, rounds
+
+
+def _registryParams(params, options):
+    # what the registry key of a tree model holds besides the series and data
+    return dict(params, rounds=options["rounds"], shuffle=options["shuffle"])
+
+
+def _fitTree(modelName, params, data, dayTarget, testSize, options, *series, **shared):
+    """(booster, rmse, report, dataset) for one horizon
+
+    options holds shuffle, seed, warmStart and rounds. shared can pass the dataHash and a
+    base TrainingSet whose matrix and feature bins are reused.
+    """
+    kit = boosters[modelName]
+    dataset = trainset.getTrainingSet(
+        data, dayTarget, testSize, options["shuffle"], options["seed"], **shared
+    )
+    booster, error, report = _fitBoosted(
+        modelName,
+        data,
+        dataset,
+        _registryParams(params, options),
+        options["rounds"],
+        options["warmStart"],
+        functools.partial(kit["boost"], params, dataset),
+        kit["predict"],
+        kit["save"],
+        kit["load"],
+        *series,
+        dayTarget,
+        testSize,
+    )
+    return booster, error, report, dataset
+
+
+def fitHorizons(modelName, params, data, horizons, testSize, options, *series):
+    """Fit one booster per horizon in one job, horizon -> (booster, rmse, report, dataset)
+
+    The horizons share the base TrainingSet of the shortest one, its feature matrix,
+    bins and quantile cuts, so a longer horizon is not split on cuts of its own rows.
+    series is (ticker, period, interval).
+    """
+    dataHash = storage.hashFrame(data)
+
+    def fitAll():
+        fits = {}
+        base = None
+        for horizon in sorted(horizons):
+            shared = {"dataHash": dataHash, "base": base}
+            fits[horizon] = _fitTree(
+                modelName, params, data, horizon, testSize, options, *series, **shared
+            )
+            base = base or fits[horizon][3]
+        return fits
+
+    key = ("horizons", modelName, dataHash, tuple(sorted(horizons)), testSize)
+    key += (options["seed"], options["warmStart"]) + tuple(series)
+    return singleflight.do(key, fitAll)
+
+
+def configuredHorizons(horizons=None):
+    """Horizons to fit together, [] when multi-horizon training is off"""
+    if horizons is not None:
+        return sorted(set(horizons))
+    config = modelregistry.registryConfig
+    if not config.get("multi_horizon", False):
+        return []
+    return sorted(set(config.get("horizons", defaultHorizons)))
+
+
+def _predictTree(
+    modelName, params, data, dayTarget, testSize, options, horizons, *series
+):
+    """(future prediction, rmse, report) of a tree model for dayTarget
+
+    Horizons inside the configured set are answered from one fitted set, by the
+    booster of that horizon or by interpolating between its two neighbours. Other
+    horizons and shuffled splits get a direct fit.
+    """
+    predict = boosters[modelName]["predict"]
+    horizons = configuredHorizons(horizons)
+    if horizons and not options["shuffle"] and horizons[0] <= dayTarget <= horizons[-1]:
+        fits = fitHorizons(
+            modelName, params, data, horizons, testSize, options, *series
+        )
+        if dayTarget in fits:
+            booster, error, report, dataset = fits[dayTarget]
+            return (
+                predict(booster, dataset.future)[0],
+                error,
+                dict(report, horizon="set"),
+            )
+
+        below = max(h for h in horizons if h < dayTarget)
+        above = min(h for h in horizons if h > dayTarget)
+        weight = (dayTarget - below) / (above - below)
+        predictions = [
+            predict(fits[h][0], fits[h][3].future)[0] for h in (below, above)
+        ]
+        errors = [fits[h][1] for h in (below, above)]
+        report = {"warmStart": False, "refitReason": None, "drift": None}
+        report["horizon"] = "interpolated"
+        return (
+            predictions[0] + weight * (predictions[1] - predictions[0]),
+            errors[0] + weight * (errors[1] - errors[0]),
+            report,
+        )
+
+    booster, error, report, dataset = _fitTree(
+        modelName, params, data, dayTarget, testSize, options, *series
+    )
+    return predict(booster, dataset.future)[0], error, dict(report, horizon="direct")
 
 
 def trainXGBoost(
@@ -15,38 +387,32 @@ def trainXGBoost(
     testSize,
     return_result=False,
     shuffle=False,
+    warmStart=None,
+    horizons=None,
 ):
-    data = pandas.read_csv(
-        f"./data/processed/{ticker}_{tperiod}_{tinterval}.csv",
-        header=0,
-        parse_dates=True,
-    )
+    if data is None:
+        data = storage.loadSeries("processed", ticker, tperiod, tinterval)
+    if warmStart is None:
+        warmStart = modelregistry.registryConfig.get("warm_start", False)
     # get the last closing price
     lastClose = data["Close"].iloc[-1]
 
-    if dayTarget > 0:
-        data["Target"] = data["Close"].shift(-dayTarget)
-        data = data.dropna(
-            subset=["Target"]
-        )  # remove the empty fields from shifted values
-    else:
-        data["Target"] = data["Close"]
-
-    y = data["Target"]
-    x = data.drop(columns=["Price", "Target"])
-
-    XTrain, XTest, YTrain, YTest = sklS.train_test_split(
-        x, y, test_size=testSize, shuffle=shuffle
+    params, rounds = boosterConfig("xgboost", ticker, tinterval)
+    options = {"shuffle": shuffle, "seed": None, "warmStart": warmStart}
+    options["rounds"] = rounds
+    futurepred, error, report = _predictTree(
+        "xgboost",
+        params,
+        data,
+        dayTarget,
+        testSize,
+        options,
+        horizons,
+        ticker,
+        tperiod,
+        tinterval,
     )
 
-    xgbModel = xgboost.XGBRegressor(
-        objective="reg:squarederror", learning_rate=0.05, n_estimators=200
-    )  # adjust estimators
-    xgbModel.fit(XTrain, YTrain)
-    predXgb = xgbModel.predict(XTest)
-    futurefeatures = x.iloc[[-1]]
-    futurepred = xgbModel.predict(futurefeatures)[0]
-
     sentimentData, _ = news.getSentimentData(ticker)
     sentimentScore = sentimentData.get("sentimentScore", 0)
 
@@ -57,7 +423,6 @@ def trainXGBoost(
         daysAhead=dayTarget,
     )
 
-    error = numpy.sqrt(sklM.mean_squared_error(YTest, predXgb))
     if not return_result:
         print(f"Original prediction: {futurepred}")
         print(f"Sentiment-adjusted prediction: {adjustedPrediction}")
@@ -76,6 +441,9 @@ def trainXGBoost(
             "error": error,
             "sentimentScore": sentimentScore,
             "sentimentEnabled": sentimentData.get("enabled", False),
+            "warmStart": report["warmStart"],
+            "drift": report["drift"],
+            "horizonFit": report["horizon"],
         }
 
 
@@ -89,35 +457,32 @@ def trainLightGBM(
     seed=42,
     return_result=False,
     shuffle=False,
+    warmStart=None,
+    horizons=None,
 ):
-    data = pandas.read_csv(
-        f"./data/processed/{ticker}_{tperiod}_{tinterval}.csv",
-        header=0,
-        parse_dates=True,
-    )
+    if data is None:
+        data = storage.loadSeries("processed", ticker, tperiod, tinterval)
+    if warmStart is None:
+        warmStart = modelregistry.registryConfig.get("warm_start", False)
 
     lastClose = data["Close"].iloc[-1]
 
-    if dayTarget > 0:
-        data["Target"] = data["Close"].shift(-dayTarget)
-        data = data.dropna(subset=["Target"])
-    else:
-        data["Target"] = data["Close"]
-
-    y = data["Target"]
-    x = data.drop(columns=["Price", "Target"])
-
-    XTrain, XTest, YTrain, YTest = sklS.train_test_split(
-        x, y, test_size=testSize, random_state=seed, shuffle=shuffle
-    )
-
-    lgbModel = lightgbm.LGBMRegressor(
-        objective="regression", learning_rate=0.05, n_estimators=200, random_state=seed
+    params, rounds = boosterConfig("lightgbm", ticker, tinterval)
+    params["random_state"] = seed
+    options = {"shuffle": shuffle, "seed": seed, "warmStart": warmStart}
+    options["rounds"] = rounds
+    futurepred, error, report = _predictTree(
+        "lightgbm",
+        params,
+        data,
+        dayTarget,
+        testSize,
+        options,
+        horizons,
+        ticker,
+        tperiod,
+        tinterval,
     )
-    lgbModel.fit(XTrain, YTrain)
-    predLgb = lgbModel.predict(XTest)
-    futurefeatures = x.iloc[[-1]]
-    futurepred = lgbModel.predict(futurefeatures)[0]
 
     sentimentData, _ = news.getSentimentData(ticker)
     sentimentScore = sentimentData.get("sentimentScore", 0)
@@ -130,7 +495,6 @@ def trainLightGBM(
         daysAhead=dayTarget,
     )
 
-    error = numpy.sqrt(sklM.mean_squared_error(YTest, predLgb))
     if not return_result:
         print(f"Original prediction: {futurepred}")
         print(f"Sentiment-adjusted prediction: {adjustedPrediction}")
@@ -149,76 +513,99 @@ def trainLightGBM(
             "error": error,
             "sentimentScore": sentimentScore,
             "sentimentEnabled": sentimentData.get("enabled", False),
+            "warmStart": report["warmStart"],
+            "drift": report["drift"],
+            "horizonFit": report["horizon"],
         }
 
 
-def trainProphet(
-    data, ticker, tperiod, tinterval, dayTarget, testSize, return_result=False
-):
-    data = pandas.read_csv(
-        f"./data/processed/{ticker}_{tperiod}_{tinterval}.csv",
-        header=0,
-        parse_dates=["Price"],
-    )
-
+def prophetFrame(data):
+    """(ds/y frame with the regressor columns, regressor names) of a feature frame"""
     # make a copy of the data and rename columns for Prophet
     prophetData = data[["Price", "Close"]].copy()
     prophetData.columns = ["ds", "y"]
+    prophetData["ds"] = pandas.to_datetime(prophetData["ds"])
+    if prophetData["ds"].dt.tz is not None:
+        prophetData["ds"] = prophetData["ds"].dt.tz_localize(
+            None
+        )  # prophet needs naive
 
-    regressorFeatures = [
-        "priceChange",
-        "ma10",
-        "ma50",
-        "ema10",
-        "ema50",
-        "macd",
-        "macdSignal",
-        "volitStd1w",
-        "volitStd1mo",
-        "bollingerUp",
-        "bollingerDown",
-        "volma10",
-        "timeFeature",
-        "RSI",
-    ]
+    # every registered feature the frame carries is a regressor
+    regressorFeatures = [c for c in data.columns if c in features.registry]
 
     # add regressors
     for feature in regressorFeatures:
         if feature in data.columns:
             prophetData[feature] = data[feature]
+    return prophetData, regressorFeatures
+
+
+def trainProphet(
+    data, ticker, tperiod, tinterval, dayTarget, testSize, return_result=False
+):
+    if data is None:
+        data = storage.loadSeries("processed", ticker, tperiod, tinterval)
+
+    prophetData, regressorFeatures = prophetFrame(data)
 
     # training/testing splits
     trainSize = int(len(prophetData) * (1 - testSize))
     trainData = prophetData.iloc[:trainSize]
     testData = prophetData.iloc[trainSize:]
 
-    # Train Prophet model with regressors
-    model = Prophet()
-
-    # each feature is a regressor
-    for feature in regressorFeatures:
-        if feature in prophetData.columns and feature not in ["ds", "y"]:
-            model.add_regressor(feature)
-
-    model.fit(trainData)
-    # make predictions for test period and beyond
-    future = model.make_future_dataframe(periods=len(testData) + dayTarget)
-
-    # copy regressor values to future dataframe for prediction
-    for feature in regressorFeatures:
-        if feature in prophetData.columns and feature not in ["ds", "y"]:
-            future[feature] = pandas.Series(prophetData[feature].values)
-            # for forecasting horizon, use the last value for each regressor
-            future.loc[len(prophetData) :, feature] = prophetData[feature].iloc[-1]
-
-    forecast = model.predict(future)
-
-    # error calc
-    test_predictions = forecast.iloc[trainSize : trainSize + len(testData)][
-        "yhat"
-    ].values
-    test_actuals = testData["y"].values
-    error = numpy.sqrt(sklM.mean_squared_error(test_actuals, test_predictions))
+    def futureFrame(model):
+        # make predictions for test period and beyond
+        future = model.make_future_dataframe(periods=len(testData) + dayTarget)
+
+        # copy regressor values to future dataframe for prediction
+        for feature in regressorFeatures:
+            if feature in prophetData.columns and feature not in ["ds", "y"]:
+                future[feature] = pandas.Series(prophetData[feature].values)
+                # for forecasting horizon, use the last value for each regressor
+                future.loc[len(prophetData) :, feature] = prophetData[feature].iloc[-1]
+        return future
+
+    forecasts = []
+
+    def fit():
+        # Train Prophet model with regressors
+        model = Prophet()
+
+        # each feature is a regressor
+        for feature in regressorFeatures:
+            if feature in prophetData.columns and feature not in ["ds", "y"]:
+                model.add_regressor(feature)
+
+        model.fit(trainData)
+        forecast = model.predict(futureFrame(model))
+        forecasts.append(forecast)
+
+        # error calc
+        test_predictions = forecast.iloc[trainSize : trainSize + len(testData)][
+            "yhat"
+        ].values
+        test_actuals = testData["y"].values
+        return model, numpy.sqrt(
+            sklM.mean_squared_error(test_actuals, test_predictions)
+        )
+
+    model, error = _fitRegistered(
+        "prophet",
+        storage.hashFrame(data),
+        {"regressors": regressorFeatures},
+        fit,
+        lambda model: model_to_json(model).encode(),
+        lambda artifact: model_from_json(artifact.decode()),
+        ticker,
+        tperiod,
+        tinterval,
+        dayTarget,
+        testSize,
+    )
+    # a registered model only has to forecast the last row
+    forecast = (
+        forecasts[0] if forecasts else model.predict(futureFrame(model).iloc[[-1]])
+    )
 
     # get future prediction
     futurepred = forecast["yhat"].iloc[-1]
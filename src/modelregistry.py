@@ -0,0 +1,370 @@
+import fcntl
+import hashlib
+import json
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from config import loadConfig
+
+# fitted models share the 50Mi persistent volume with the series cache and users.json
+defaultDir = "/persistent/models"
+defaultMaxEntries = 32
+defaultMaxBytes = 8 * 1024 * 1024
+# deserialized models kept in memory, each tree model is a few hundred KB
+defaultLoadedEntries = 8
+
+# key -> manifest entry of a stored model, least recently used first
+_entries = OrderedDict()
+# key -> fitted model object, saves deserializing models used again soon
+_loaded = OrderedDict()
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "stored": 0,
+    "evictions": 0,
+    "warmStarts": 0,
+    "refits": 0,
+}
+# relative rmse difference of continued models against full refits on the same data
+_drifts = deque(maxlen=50)
+# "model|TICKER|interval" -> tuned hyperparameters, _tunedMtime is the path and
+# mtime of the tuned.json they were read from
+_tuned = {}
+_tunedMtime = None
+_lock = threading.Lock()
+
+registryConfig = loadConfig().get("models", {})
+
+
+def _enabled():
+    return registryConfig.get("registry", True)
+
+
+def registryDir():
+    return registryConfig.get("dir", defaultDir)
+
+
+def makeKey(
+    modelName, ticker, tperiod, tinterval, dayTarget, testSize, dataHash, params
+):
+    """Registry key of a fitted model, stable across processes
+
+    dataHash identifies the frame the model was trained on, params holds every
+    hyperparameter that changes the fit.
+    """
+    fields = [
+        modelName,
+        ticker.upper(),
+        tperiod,
+        tinterval,
+        dayTarget,
+        testSize,
+        dataHash,
+        params,
+    ]
+    text = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def findLatest(lineage):
+    """Key of the most recently stored model with this lineage, or None
+
+    The lineage is a key made without a dataHash, the same model trained on
+    earlier versions of a series.
+    """
+    with _lock:
+        entries = [e for e in _entries.values() if e.get("lineage") == lineage]
+    if not entries:
+        return None
+    return max(entries, key=lambda e: e.get("storedAt", 0))["key"]
+
+
+def entryOf(key):
+    """Manifest entry of a stored model, or None"""
+    with _lock:
+        entry = _entries.get(key)
+        return dict(entry) if entry is not None else None
+
+
+def recordTraining(warmStart, drift=None):
+    """Count a fit, drift is measured whenever a full refit could have been continued"""
+    with _lock:
+        _stats["warmStarts" if warmStart else "refits"] += 1
+        if drift is not None:
+            _drifts.append(drift)
+
+
+def _manifestPath():
+    return os.path.join(registryDir(), "manifest.json")
+
+
+def _readManifest():
+    with open(_manifestPath(), "r") as f:
+        return json.load(f).get("entries", [])
+
+
+def _valid(entry):
+    return (
+        isinstance(entry, dict)
+        and os.path.exists(entry.get("path", ""))
+        and os.path.getsize(entry["path"]) == entry.get("bytes")
+    )
+
+
+def _writeManifest():
+    # caller holds _lock. training workers write the same manifest, so models one
+    # of them stored since are merged in (as least recently used) under a file lock
+    path = _manifestPath()
+    os.makedirs(registryDir(), exist_ok=True)
+    lock = os.open(f"{path}.lock", os.O_CREAT | os.O_RDWR)
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            stored = _readManifest()
+        except (OSError, json.JSONDecodeError):
+            stored = []
+        for entry in reversed(stored):
+            if _valid(entry) and entry["key"] not in _entries:
+                _entries[entry["key"]] = entry
+                _entries.move_to_end(entry["key"], last=False)
+        _evict()
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"version": 1, "entries": list(_entries.values())}, f, indent=1)
+        os.replace(f"{path}.tmp", path)
+    finally:
+        os.close(lock)  # releases the lock
+
+
+def _removeEntry(key):
+    # caller holds _lock
+    entry = _entries.pop(key)
+    _loaded.pop(key, None)
+    if os.path.exists(entry["path"]):
+        os.remove(entry["path"])
+
+
+def _evict():
+    # caller holds _lock, drops least recently used models until both limits hold
+    maxEntries = registryConfig.get("max_entries", defaultMaxEntries)
+    maxBytes = registryConfig.get("max_bytes", defaultMaxBytes)
+    total = sum(entry["bytes"] for entry in _entries.values())
+    while _entries and (len(_entries) > maxEntries or total > maxBytes):
+        key = next(iter(_entries))
+        total -= _entries[key]["bytes"]
+        _removeEntry(key)
+        _stats["evictions"] += 1
+
+
+def _remember(key, model):
+    # caller holds _lock
+    _loaded[key] = model
+    _loaded.move_to_end(key)
+    while len(_loaded) > registryConfig.get("loaded_entries", defaultLoadedEntries):
+        _loaded.popitem(last=False)
+
+
+def getModel(key, load):
+    """Return (model, metrics) registered under key, or None
+
+    load turns the stored artifact bytes back into a model. It only runs when the
+    model is not in memory already.
+    """
+    if not _enabled():
+        return None
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        entry["usedAt"] = time.time()
+        model = _loaded.get(key)
+        if model is not None:
+            _loaded.move_to_end(key)
+
+    if model is None:
+        try:
+            with open(entry["path"], "rb") as f:
+                model = load(f.read())
+        except Exception as e:  # every model library raises its own error type
+            print(f"Dropping unreadable model {entry['path']}: {e}")
+            with _lock:
+                if key in _entries:
+                    _removeEntry(key)
+                _stats["misses"] += 1
+            return None
+
+    with _lock:
+        _remember(key, model)
+        _stats["hits"] += 1
+        try:
+            _writeManifest()  # keeps the recency order for the next run
+        except OSError as e:
+            print(f"Could not write the model manifest: {e}")
+    return model, entry["metrics"]
+
+
+def putModel(key, model, artifact, metrics, info):
+    """Register a fitted model, artifact is its serialized form as bytes
+
+    metrics are the evaluation results served with it (e.g. rmse), info is kept
+    in the manifest to tell entries apart.
+    """
+    if not _enabled():
+        return
+    path = os.path.join(registryDir(), f"{key}.model")
+    try:
+        os.makedirs(registryDir(), exist_ok=True)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(artifact)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        print(f"Could not write {path} to the model registry: {e}")
+        return
+
+    entry = dict(info, key=key, path=path, bytes=len(artifact), metrics=metrics)
+    entry["usedAt"] = entry["storedAt"] = time.time()
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        _remember(key, model)
+        _stats["stored"] += 1
+        _evict()
+        try:
+            _writeManifest()
+        except OSError as e:
+            print(f"Could not write the model manifest: {e}")
+
+
+def loadManifest():
+    """Pick up the models stored by earlier runs, returns how many are available"""
+    if not _enabled():
+        return 0
+    try:
+        stored = _readManifest()
+    except FileNotFoundError:
+        # an empty registry, a worker may still hold the entries of an earlier one
+        with _lock:
+            _entries.clear()
+            _loaded.clear()
+        return 0
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ignoring unreadable model manifest {_manifestPath()}: {e}")
+        return 0
+
+    valid = [entry for entry in stored if _valid(entry)]
+    with _lock:
+        # models in memory stay loaded while the same artifact is still registered
+        before = {key: entry.get("storedAt") for key, entry in _entries.items()}
+        _entries.clear()
+        for entry in sorted(valid, key=lambda e: e.get("usedAt", 0)):
+            _entries[entry["key"]] = entry
+        for key in list(_loaded):
+            if key not in _entries or before.get(key) != _entries[key].get("storedAt"):
+                del _loaded[key]
+        _evict()
+        try:
+            _writeManifest()
+        except OSError as e:
+            print(f"Could not write the model manifest: {e}")
+    return len(_entries)
+
+
+def _tunedPath():
+    return os.path.join(registryDir(), "tuned.json")
+
+
+def _readTuned():
+    # caller holds _lock, tuning jobs write the file from worker processes
+    global _tunedMtime
+    try:
+        mtime = os.path.getmtime(_tunedPath())
+    except OSError:
+        mtime = None
+    # with the path, a long-lived worker may be pointed at another registry
+    if (_tunedPath(), mtime) == _tunedMtime:
+        return
+    _tuned.clear()
+    if mtime is not None:
+        try:
+            with open(_tunedPath(), "r") as f:
+                _tuned.update(json.load(f).get("tuned", {}))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ignoring unreadable tuned parameters {_tunedPath()}: {e}")
+    _tunedMtime = (_tunedPath(), mtime)
+
+
+def getTuned(modelName, ticker, tinterval):
+    """Tuned hyperparameters of a model for a ticker and interval, or None
+
+    Only results that beat the default configuration on the test rows are used.
+    """
+    with _lock:
+        _readTuned()
+        entry = _tuned.get(f"{modelName}|{ticker.upper()}|{tinterval}")
+    if entry is None or entry["rmse"] >= entry["defaultRmse"]:
+        return None
+    return entry
+
+
+def putTuned(modelName, ticker, tinterval, entry):
+    """Store the result of a tuning run, entry holds params, rounds, rmse and defaultRmse"""
+    global _tunedMtime
+    path = _tunedPath()
+    with _lock:
+        _readTuned()
+        _tuned[f"{modelName}|{ticker.upper()}|{tinterval}"] = entry
+        try:
+            os.makedirs(registryDir(), exist_ok=True)
+            with open(f"{path}.tmp", "w") as f:
+                json.dump({"version": 1, "tuned": _tuned}, f, indent=1)
+            os.replace(f"{path}.tmp", path)
+            _tunedMtime = (path, os.path.getmtime(path))
+        except OSError as e:
+            print(f"Could not write tuned parameters {path}: {e}")
+
+
+def clearRegistry():
+    """Forget everything in memory, stored models stay on disk"""
+    global _tunedMtime
+    with _lock:
+        _entries.clear()
+        _loaded.clear()
+        _drifts.clear()
+        _tuned.clear()
+        _tunedMtime = None
+        for name in _stats:
+            _stats[name] = 0
+
+
+def counters(reset=False):
+    """Counters of this process, a training worker hands them back to the bot
+
+    With reset they start again from zero, so a worker that runs many jobs hands
+    back each job's counts once.
+    """
+    with _lock:
+        result = dict(_stats), list(_drifts)
+        if reset:
+            for name in _stats:
+                _stats[name] = 0
+            _drifts.clear()
+        return result
+
+
+def mergeCounters(stats, drifts):
+    """Add the counters of a training worker to this process"""
+    with _lock:
+        for name, count in stats.items():
+            _stats[name] = _stats.get(name, 0) + count
+        _drifts.extend(drifts)
+
+
+def getStats():
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = len(_entries)
+        stats["bytes"] = sum(entry["bytes"] for entry in _entries.values())
+        stats["drift"] = sum(_drifts) / len(_drifts) if _drifts else None
+    return stats
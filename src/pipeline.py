@@ -0,0 +1,251 @@
+import ingestion, preprocessing, processing
+import cache
+import features
+import storage
+import singleflight
+import executor
+import modelregistry
+from config import loadConfig
+
+# trainer of each model in the model module. it is only imported by the process
+# that trains, the bot stays without xgboost, lightgbm and prophet
+trainers = {
+    "xgboost": "trainXGBoost",
+    "lightgbm": "trainLightGBM",
+    "prophet": "trainProphet",
+}
+# feature frames estimated larger are computed block by block from the cached copy
+defaultMaxFrameBytes = 64 * 1024 * 1024
+# seconds, as tuning.defaultBudget. the bot needs it for the job timeout only
+defaultTuningBudget = 600
+
+tuningConfig = loadConfig().get("tuning", {})
+
+
+def train(modelName, *args, **kwargs):
+    """Runs the trainer of modelName, see model.trainXGBoost"""
+    import model
+
+    return getattr(model, trainers[modelName])(*args, **kwargs)
+
+
+def tune(data, modelName, *args, **kwargs):
+    """Runs tuning.tune in the process that trains, searched lists the tuned settings"""
+    import tuning
+
+    entry = tuning.tune(data, modelName, *args, **kwargs)
+    return dict(entry, searched=list(tuning.searchSpaces[modelName]))
+
+
+def _trainInWorker(registryConfig, trainer, *args, **kwargs):
+    """Runs a trainer in a training worker, returns its result and registry counters"""
+    # same registry as the bot, models it or other workers stored since included
+    modelregistry.registryConfig.update(registryConfig)
+    modelregistry.loadManifest()
+    result = trainer(*args, **kwargs)
+    # the worker runs more jobs, the bot gets the counts of this one
+    return result, modelregistry.counters(reset=True)
+
+
+def runJob(fn, *args, description=None, timeout=None, **kwargs):
+    """Run a training function through the training executor, see executor.submit
+
+    With training.workers at 0 it runs in the calling thread instead.
+    """
+    if executor.workerCount() <= 0:
+        return fn(*args, **kwargs)
+    result, (stats, drifts) = executor.run(
+        _trainInWorker,
+        dict(modelregistry.registryConfig),
+        fn,
+        *args,
+        description=description,
+        timeout=timeout,
+        **kwargs,
+    )
+    # pick up the models the worker stored and count its hits and fits here
+    modelregistry.loadManifest()
+    modelregistry.mergeCounters(stats, drifts)
+    return result
+
+
+def runTrainer(modelName, *args, **kwargs):
+    """Run a trainer through the training executor
+
+    Registry hits go to a worker too. Workers stay up between jobs and keep the
+    models they loaded, so a hit costs sending the frame, while the bot process
+    never loads the model libraries.
+    """
+    description = f"{modelName} {' '.join(str(a) for a in args[1:4])}"
+    return runJob(train, modelName, *args, description=description, **kwargs)
+
+
+class StockPipeline:
+    """Runs fetch -> clean -> features -> model on in-memory frames.
+
+    Every stage hands its DataFrame to the next one directly. Nothing is written
+    to ./data unless persist is set, and nothing is ever read back from disk.
+    Concurrent pipelines for the same series share each stage through singleflight.
+    """
+
+    def __init__(
+        self,
+        ticker,
+        tperiod,
+        tinterval,
+        persist=False,
+        incremental=False,
+        resample=False,
+        featureNames=None,
+        compact=False,
+    ):
+        self.ticker = ticker
+        self.tperiod = tperiod
+        self.tinterval = tinterval
+        self.persist = persist
+        self.incremental = incremental
+        self.resample = resample
+        # None means every default feature column, models train on whatever is there
+        self.featureNames = tuple(featureNames) if featureNames else None
+        # float32 values and downcast volume in every stage, see storage.compactFrame
+        self.compact = compact
+        self.raw = None
+        self.clean = None
+        self.features = None
+
+    def _key(self, stage, *extra):
+        series = (self.ticker.upper(), self.tperiod, self.tinterval, self.compact)
+        return (stage,) + series + extra
+
+    def fetch(self):
+        if self.raw is None:
+            raw = singleflight.do(
+                self._key("fetch"),
+                ingestion.fetchStock,
+                self.ticker,
+                self.tperiod,
+                self.tinterval,
+                incremental=self.incremental,
+                persist=self.persist,
+                resample=self.resample,
+                compact=self.compact,
+            )
+            if raw.empty:
+                raise ValueError(f"No data downloaded for ticker: {self.ticker}")
+            self.raw = raw
+        return self.raw
+
+    def cleaned(self):
+        if self.clean is None:
+            self.clean = preprocessing.cleanData(
+                self.fetch(), self.ticker, self.tperiod, self.tinterval, self.persist
+            )
+        return self.clean
+
+    def _frameBytes(self):
+        # estimated size of the feature frame, raw columns plus one per feature
+        raw = self.fetch()
+        names = self.featureNames or features.featureColumns
+        itemSize = 4 if self.compact else 8
+        return len(raw) * (len(raw.columns) + 1 + len(names)) * itemSize
+
+    def _chunkedFeatures(self):
+        # too large to hold with its features, None without a copy on the volume
+        copy = cache.diskCopy(self.ticker, self.tperiod, self.tinterval)
+        if copy is None:
+            return None
+        path, fmt = copy
+        target = cache.featuresPath(path)
+        processing.addFeaturesChunked(
+            self.ticker, self.tperiod, self.tinterval, self.featureNames, target=target
+        )
+        # memory-mapped with the npy format
+        return storage.loadFrame(target, fmt)
+
+    def _buildFeatures(self):
+        maxBytes = storage.storageConfig.get("max_frame_bytes", defaultMaxFrameBytes)
+        if self._frameBytes() > maxBytes:
+            chunked = self._chunkedFeatures()
+            if chunked is not None:
+                return chunked
+        if self.incremental and self.featureNames is None:
+            # an incremental fetch appended bars, continue the saved feature state
+            return processing.refreshFeatures(
+                self.cleaned(), self.ticker, self.tperiod, self.tinterval, self.persist
+            )
+        return processing.addFeatures(
+            self.cleaned(),
+            self.ticker,
+            self.tperiod,
+            self.tinterval,
+            self.persist,
+            names=self.featureNames,
+        )
+
+    def withFeatures(self):
+        if self.features is None:
+            key = self._key("features", self.featureNames)
+            self.features = singleflight.do(key, self._buildFeatures)
+        return self.features
+
+    def memoryReport(self):
+        """Bytes held by each stage computed so far, stage -> bytes"""
+        stages = {"raw": self.raw, "clean": self.clean, "features": self.features}
+        return {
+            stage: int(data.memory_usage(deep=True).sum())
+            for stage, data in stages.items()
+            if data is not None
+        }
+
+    def train(self, modelName, dayTarget, testSize, **kwargs):
+        modelName = modelName.lower()
+        key = self._key("train", modelName, dayTarget, testSize, self.featureNames)
+        key += tuple(sorted(kwargs.items()))
+        return singleflight.do(
+            key,
+            runTrainer,
+            modelName,
+            self.withFeatures(),
+            self.ticker,
+            self.tperiod,
+            self.tinterval,
+            dayTarget,
+            testSize,
+            return_result=True,
+            **kwargs,
+        )
+
+    def tune(self, modelName, budget=None, **kwargs):
+        """Tune a tree model for this ticker and interval, see tuning.tune"""
+        modelName = modelName.lower()
+        budget = budget or tuningConfig.get("budget_seconds", defaultTuningBudget)
+        return singleflight.do(
+            self._key("tune", modelName),
+            runJob,
+            tune,
+            self.withFeatures(),
+            modelName,
+            self.ticker,
+            self.tinterval,
+            budget=budget,
+            description=f"tune {modelName} {self.ticker} {self.tinterval}",
+            # the winner and the default are still fitted once the budget is used up
+            timeout=2 * budget + 60,
+            **kwargs,
+        )
+
+
+def panelFeatures(tickers, tperiod, tinterval, featureNames=None, chunkSize=100):
+    """Fetch many tickers and compute their features in one panel pass, ticker -> frame
+
+    Tickers without data are left out.
+    """
+    raw = ingestion.fetchMany(
+        tickers, tperiod, tinterval, chunkSize=chunkSize, persist=False
+    )
+    cleaned = {
+        ticker: preprocessing.cleanData(data, ticker, tperiod, tinterval, persist=False)
+        for ticker, data in raw.items()
+        if not data.empty
+    }
+    return processing.addPanelFeatures(cleaned, featureNames)
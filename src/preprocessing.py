@@ -1,14 +1,27 @@
 import pandas
-import os
-
-
-def cleanData(data, ticker, tperiod, tinterval):
-    data = pandas.read_csv(
-        f"./data/raw/{ticker}_{tperiod}_{tinterval}.csv", header=0, parse_dates=True
-    )
-    data = data.dropna(how="all")
-    data = data.drop(data.index[[0, 1]])  # remove 2 useless rows
-    data["Close"] = pandas.to_numeric(data["Close"], errors="coerce")
-    data.to_csv(
-        f"./data/processed/{ticker}_{tperiod}_{tinterval}.csv", index=False, mode="w"
-    )
+import storage
+
+
+def normalizeRaw(data):
+    """Bring raw data into one layout: a Price date column followed by numeric columns"""
+    if isinstance(data.columns, pandas.MultiIndex):
+        data = data.set_axis(data.columns.get_level_values(0), axis=1)
+    if "Price" not in data.columns:
+        data = data.rename_axis("Price").reset_index()
+
+    # csv exports of yfinance downloads carry Ticker/Date header rows below the column names
+    dates = pandas.to_datetime(data["Price"], format="ISO8601", errors="coerce")
+    data = data[dates.notna()].assign(Price=dates[dates.notna()])
+    valueColumns = data.columns.drop("Price")
+    data[valueColumns] = data[valueColumns].apply(pandas.to_numeric, errors="coerce")
+    return data.rename_axis(None, axis=1).reset_index(drop=True)
+
+
+def cleanData(data, ticker, tperiod, tinterval, persist=True):
+    if data is None:
+        data = storage.loadSeries("raw", ticker, tperiod, tinterval)
+    data = normalizeRaw(data)
+    data = data.dropna(how="all", subset=data.columns.drop("Price"))
+    if persist:
+        storage.saveSeries(data, "processed", ticker, tperiod, tinterval)
+    return data
@@ -1,13 +1,281 @@
+import os
 import numpy, pandas
 import news
+import storage
+import features
+import cache
+import preprocessing
 
+# raw rows read per block by addFeaturesChunked
+defaultChunkRows = 100_000
 
-def addFeatures(data, ticker, tperiod, tinterval):
-    data = pandas.read_csv(
-        f"./data/processed/{ticker}_{tperiod}_{tinterval}.csv",
-        header=0,
-        parse_dates=True,
+
+def addFeatures(data, ticker, tperiod, tinterval, persist=True, names=None):
+    """Add feature columns to a cleaned series, names defaults to features.featureColumns
+
+    Only the requested features and what they depend on are computed. Results are
+    cached by the content hash of data and the version of the feature definitions,
+    the returned frame may be shared and must not be modified.
+    """
+    if data is None:
+        data = storage.loadSeries("processed", ticker, tperiod, tinterval)
+    names = features.featureColumns if names is None else list(names)
+    key = (storage.hashFrame(data), features.specVersion(names), tuple(names))
+    cached = cache.getFeatures(key)
+    if cached is not None:
+        data = cached
+    else:
+        data = _computeFeatures(data, names)
+        cache.putFeatures(key, data)
+    # cleanData stores its output under the same path, so a cache hit is written too
+    if persist:
+        storage.saveSeries(data, "processed", ticker, tperiod, tinterval)
+
+    return data
+
+
+def _computeFeatures(data, names):
+    close = data["Close"].to_numpy(dtype=numpy.float64)
+    if numpy.isnan(close).any():
+        # the recursive kernel cannot skip missing closes the way pandas ewm does
+        data = addFeaturesPandas(data)
+        missing = [name for name in names if name not in data.columns]
+        if missing:
+            raise ValueError(
+                f"{', '.join(missing)} need a series without missing closes"
+            )
+        base = data.columns.drop(features.featureColumns)
+        return data[list(base) + names].dropna()  # ensure no empty values
+    data = data.drop(columns=names, errors="ignore")
+    return _kernelFeatures(data, close, names)
+
+
+def _kernelFeatures(data, close, names):
+    volume = data["Volume"].to_numpy(dtype=numpy.float64)
+    return _joinFeatures(data, features.computeFeatures(close, volume, names), names)
+
+
+def _joinFeatures(data, columns, names):
+    # one row per feature, the transpose is the column-major block pandas stores
+    values = numpy.stack([columns[c] for c in names])
+    if data["Close"].dtype == numpy.float32:
+        # compact series get float32 features, computed in float64 and rounded once
+        values = values.astype(numpy.float32)
+
+    # ensure no empty values, usually only the warm-up rows of the rolling windows
+    keep = ~numpy.isnan(values).any(axis=0)
+    keep &= ~data.isna().to_numpy().any(axis=1)
+    first = int(keep.argmax()) if keep.any() else len(keep)
+    rows = slice(first, None) if keep[first:].all() else keep
+    added = pandas.DataFrame(
+        values[:, rows].T,
+        index=data.index[rows],
+        columns=names,
+        copy=False,
     )
+    # one concat instead of a copy of the frame per added column
+    return pandas.concat([data.iloc[rows], added], axis=1)
+
+
+def addFeaturesChunked(
+    ticker, tperiod, tinterval, names=None, chunkRows=None, target=None
+):
+    """Compute the features of a stored raw series block by block into target
+
+    For intraday histories too long to hold in memory. The raw series is read from
+    its copy in the persistent cache, or from ./data/raw without one. target is the
+    base path of the result, ./data/processed by default. Each block repeats the
+    last features.overlap rows of the one before and continues its EMAs and running
+    sums, so the stored rows equal what addFeatures gives for the whole cleaned
+    series, while memory depends only on chunkRows. Returns the number of rows stored.
+    """
+    names = features.featureColumns if names is None else list(names)
+    chunkRows = chunkRows or defaultChunkRows
+    rawPath, fmt = cache.diskCopy(ticker, tperiod, tinterval) or (
+        storage.seriesPath("raw", ticker, tperiod, tinterval),
+        None,
+    )
+    if not storage.exists(rawPath, fmt):
+        raise ValueError(f"No stored raw series for {ticker} {tperiod} {tinterval}")
+
+    def cleanedBlocks():
+        for block in storage.iterFrame(rawPath, chunkRows, fmt):
+            block = preprocessing.cleanData(block, ticker, tperiod, tinterval, False)
+            if len(block):
+                yield block
+
+    # timeFeature runs over the whole cleaned series, so its length is counted first
+    bars = sum(len(block) for block in cleanedBlocks())
+    overlap = features.overlap(names)
+    tail = {c: numpy.empty(0) for c in features.inputColumns}
+    carry = None
+    position = 0
+    target = target or storage.seriesPath("processed", ticker, tperiod, tinterval)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with storage.SeriesWriter(target, fmt) as writer:
+        for block in cleanedBlocks():
+            if block["Close"].isna().any():
+                raise ValueError(
+                    "Chunked features need a series without missing closes"
+                )
+            inputs = {
+                c: numpy.concatenate([tail[c], block[c].to_numpy(dtype=numpy.float64)])
+                for c in features.inputColumns
+            }
+            columns, carry = features.evaluateBlock(inputs, names, carry)
+            repeated = len(tail["Close"])
+            columns = {name: values[repeated:] for name, values in columns.items()}
+            if "timeFeature" in columns:
+                steps = numpy.arange(
+                    position, position + len(block), dtype=numpy.float64
+                )
+                columns["timeFeature"] = steps / max(bars - 1, 1)
+
+            block = block.drop(columns=names, errors="ignore")
+            block = block.set_axis(pandas.RangeIndex(position, position + len(block)))
+            writer.write(_joinFeatures(block, columns, names))
+            tail = {
+                c: values[max(len(values) - overlap, 0) :]
+                for c, values in inputs.items()
+            }
+            position += len(block)
+    return writer.rows
+
+
+def addPanelFeatures(series, names=None):
+    """Add feature columns to many cleaned series in one pass, ticker -> frame
+
+    The series are aligned on the union of their dates. Listing dates and days a
+    ticker did not trade are handled per ticker, so each frame equals what
+    addFeatures returns for it. Bars without a close are treated as no bar.
+    """
+    names = features.featureColumns if names is None else list(names)
+    prepared = {}
+    for ticker, data in series.items():
+        if data["Close"].isna().any():
+            data = data.dropna(subset=["Close"])
+        if data.columns.isin(names).any():
+            data = data.drop(columns=names, errors="ignore")
+        prepared[ticker] = data
+    if not prepared:
+        return {}
+
+    # shared calendar as int64 stamps, numpy instead of aligning hundreds of indexes
+    stamps = {t: _stamps(d["Price"]) for t, d in prepared.items()}
+    calendar = numpy.unique(numpy.concatenate(list(stamps.values())))
+    close = numpy.full((len(prepared), len(calendar)), numpy.nan)
+    volume = numpy.full((len(prepared), len(calendar)), numpy.nan)
+    positions = {}
+    for row, (ticker, data) in enumerate(prepared.items()):
+        positions[ticker] = numpy.searchsorted(calendar, stamps[ticker])
+        close[row, positions[ticker]] = data["Close"].to_numpy(dtype=numpy.float64)
+        volume[row, positions[ticker]] = data["Volume"].to_numpy(dtype=numpy.float64)
+
+    panel = features.computePanel(close, volume, names)
+    results = {}
+    for row, (ticker, data) in enumerate(prepared.items()):
+        columns = {name: panel[name][row, positions[ticker]] for name in names}
+        results[ticker] = _joinFeatures(data, columns, names)
+    return results
+
+
+def _stamps(dates):
+    dates = pandas.DatetimeIndex(dates)
+    if dates.tz is not None:
+        dates = dates.tz_convert("UTC").tz_localize(None)
+    return dates.as_unit("ns").asi8
+
+
+def featureState(data):
+    """Streaming state after the last bar of a cleaned series (Price date column)"""
+    state = features.FeatureState.fromSeries(data["Close"], data["Volume"])
+    if len(data):
+        state.lastTimestamp = pandas.Timestamp(data["Price"].iloc[-1]).isoformat()
+    return state
+
+
+def extendFeatures(data, newBars, state):
+    """Append the feature rows of newBars to a frame from addFeatures
+
+    state is the FeatureState after the last bar of data and is advanced bar by
+    bar, so the cost does not depend on the length of the history. data keeps the
+    RangeIndex of the cleaned series, which is what timeFeature is rescaled from.
+    """
+    rows = [
+        state.update(close, volume)
+        for close, volume in zip(newBars["Close"], newBars["Volume"])
+    ]
+    if not rows:
+        return data
+    state.lastTimestamp = pandas.Timestamp(newBars["Price"].iloc[-1]).isoformat()
+
+    index = pandas.RangeIndex(state.bars - len(rows), state.bars)
+    added = pandas.DataFrame(rows, index=index, columns=features.featureColumns)
+    added = pandas.concat([newBars.set_axis(index), added], axis=1).dropna()
+    data = pandas.concat([data, added[data.columns].astype(data.dtypes)])
+    # linspace(0, 1) over every bar of the series, as in addFeatures
+    return data.assign(timeFeature=data.index / max(state.bars - 1, 1))
+
+
+def refreshFeatures(data, ticker, tperiod, tinterval, persist=True):
+    """addFeatures with every feature column for a series an incremental fetch grew
+
+    The FeatureState cached with the series has seen every bar of its previous
+    version but the last, which may still have been forming. While those bars are
+    unchanged, the previous feature frame is extended from the state bar by bar
+    instead of running the kernel over the whole history. Otherwise, e.g. when a
+    rolling period dropped its oldest bars, the features are computed in full.
+    The state is saved again for the next refresh.
+    """
+    names = features.featureColumns
+    dataHash = storage.hashFrame(data)
+    saved = cache.getFeatureState(ticker, tperiod, tinterval)
+    if saved is not None and saved.featuresHash == dataHash:
+        return addFeatures(data, ticker, tperiod, tinterval, persist)
+
+    result, state = _extendSaved(data, saved)
+    if result is None:
+        result = addFeatures(data, ticker, tperiod, tinterval, persist)
+        state = featureState(data.iloc[:-1])
+    else:
+        cache.putFeatures((dataHash, features.specVersion(names), tuple(names)), result)
+        if persist:
+            storage.saveSeries(result, "processed", ticker, tperiod, tinterval)
+    state.seriesHash = storage.hashFrame(data.iloc[:-1])
+    state.featuresHash = dataHash
+    cache.putFeatureState(ticker, tperiod, tinterval, state)
+    return result
+
+
+def _extendSaved(data, saved):
+    # (features, state after all but the last bar), or (None, None) to recompute
+    if saved is None or saved.seriesHash is None or not 0 < saved.bars < len(data):
+        return None, None
+    # extendFeatures rescales timeFeature from the RangeIndex of the cleaned series
+    if not data.index.equals(pandas.RangeIndex(len(data))):
+        return None, None
+    newBars = data.iloc[saved.bars :]
+    if newBars[list(features.inputColumns)].isna().to_numpy().any():
+        return None, None
+    names = features.featureColumns
+    key = (saved.featuresHash, features.specVersion(names), tuple(names))
+    previous = cache.getFeatures(key)
+    if previous is None:
+        return None, None
+    if storage.hashFrame(data.iloc[: saved.bars]) != saved.seriesHash:
+        return None, None
+
+    # the cached state is left as it was if anything below fails
+    state = features.FeatureState.fromDict(saved.toDict())
+    previous = previous[previous.index < saved.bars]
+    result = extendFeatures(previous, newBars.iloc[:-1], state)
+    nextState = features.FeatureState.fromDict(state.toDict())
+    return extendFeatures(result, newBars.iloc[-1:], state), nextState
+
+
+def addFeaturesPandas(data):
+    """Reference implementation with one pandas call per indicator, rows not dropped yet"""
+    data = data.copy()  # columns are added below, keep the caller's frame intact
     data["priceChange"] = data["Close"].pct_change() * 100
     data["ma10"] = data["Close"].rolling(window=10).mean()
     data["ma50"] = data["Close"].rolling(window=50).mean()
@@ -44,10 +312,4 @@ def addFeatures(data, ticker, tperiod, tinterval):
     RSIavgLoss = RSIloss.ewm(com=13, adjust=False).mean()
     RSI = RSIavgGain / RSIavgLoss
     data["RSI"] = 100 - (100 / (1 + RSI))
-
-    data = data.dropna()  # ensure no empty values
-    data.to_csv(
-        f"./data/processed/{ticker}_{tperiod}_{tinterval}.csv", index=False, mode="w"
-    )
-
     return data
@@ -0,0 +1,51 @@
+import numpy
+import pandas
+
+# how each OHLCV column of the finer bars folds into one coarser bar
+barRules = {
+    "Open": "first",
+    "High": "max",
+    "Low": "min",
+    "Close": "last",
+    "Volume": "sum",
+}
+# intervals counted in trading sessions, buckets never span a day without trading
+sessionBuckets = {"5d": 5}
+# intervals bounded by the calendar (weeks run Monday to Sunday)
+calendarBuckets = {"1wk": "W-SUN", "1mo": "M", "3mo": "Q"}
+# finer intervals a coarser one can be built from, preferred first
+finerIntervals = {
+    "5d": ["1d"],
+    "1wk": ["1d"],
+    "1mo": ["1d"],
+    "3mo": ["1mo", "1d"],
+}
+
+
+def canResample(tinterval):
+    return tinterval in finerIntervals
+
+
+def resampleBars(data, tinterval):
+    """Aggregate finer OHLCV bars into tinterval bars
+
+    Only sessions present in data form buckets, so holidays never create empty
+    bars. Each bar is labelled with the first session it contains.
+    """
+    data = data.dropna(how="all")
+    if data.empty:
+        return data
+
+    index = data.index
+    if tinterval in sessionBuckets:
+        sessions = pandas.factorize(index.normalize())[0]
+        keys = sessions // sessionBuckets[tinterval]
+    else:
+        naive = index.tz_localize(None) if index.tz is not None else index
+        keys = numpy.asarray(naive.to_period(calendarBuckets[tinterval]).asi8)
+
+    rules = {c: barRules[c] for c in data.columns if c in barRules}
+    bars = data.groupby(keys).agg(rules)
+    labels = pandas.Series(index, index=index).groupby(keys).first()
+    bars.index = pandas.DatetimeIndex(labels, name=index.name)
+    return bars
@@ -0,0 +1,140 @@
+import math
+import os
+import sys
+from config import loadConfig
+
+cgroupRoot = "/sys/fs/cgroup"
+# anonymous memory of one process, measured after xgboost, lightgbm and prophet
+# fits on a 1y daily series: about 150 MiB for a worker and 146 MiB for the fork
+# server with the model libraries preloaded, 118 MiB for the bot without them
+defaultWorkerMemory = 150 * 1024 * 1024
+# read by the BLAS/OpenMP runtimes of numpy, xgboost and lightgbm when they load, and by cmdstan
+threadVariables = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "STAN_NUM_THREADS",
+]
+
+resourceConfig = loadConfig().get("resources", {})
+
+# effective settings of govern(), None until it ran
+_settings = None
+
+
+def _read(path):
+    with open(path, "r") as f:
+        return f.read().strip()
+
+
+def cpuQuota(root=cgroupRoot):
+    """CPUs the cgroup may use, e.g. 0.1 for a 100m limit, None without a quota"""
+    try:  # cgroup v2
+        quota, period = _read(os.path.join(root, "cpu.max")).split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:  # cgroup v1
+        quota = int(_read(os.path.join(root, "cpu", "cpu.cfs_quota_us")))
+        period = int(_read(os.path.join(root, "cpu", "cpu.cfs_period_us")))
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def memoryLimit(root=cgroupRoot):
+    """Memory limit of the cgroup in bytes, None without one"""
+    try:  # cgroup v2
+        value = _read(os.path.join(root, "memory.max"))
+        return None if value == "max" else int(value)
+    except (OSError, ValueError):
+        pass
+    try:  # cgroup v1 reports a huge number when there is no limit
+        value = int(_read(os.path.join(root, "memory", "memory.limit_in_bytes")))
+        return value if value < 2**60 else None
+    except (OSError, ValueError):
+        return None
+
+
+def hostCpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not on linux
+        return os.cpu_count() or 1
+
+
+def govern(root=cgroupRoot):
+    """Size training workers and library thread pools to the pod's limits
+
+    Reads the cgroup CPU quota and memory limit. Workers are capped by both, and
+    every worker gets an equal share of the CPUs as its thread count, at least one.
+    resources.threads and resources.workers in config.json override them. Call it
+    before numpy and the model libraries are imported, their thread pools read the
+    environment when they load. Pools already loaded are limited as well. Returns
+    the effective settings.
+    """
+    global _settings
+    import executor
+
+    quota = cpuQuota(root)
+    memory = memoryLimit(root)
+    host = hostCpus()
+    cpus = min(host, max(1, math.ceil(quota))) if quota else host
+
+    workers = resourceConfig.get("workers")
+    if workers is None:
+        workers = executor.workerCount()
+        if workers > 0:
+            workers = min(workers, cpus)
+            if memory:
+                perWorker = resourceConfig.get(
+                    "worker_memory_bytes", defaultWorkerMemory
+                )
+                # one share each for the bot and the fork server
+                workers = max(1, min(workers, memory // perWorker - 2))
+    executor.executorConfig["workers"] = workers
+
+    threads = resourceConfig.get("threads") or max(1, cpus // max(workers, 1))
+    for name in threadVariables:
+        os.environ[name] = str(threads)
+    _limitLoaded(threads)
+
+    _settings = {
+        "cpuQuota": quota,
+        "memoryLimit": memory,
+        "hostCpus": host,
+        "workers": workers,
+        "threads": threads,
+        "source": (
+            "config" if resourceConfig.get("threads") else "cgroup" if quota else "host"
+        ),
+    }
+    return _settings
+
+
+def _limitLoaded(threads):
+    # libraries imported before govern() already sized their pools
+    if "numpy" in sys.modules:
+        from threadpoolctl import threadpool_limits  # comes with scikit-learn
+
+        threadpool_limits(threads)
+    if "xgboost" in sys.modules:
+        sys.modules["xgboost"].set_config(nthread=threads)
+
+
+def threads():
+    """Thread count per training job, None when nothing limits it
+
+    Training workers inherit it through the environment of the fork server.
+    """
+    if _settings is not None:
+        return _settings["threads"]
+    value = os.environ.get("OMP_NUM_THREADS")
+    return int(value) if value and value.isdigit() else None
+
+
+def settings():
+    """Effective settings of govern(), None before it ran"""
+    return dict(_settings) if _settings is not None else None
@@ -0,0 +1,62 @@
+import threading
+from concurrent.futures import Future
+
+# key -> Future of the computation currently running for it
+_inflight = {}
+_lock = threading.Lock()
+# per stage (first element of the key): computations run and callers that joined one
+_stats = {}
+
+
+def do(key, fn, *args, **kwargs):
+    """Run fn once for concurrent callers with the same key, all of them get its result.
+
+    The first caller computes, callers arriving while it runs wait for the same
+    result (or exception). Results are shared objects, callers must not mutate them.
+    """
+    stage = key[0] if isinstance(key, tuple) else key
+    with _lock:
+        stats = _stats.setdefault(stage, {"executions": 0, "merged": 0})
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+            stats["executions"] += 1
+        else:
+            stats["merged"] += 1
+
+    if not leader:
+        return future.result()
+
+    try:
+        result = fn(*args, **kwargs)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _lock:
+            del _inflight[key]
+
+
+def inflightCount():
+    with _lock:
+        return len(_inflight)
+
+
+def getStats():
+    with _lock:
+        stages = {stage: dict(stats) for stage, stats in _stats.items()}
+    return {
+        "stages": stages,
+        "executions": sum(s["executions"] for s in stages.values()),
+        "merged": sum(s["merged"] for s in stages.values()),
+    }
+
+
+def resetStats():
+    with _lock:
+        _stats.clear()
@@ -0,0 +1,367 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy
+import pandas
+from config import loadConfig
+
+try:
+    import pyarrow  # noqa: F401 - optional, only needed for the parquet format
+
+    parquetAvailable = True
+except ImportError:
+    parquetAvailable = False
+
+# npy: values matrix + index as .npy files with a json sidecar, loaded memory-mapped
+# parquet: single columnar file, needs pyarrow
+# csv: plain text, kept for exports and debugging
+formats = ["npy", "parquet", "csv"]
+defaultFormat = "npy"
+
+storageConfig = loadConfig().get("storage", {})
+
+
+def compactFrame(data):
+    """float32 prices and features, the smallest integer type that holds Volume
+
+    Dates stay datetime64. Values already in compact dtypes are left as they are.
+    """
+    dtypes = {}
+    for column, dtype in data.dtypes.items():
+        if column == "Volume" and pandas.api.types.is_numeric_dtype(dtype):
+            volume = data[column]
+            whole = volume.notna().all() and (volume % 1 == 0).all()
+            if whole and volume.min() >= 0:
+                dtypes[column] = numpy.min_scalar_type(int(volume.max()))
+            elif dtype != numpy.float32:
+                dtypes[column] = numpy.float32
+        elif dtype == numpy.float64:
+            dtypes[column] = numpy.float32
+    dtypes = {c: t for c, t in dtypes.items() if data[c].dtype != t}
+    return data.astype(dtypes) if dtypes else data
+
+
+def getFormat(fmt=None):
+    fmt = fmt or storageConfig.get("format", defaultFormat)
+    if fmt not in formats:
+        print(f"Unknown storage format '{fmt}', using {defaultFormat}")
+        return defaultFormat
+    if fmt == "parquet" and not parquetAvailable:
+        print(f"pyarrow is not installed, using {defaultFormat} instead of parquet")
+        return defaultFormat
+    return fmt
+
+
+def seriesPath(kind, ticker, tperiod, tinterval):
+    """Base path of a stored series without extension, kind is raw or processed"""
+    return f"./data/{kind}/{ticker}_{tperiod}_{tinterval}"
+
+
+def hashFrame(data):
+    """Content hash of a frame's index and values, stable across processes"""
+    if isinstance(data.index, pandas.DatetimeIndex):
+        data = data.set_axis(data.index.as_unit("ns"))  # stored series come back as ns
+    rowHashes = pandas.util.hash_pandas_object(data, index=True).to_numpy()
+    digest = hashlib.sha1(rowHashes.tobytes())
+    digest.update(",".join(str(c) for c in data.columns).encode())
+    return digest.hexdigest()
+
+
+def barStamps(data):
+    """Bar times of a frame as UTC nanoseconds, from its Price column or its index"""
+    dates = data["Price"] if "Price" in data.columns else data.index
+    dates = pandas.DatetimeIndex(pandas.to_datetime(dates, utc=True))
+    return dates.as_unit("ns").asi8
+
+
+def _npyPaths(basePath):
+    return f"{basePath}.npy", f"{basePath}.index.npy", f"{basePath}.json"
+
+
+def filePaths(basePath, fmt=None):
+    fmt = getFormat(fmt)
+    if fmt == "npy":
+        return list(_npyPaths(basePath))
+    return [f"{basePath}.{fmt}"]
+
+
+def exists(basePath, fmt=None):
+    return all(os.path.exists(path) for path in filePaths(basePath, fmt))
+
+
+def _toIndexed(data):
+    # processed frames carry their dates in the Price column, store them as the index
+    if "Price" in data.columns:
+        data = data.set_index("Price")
+    if not isinstance(data.index, pandas.DatetimeIndex):
+        # rows without a parseable timestamp, e.g. csv header rows, cannot be stored
+        index = pandas.to_datetime(data.index, format="ISO8601", errors="coerce")
+        data = data[index.notna()].set_axis(index[index.notna()])
+    text = data.select_dtypes(exclude="number").columns
+    if len(text):
+        data = data.assign(
+            **{c: pandas.to_numeric(data[c], errors="coerce") for c in text}
+        )
+    return data
+
+
+def _fromIndexed(data):
+    if data.index.name == "Price":
+        data = data.reset_index()
+    return data
+
+
+def _utcStamps(index):
+    # nanoseconds since the epoch in UTC, _npyFrame converts back to meta["tz"]
+    if index.tz is not None:
+        index = index.tz_convert("UTC").tz_localize(None)
+    return index.as_unit("ns").asi8
+
+
+def _saveNpy(data, basePath):
+    valuesPath, indexPath, metaPath = _npyPaths(basePath)
+    index = data.index
+    meta = {
+        "columns": [str(c) for c in data.columns],
+        "dtypes": {str(c): str(t) for c, t in data.dtypes.items()},
+        "indexName": index.name,
+        "tz": str(index.tz) if index.tz is not None else None,
+        "rows": len(data),
+    }
+    # column-major so each column is one contiguous run in the memory map
+    values = numpy.asfortranarray(data.to_numpy(dtype=numpy.result_type(*data.dtypes)))
+    stamps = _utcStamps(index)
+
+    # sidecar is swapped in last, loaders check its row count against the arrays
+    for path, array in ((valuesPath, values), (indexPath, stamps)):
+        with open(f"{path}.tmp", "wb") as f:
+            numpy.save(f, array)
+        os.replace(f"{path}.tmp", path)
+    with open(f"{metaPath}.tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(f"{metaPath}.tmp", metaPath)
+
+
+def _loadNpy(basePath, mmap=True):
+    valuesPath, indexPath, metaPath = _npyPaths(basePath)
+    with open(metaPath, "r") as f:
+        meta = json.load(f)
+    mode = "r" if mmap else None
+    values = numpy.load(valuesPath, mmap_mode=mode)
+    stamps = numpy.load(indexPath, mmap_mode=mode)
+    if len(values) != meta["rows"] or len(stamps) != meta["rows"]:
+        raise ValueError(f"Stored series {basePath} is incomplete")
+    return _npyFrame(values, stamps, meta)
+
+
+def _npyFrame(values, stamps, meta):
+    index = pandas.DatetimeIndex(numpy.asarray(stamps).view("datetime64[ns]"))
+    if meta["tz"]:
+        index = index.tz_localize("UTC").tz_convert(meta["tz"])
+    index.name = meta["indexName"]
+    data = pandas.DataFrame(values, index=index, columns=meta["columns"], copy=False)
+    # integer columns such as Volume were widened to share the values matrix
+    mixed = {c: t for c, t in meta["dtypes"].items() if t != str(values.dtype)}
+    if mixed:
+        data = data.astype(mixed)
+    return data
+
+
+def saveFrame(data, basePath, fmt=None):
+    """Store a frame with a datetime index (or a Price date column) atomically"""
+    fmt = getFormat(fmt)
+    data = _toIndexed(data)
+    if fmt == "npy":
+        _saveNpy(data, basePath)
+        return
+    path = f"{basePath}.{fmt}"
+    tmpPath = f"{path}.tmp"
+    if fmt == "parquet":
+        data.to_parquet(tmpPath)
+    else:
+        data.to_csv(tmpPath, mode="w")
+    os.replace(tmpPath, path)
+
+
+def loadFrame(basePath, fmt=None, mmap=True, compact=None):
+    """Load a stored frame, returns None when nothing (complete) is stored
+
+    compact defaults to storage.compact and casts to compactFrame dtypes on load.
+    """
+    fmt = getFormat(fmt)
+    compact = storageConfig.get("compact", False) if compact is None else compact
+    if not exists(basePath, fmt):
+        return None
+    try:
+        if fmt == "npy":
+            data = _loadNpy(basePath, mmap=mmap)
+        elif fmt == "parquet":
+            data = pandas.read_parquet(f"{basePath}.parquet")
+        else:
+            data = pandas.read_csv(f"{basePath}.csv", index_col=0, parse_dates=True)
+    except (ValueError, OSError, KeyError, json.JSONDecodeError) as e:
+        print(f"Could not read stored series {basePath}: {e}")
+        return None
+    if compact:
+        data = compactFrame(data)
+    return _fromIndexed(data)
+
+
+def iterFrame(basePath, rows, fmt=None, compact=None):
+    """Read a stored frame in blocks of at most rows rows, in the layout of loadFrame
+
+    Only one block is in memory at a time, the npy format reads it from the memory map.
+    """
+    fmt = getFormat(fmt)
+    compact = storageConfig.get("compact", False) if compact is None else compact
+    if not exists(basePath, fmt):
+        return
+    if fmt == "npy":
+        valuesPath, indexPath, metaPath = _npyPaths(basePath)
+        with open(metaPath, "r") as f:
+            meta = json.load(f)
+        values = numpy.load(valuesPath, mmap_mode="r")
+        stamps = numpy.load(indexPath, mmap_mode="r")
+        if len(values) != meta["rows"] or len(stamps) != meta["rows"]:
+            raise ValueError(f"Stored series {basePath} is incomplete")
+        blocks = (
+            _npyFrame(values[start : start + rows], stamps[start : start + rows], meta)
+            for start in range(0, meta["rows"], rows)
+        )
+    elif fmt == "parquet":
+        import pyarrow.parquet
+
+        batches = pyarrow.parquet.ParquetFile(f"{basePath}.parquet").iter_batches(rows)
+        blocks = (batch.to_pandas() for batch in batches)
+    else:
+        blocks = pandas.read_csv(
+            f"{basePath}.csv", index_col=0, parse_dates=True, chunksize=rows
+        )
+    for block in blocks:
+        yield _fromIndexed(compactFrame(block) if compact else block)
+
+
+class SeriesWriter:
+    """Stores a frame block by block, for results too long to hold in memory
+
+    Use it as a context manager. Blocks are appended to temporary files that
+    replace the stored series on close, so readers never see a partial series.
+    """
+
+    def __init__(self, basePath, fmt=None):
+        self.basePath = basePath
+        self.fmt = getFormat(fmt)
+        self.rows = 0
+        self._meta = None
+        self._files = {}
+        self._parquet = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, exc, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, data):
+        data = _toIndexed(data)
+        if self.fmt == "npy":
+            self._writeNpy(data)
+        elif self.fmt == "parquet":
+            import pyarrow.parquet
+
+            table = pyarrow.Table.from_pandas(data)
+            if self._parquet is None:
+                path = f"{self.basePath}.parquet.tmp"
+                self._parquet = pyarrow.parquet.ParquetWriter(path, table.schema)
+            self._parquet.write_table(table)
+        else:
+            first = self.rows == 0
+            data.to_csv(
+                f"{self.basePath}.csv.tmp", mode="w" if first else "a", header=first
+            )
+        self.rows += len(data)
+
+    def _writeNpy(self, data):
+        valuesPath, indexPath, _ = _npyPaths(self.basePath)
+        index = data.index
+        if self._meta is None:
+            self._meta = {
+                "columns": [str(c) for c in data.columns],
+                "dtypes": {str(c): str(t) for c, t in data.dtypes.items()},
+                "indexName": index.name,
+                "tz": str(index.tz) if index.tz is not None else None,
+            }
+            self._dtype = numpy.result_type(*data.dtypes)
+            for path in (valuesPath, indexPath):
+                self._files[path] = open(f"{path}.part", "wb")
+        # row-major, appending a block is one sequential write
+        data.to_numpy(dtype=self._dtype).tofile(self._files[valuesPath])
+        _utcStamps(index).tofile(self._files[indexPath])
+
+    def close(self):
+        """Swap the written blocks in as the stored series, nothing happens without rows"""
+        if self.fmt == "npy":
+            self._closeNpy()
+        elif self.fmt == "parquet":
+            if self._parquet is not None:
+                self._parquet.close()
+                os.replace(f"{self.basePath}.parquet.tmp", f"{self.basePath}.parquet")
+        elif os.path.exists(f"{self.basePath}.csv.tmp"):
+            os.replace(f"{self.basePath}.csv.tmp", f"{self.basePath}.csv")
+
+    def _closeNpy(self):
+        if self._meta is None:
+            return
+        valuesPath, indexPath, metaPath = _npyPaths(self.basePath)
+        arrays = {
+            valuesPath: (self._dtype, (self.rows, len(self._meta["columns"]))),
+            indexPath: (numpy.dtype(numpy.int64), (self.rows,)),
+        }
+        for path, (dtype, shape) in arrays.items():
+            self._files.pop(path).close()
+            header = {
+                "descr": numpy.lib.format.dtype_to_descr(dtype),
+                "fortran_order": False,
+                "shape": shape,
+            }
+            # the header goes in front of the appended rows, copied in fixed-size pieces
+            with open(f"{path}.tmp", "wb") as f, open(f"{path}.part", "rb") as part:
+                numpy.lib.format.write_array_header_1_0(f, header)
+                shutil.copyfileobj(part, f)
+            os.remove(f"{path}.part")
+            os.replace(f"{path}.tmp", path)
+        with open(f"{metaPath}.tmp", "w") as f:
+            json.dump(dict(self._meta, rows=self.rows), f)
+        os.replace(f"{metaPath}.tmp", metaPath)
+
+    def discard(self):
+        """Drop everything written so far, the stored series stays as it was"""
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+        if self._parquet is not None:
+            self._parquet.close()
+        for path in filePaths(self.basePath, self.fmt):
+            for leftover in (f"{path}.part", f"{path}.tmp"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+
+def saveSeries(data, kind, ticker, tperiod, tinterval, fmt=None):
+    os.makedirs(f"./data/{kind}", exist_ok=True)
+    saveFrame(data, seriesPath(kind, ticker, tperiod, tinterval), fmt)
+
+
+def loadSeries(kind, ticker, tperiod, tinterval, fmt=None):
+    return loadFrame(seriesPath(kind, ticker, tperiod, tinterval), fmt)
+
+
+def exportCsv(data, path):
+    """Write a frame as flat csv to a path or buffer, whatever the storage format"""
+    data = _fromIndexed(_toIndexed(data))
+    data.to_csv(path, index=False, mode="w")
+    return path
@@ -0,0 +1,164 @@
+import math
+import threading
+import numpy
+import xgboost, lightgbm
+from sklearn.utils import check_random_state
+import storage
+import cache
+import resources
+
+
+class TrainingSet:
+    """Feature matrix and target of a feature frame, shared by the tree models
+
+    The features are copied once into a contiguous row-major matrix. train, test
+    and future rows are views on it (copies only when shuffling). Native XGBoost and
+    LightGBM datasets are built from it on first use and kept, so training again on
+    the same data skips the conversion and the binning of every feature.
+    """
+
+    def __init__(
+        self,
+        data,
+        dayTarget,
+        testSize,
+        shuffle=False,
+        seed=None,
+        dataHash=None,
+        base=None,
+    ):
+        # content hash of data, None for random splits that are never reused
+        self.dataHash = dataHash
+        # another horizon of the same data, its matrix and feature bins are shared
+        self.base = base
+        if base is not None:
+            self.featureNames = base.featureNames
+            self.matrix = base.matrix
+            close = base.close
+        else:
+            columns = data.columns.drop(["Price", "Target"], errors="ignore")
+            self.featureNames = [str(c) for c in columns]
+            # compact frames keep float32 features, trees split on the same values
+            dtype = (
+                numpy.float32 if data["Close"].dtype == numpy.float32 else numpy.float64
+            )
+            self.matrix = numpy.ascontiguousarray(data[columns].to_numpy(dtype=dtype))
+            close = data["Close"].to_numpy(dtype=numpy.float64)
+        self.close = close
+
+        # rows whose close dayTarget bars later is known
+        labelled = len(close) - max(dayTarget, 0)
+        self.target = close[len(close) - labelled :]
+        # same sizes as sklearn's train_test_split
+        if isinstance(testSize, float):
+            testRows = math.ceil(testSize * labelled)
+        else:
+            testRows = int(testSize)
+        self.trainRows = labelled - testRows
+        self.labelled = labelled
+
+        self._order = None
+        if shuffle:
+            order = check_random_state(seed).permutation(labelled)
+            # train_test_split puts the test rows first in its permutation
+            self._order = (order[testRows:], order[:testRows])
+        self._native = {}
+        self._lock = threading.Lock()
+
+    def _rows(self, part):
+        if self._order is not None:
+            return self._order[part == "test"]
+        if part == "train":
+            return slice(0, self.trainRows)
+        return slice(self.trainRows, self.labelled)
+
+    @property
+    def trainX(self):
+        return self.matrix[self._rows("train")]
+
+    @property
+    def trainY(self):
+        return self.target[self._rows("train")]
+
+    @property
+    def testX(self):
+        return self.matrix[self._rows("test")]
+
+    @property
+    def testY(self):
+        return self.target[self._rows("test")]
+
+    @property
+    def future(self):
+        """Features of the last labelled row, the input of the future prediction"""
+        return self.matrix[self.labelled - 1 : self.labelled]
+
+    def _nativeSet(self, key, build):
+        with self._lock:
+            if key not in self._native:
+                self._native[key] = build()
+            return self._native[key]
+
+    def xgbTrain(self):
+        """Training rows as an XGBoost QuantileDMatrix, quantized once for hist trees"""
+        return self._nativeSet(
+            ("xgboost",),
+            lambda: xgboost.QuantileDMatrix(
+                self.trainX,
+                label=self.trainY,
+                feature_names=self.featureNames,
+                ref=self.base.xgbTrain() if self.base is not None else None,
+                nthread=resources.threads(),
+            ),
+        )
+
+    def lgbTrain(self, params):
+        """Training rows as a constructed lightgbm.Dataset, binned once per params"""
+
+        def build():
+            reference = self.base.lgbTrain(params) if self.base is not None else None
+            dataset = lightgbm.Dataset(
+                self.trainX,
+                label=self.trainY,
+                feature_name=self.featureNames,
+                params=params,
+                reference=reference,
+                free_raw_data=False,
+            )
+            return dataset.construct()
+
+        return self._nativeSet(("lightgbm",) + tuple(sorted(params.items())), build)
+
+    def lgbContinue(self, params):
+        """Training rows for continuing a booster, binned like lgbTrain
+
+        Continuing sets init scores on the dataset, so the shared one is left alone.
+        """
+        return lightgbm.Dataset(
+            self.trainX,
+            label=self.trainY,
+            feature_name=self.featureNames,
+            params=params,
+            reference=self.lgbTrain(params),
+            free_raw_data=False,
+        )
+
+
+def getTrainingSet(
+    data, dayTarget, testSize, shuffle=False, seed=None, dataHash=None, base=None
+):
+    """TrainingSet of a feature frame, reused while the same frame is trained on
+
+    dataHash saves hashing data again, base is a TrainingSet of the same data for
+    another horizon to share the matrix and feature bins with.
+    """
+    if shuffle and seed is None:
+        # a new split every time
+        return TrainingSet(data, dayTarget, testSize, shuffle, base=base)
+    dataHash = dataHash or storage.hashFrame(data)
+    key = (dataHash, dayTarget, testSize, shuffle, seed)
+    dataset = cache.getDataset(key)
+    if dataset is None:
+        dataset = TrainingSet(data, dayTarget, testSize, shuffle, seed, dataHash, base)
+        cache.putDataset(key, dataset)
+    return dataset
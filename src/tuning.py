@@ -0,0 +1,186 @@
+import time
+import numpy, xgboost, lightgbm
+from sklearn.utils import check_random_state
+import model
+import modelregistry
+import resources
+import trainset
+from config import loadConfig
+
+# a tuning run is meant for off-hours, it stops drawing fits after budget seconds
+defaultBudget = 600
+defaultCandidates = 27
+# successive halving keeps the best 1/eta of the candidates and gives them eta
+# times the boosting rounds, from minRounds up to maxRounds
+defaultEta = 3
+defaultMinRounds = 25
+defaultMaxRounds = 675
+# the last share of the training rows is the validation tail for early stopping
+defaultValidation = 0.2
+defaultPatience = 20
+
+tuningConfig = loadConfig().get("tuning", {})
+
+
+def _logUniform(low, high):
+    return lambda rng: float(10 ** rng.uniform(low, high))
+
+
+def _uniform(low, high):
+    return lambda rng: float(rng.uniform(low, high))
+
+
+def _integer(low, high):
+    return lambda rng: int(rng.randint(low, high + 1))
+
+
+# hyperparameter -> draw(rng) of each tree model, all of them grow histogram trees
+searchSpaces = {
+    "xgboost": {
+        "learning_rate": _logUniform(-2, -0.5),
+        "max_depth": _integer(2, 8),
+        "min_child_weight": _logUniform(-1, 1.5),
+        "subsample": _uniform(0.5, 1),
+        "colsample_bytree": _uniform(0.5, 1),
+        "reg_lambda": _logUniform(-2, 1),
+    },
+    "lightgbm": {
+        "learning_rate": _logUniform(-2, -0.5),
+        "num_leaves": _integer(4, 63),
+        "min_data_in_leaf": _integer(5, 50),
+        "feature_fraction": _uniform(0.5, 1),
+        "bagging_fraction": _uniform(0.5, 1),
+        "lambda_l2": _logUniform(-2, 1),
+    },
+}
+fixedParams = {
+    "xgboost": {"tree_method": "hist"},
+    "lightgbm": {"bagging_freq": 1, "random_state": 42},
+}
+
+
+def _fit(modelName, params, rounds, split):
+    """(best rounds, validation rmse) of up to rounds trees, stopping early on the tail"""
+    fitX, fitY, validX, validY = split
+    patience = tuningConfig.get("patience", defaultPatience)
+    if modelName == "xgboost":
+        train = xgboost.QuantileDMatrix(fitX, label=fitY, nthread=resources.threads())
+        valid = xgboost.QuantileDMatrix(validX, label=validY, ref=train)
+        booster = xgboost.train(
+            model.withThreads(dict(params, eval_metric="rmse"), "nthread"),
+            train,
+            num_boost_round=rounds,
+            evals=[(valid, "valid")],
+            early_stopping_rounds=patience,
+            verbose_eval=False,
+        )
+        return booster.best_iteration + 1, float(booster.best_score)
+
+    params = model.withThreads(params, "num_threads")
+    train = lightgbm.Dataset(fitX, label=fitY, params=params)
+    valid = lightgbm.Dataset(validX, label=validY, reference=train)
+    booster = lightgbm.train(
+        dict(params, metric="rmse"),
+        train,
+        num_boost_round=rounds,
+        valid_sets=[valid],
+        callbacks=[lightgbm.early_stopping(patience, verbose=False)],
+    )
+    return booster.best_iteration or rounds, booster.best_score["valid_0"]["rmse"]
+
+
+def _testRmse(modelName, params, rounds, dataset):
+    kit = model.boosters[modelName]
+    booster = kit["boost"](params, dataset, rounds, None)
+    predictions = kit["predict"](booster, dataset.testX)
+    return float(numpy.sqrt(numpy.mean((predictions - dataset.testY) ** 2)))
+
+
+def tune(
+    data,
+    modelName,
+    ticker,
+    tinterval,
+    dayTarget=None,
+    testSize=None,
+    budget=None,
+    candidates=None,
+    seed=0,
+):
+    """Search the hyperparameters of a tree model for a series by successive halving
+
+    Candidates are drawn at random around the default configuration, which is
+    always one of them. Every rung fits the surviving candidates on the training
+    rows minus a validation tail with early stopping, so a rung only costs the
+    rounds that still help. Fits stop once budget seconds are used up, the best
+    candidate of the highest rung reached wins. Its rounds are where it stopped.
+
+    The winner and the default are then fitted on all training rows and scored on
+    the test rows. The result is stored in the model registry, and predictions of
+    this ticker and interval use it when it beat the default. Returns the entry.
+    """
+    config = tuningConfig
+    modelName = modelName.lower()
+    dayTarget = dayTarget or config.get("days_ahead", 5)
+    testSize = testSize or config.get("test_size", 0.2)
+    budget = budget or config.get("budget_seconds", defaultBudget)
+    candidates = candidates or config.get("candidates", defaultCandidates)
+    eta = config.get("eta", defaultEta)
+    maxRounds = config.get("max_rounds", defaultMaxRounds)
+    started = time.monotonic()
+    deadline = started + budget
+
+    dataset = trainset.TrainingSet(data, dayTarget, testSize)
+    validRows = max(
+        int(dataset.trainRows * config.get("validation", defaultValidation)), 1
+    )
+    fitRows = dataset.trainRows - validRows
+    if fitRows < 10:
+        raise ValueError(f"Not enough rows ({len(data)}) to tune {modelName}")
+    trainX, trainY = dataset.trainX, dataset.trainY
+    split = (trainX[:fitRows], trainY[:fitRows], trainX[fitRows:], trainY[fitRows:])
+
+    rng = check_random_state(seed)
+    default = dict(model.boosterParams[modelName], **fixedParams[modelName])
+    space = searchSpaces[modelName]
+    configs = [default] + [
+        dict(default, **{name: draw(rng) for name, draw in space.items()})
+        for _ in range(candidates - 1)
+    ]
+
+    # candidate -> (rounds of its rung, validation rmse, rounds before stopping)
+    scores = {}
+    alive = list(range(len(configs)))
+    rounds = config.get("min_rounds", defaultMinRounds)
+    fits = 0
+    while True:
+        for candidate in alive:
+            if time.monotonic() > deadline:
+                break
+            best, score = _fit(modelName, configs[candidate], rounds, split)
+            scores[candidate] = (rounds, score, best)
+            fits += 1
+        if time.monotonic() > deadline or rounds >= maxRounds:
+            break
+        alive = sorted(alive, key=lambda c: scores[c][1])[: max(len(alive) // eta, 1)]
+        rounds = min(rounds * eta, maxRounds)
+    if not scores:
+        raise ValueError(f"A tuning budget of {budget} seconds is too small")
+
+    winner = min(scores, key=lambda c: (-scores[c][0], scores[c][1]))
+    _, validRmse, bestRounds = scores[winner]
+    params = configs[winner]
+    entry = {
+        "params": params,
+        "rounds": int(bestRounds),
+        "rmse": _testRmse(modelName, params, bestRounds, dataset),
+        "defaultRmse": _testRmse(modelName, default, model.boostRounds, dataset),
+        "validRmse": float(validRmse),
+        "daysAhead": dayTarget,
+        "candidates": len(configs),
+        "fits": fits,
+        "seconds": time.monotonic() - started,
+        "tunedAt": time.time(),
+    }
+    modelregistry.putTuned(modelName, ticker, tinterval, entry)
+    return entry
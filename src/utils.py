@@ -1,11 +1,13 @@
 # backtrader
-import pandas, os
-import matplotlib.pyplot as plt
+import pandas, os, sys
 import numpy as np
 from datetime import datetime, timedelta
 import gc
 import shutil
 import json
+import glob
+import cache
+import storage
 
 PERSISTENT_DIR = "/persistent"  # path for kubernetes persistent volume
 USERS_FILE = os.path.join(
@@ -65,13 +67,48 @@ def loadData(filePath):
     filename = os.path.basename(filePath)
     name_without_ext = os.path.splitext(filename)[0]
     ticker, tperiod, tinterval = name_without_ext.split("_")
+    if not str(filePath).endswith(".csv"):
+        # binary formats are addressed by their base path
+        return storage.loadFrame(os.path.splitext(str(filePath))[0])
     data = pandas.read_csv(filePath, header=0, parse_dates=True)
     return data
 
 
+def generateStockChart(data, ticker, period, interval):
+    """Render the price chart on demand, reusing the png while the data is unchanged"""
+    chartDir = "./data/charts"
+    prefix = f"{ticker}_{period}_{interval}_"
+    chartPath = os.path.join(chartDir, f"{prefix}{storage.hashFrame(data)[:16]}.png")
+    if os.path.exists(chartPath):
+        return chartPath
+
+    os.makedirs(chartDir, exist_ok=True)
+    # charts of older data for the same series are never served again
+    for stale in glob.glob(os.path.join(chartDir, f"{prefix}*.png")):
+        os.remove(stale)
+
+    # matplotlib is loaded by the first chart, not by every process importing utils
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 5))
+    plt.plot(data.index, data["Close"], label="Close Price")
+    plt.plot(data.index, data["Open"], label="Open Price")
+    plt.title(f"{ticker} Stock Price - {period} at {interval} interval")
+    plt.xlabel("Date")
+    plt.ylabel("Price (USD)")
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(chartPath)
+    plt.close()
+
+    return chartPath
+
+
 def generatePredictionChart(
     data, predictionValue, error, days_ahead, ticker, period, interval, modelName
 ):
+    import matplotlib.pyplot as plt
+
     # axos and figure
     plt.figure(figsize=(12, 6))
 
@@ -201,10 +238,14 @@ def generatePredictionChart(
 
 
 def cleanupMemory(delete_files=False):
+    # drop cached series so their frames can be collected
+    cache.invalidate()
     gc.collect()
 
-    # close all matplotlib figures
-    plt.close("all")
+    # close all matplotlib figures, if a chart was drawn at all
+    plt = sys.modules.get("matplotlib.pyplot")
+    if plt is not None:
+        plt.close("all")
 
     if delete_files:
         # reset data directories
@@ -214,6 +255,8 @@ def cleanupMemory(delete_files=False):
             shutil.rmtree("./data/processed")
         if os.path.exists("./data/predictions"):
             shutil.rmtree("./data/predictions")
+        if os.path.exists("./data/charts"):
+            shutil.rmtree("./data/charts")
 
         # create fresh data directories
         os.makedirs("./data/raw", exist_ok=True)
@@ -12,6 +12,55 @@ sys.path.insert(
 )
 
 
+@pytest.fixture(autouse=True)
+def persistent_cache_dir(tmp_path, monkeypatch):
+    """Keep the persistent cache of every test inside its own temp directory"""
+    import cache
+
+    monkeypatch.setitem(cache.cacheConfig, "dir", str(tmp_path / "persistent_cache"))
+    return tmp_path / "persistent_cache"
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    """Start and end every test with an empty in-memory cache"""
+    import cache
+
+    cache.clearCache()
+    yield
+    cache.clearCache()
+
+
+@pytest.fixture(autouse=True)
+def model_registry_dir(tmp_path, monkeypatch):
+    """Start every test with an empty model registry inside its temp directory"""
+    import modelregistry
+
+    modelregistry.clearRegistry()
+    monkeypatch.setitem(modelregistry.registryConfig, "dir", str(tmp_path / "models"))
+    yield tmp_path / "models"
+    modelregistry.clearRegistry()
+
+
+@pytest.fixture(autouse=True)
+def backtest_dir(tmp_path, monkeypatch):
+    """Keep the backtest fold results of every test inside its temp directory"""
+    import backtest
+
+    backtest.clearFolds()
+    monkeypatch.setitem(backtest.backtestConfig, "dir", str(tmp_path / "backtest"))
+    yield tmp_path / "backtest"
+    backtest.clearFolds()
+
+
+@pytest.fixture(autouse=True)
+def inline_training(monkeypatch):
+    """Train in the test process, executor tests turn the worker processes on"""
+    import executor
+
+    monkeypatch.setitem(executor.executorConfig, "workers", 0)
+
+
 @pytest.fixture
 def sample_stock_data():
     """Load raw stock data from the test dummy file"""
@@ -20,6 +69,14 @@ def sample_stock_data():
     return pd.read_csv(file_path)
 
 
+@pytest.fixture
+def raw_download_data():
+    """Load raw stock data shaped like a flattened yfinance download"""
+    file_path = os.path.join(os.path.dirname(__file__), "AAPL_1y_1d_raw.csv")
+    data = pd.read_csv(file_path, header=[0, 1], index_col=0, parse_dates=True)
+    return data.droplevel("Ticker", axis=1).rename_axis(None, axis=1)
+
+
 @pytest.fixture
 def processed_stock_data():
     """Load processed stock dataframe with features from test dummy file"""
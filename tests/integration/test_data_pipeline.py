@@ -35,8 +35,11 @@ class TestStockDataPipeline:
         processed_stock_data,
         tmp_path,
         sample_stock_data,
+        monkeypatch,
     ):
         """Test the full data pipeline from ingestion to prediction"""
+        # relative ./data paths of the pipeline land in the temporary directory
+        monkeypatch.chdir(tmp_path)
         # Setup test data
         ticker = "AAPL"
         period = "1y"
@@ -63,20 +66,20 @@ class TestStockDataPipeline:
 
                 # Step 1: Fetch stock data
                 with patch("pandas.DataFrame.to_csv"):
-                    ingestion.fetchStock(ticker, period, interval)
+                    ingestion.fetchStock(ticker, period, interval, persist=False)
 
                 # Step 2: Clean the data
                 with patch("pandas.read_csv", return_value=processed_stock_data):
                     with patch("pandas.DataFrame.to_csv"):
                         preprocessing.cleanData(
-                            processed_stock_data, ticker, period, interval
+                            processed_stock_data, ticker, period, interval, False
                         )
 
                 # Step 3: Add features
                 with patch("pandas.read_csv", return_value=processed_stock_data):
                     with patch("pandas.DataFrame.to_csv"):
                         processed_data = processing.addFeatures(
-                            processed_stock_data, ticker, period, interval
+                            processed_stock_data, ticker, period, interval, False
                         )
 
                 # Step 4: Train a model and get prediction
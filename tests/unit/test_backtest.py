@@ -0,0 +1,122 @@
+import pytest
+import numpy as np
+import pandas as pd
+from unittest.mock import patch
+
+import backtest
+import executor
+import model
+
+
+def run(data, modelName="lightgbm", **kwargs):
+    options = dict(folds=4, step=10, minTrain=100, horizons=[1, 5])
+    options.update(kwargs)
+    return backtest.runBacktest(data, modelName, **options)
+
+
+def daily_stamps(rows):
+    return pd.date_range("2020-01-01", periods=rows, freq="D").as_unit("ns").asi8
+
+
+class TestFolds:
+    def test_expanding_and_sliding_windows(self):
+        """Test that folds step through the series and leave room for the horizons"""
+        stamps = daily_stamps(200)  # the 20 day grid starts at row 18
+        folds = backtest.makeFolds(stamps, [1, 5], 3, 20, 100)
+        assert folds == [(0, 158, 183, 20), (0, 178, 200, 20), (0, 198, 200, 2)]
+
+        sliding = backtest.makeFolds(stamps, [1, 5], 2, 20, 100, "sliding", 150)
+        assert sliding == [(28, 178, 200, 20), (48, 198, 200, 2)]
+
+    def test_rolling_series_keeps_its_cutoffs(self):
+        """Test that cutoff times survive bars added at the end and trimmed at the front"""
+        stamps = daily_stamps(230)
+        before = backtest.makeFolds(stamps[:190], [1], 10, 20, 100)
+        after = backtest.makeFolds(stamps[25:], [1], 10, 20, 100)
+
+        beforeTimes = {stamps[cutoff] for _, cutoff, _, _ in before}
+        afterTimes = {stamps[25 + cutoff] for _, cutoff, _, _ in after}
+        assert len(beforeTimes & afterTimes) == 3
+        assert max(afterTimes) > max(beforeTimes)
+
+
+class TestBacktest:
+    def test_error_table(self, processed_stock_data):
+        """Test that every horizon gets errors over all of its predictions"""
+        result = run(processed_stock_data)
+
+        assert result["folds"] == result["computed"] == 4
+        assert list(result["table"]) == [1, 5]
+        row = result["table"][1]
+        assert row["predictions"] == 29  # the last fold has seven bars left
+        assert row["rmse"] >= row["mae"] > 0
+        assert 0 <= row["direction"] <= 1
+        assert result["table"][5]["rmse"] > result["table"][1]["rmse"]
+
+    def test_no_training_on_future_bars(self, processed_stock_data):
+        """Test that a fold only learns targets from before its cutoff"""
+        data = processed_stock_data.assign(Close=np.arange(len(processed_stock_data)))
+        targets = []
+        boost = model.boosters["xgboost"]["boost"]
+
+        def spy(params, dataset, rounds, previous):
+            targets.append(dataset.trainY.max())
+            return boost(params, dataset, rounds, previous)
+
+        with patch.dict(model.boosters["xgboost"], boost=spy):
+            run(data.iloc[:180], "xgboost", folds=1, minTrain=150)
+
+        # the fold at bar 173 predicts bars 174 to 179
+        assert targets == [172, 172]
+
+    def test_rerun_only_computes_new_folds(self, processed_stock_data):
+        """Test that folds are reused from memory and disk when bars are added"""
+        run(processed_stock_data.iloc[:-20], folds=10)
+        grown = run(processed_stock_data, folds=10)
+        assert grown["computed"] < grown["folds"]
+
+        backtest.clearFolds()
+        with patch("backtest.evaluateFold") as mock_fold:
+            again = run(processed_stock_data, folds=10)
+        mock_fold.assert_not_called()
+        assert again["table"] == grown["table"]
+
+    def test_trimmed_front_reuses_folds(self, processed_stock_data):
+        """Test that a rolling period refresh only computes the folds at its end"""
+        first = run(processed_stock_data.iloc[:-10], folds=6)
+        rolled = run(processed_stock_data.iloc[10:], folds=6)
+
+        assert first["computed"] == 6
+        # only the folds whose predictions reach the new bars
+        assert (rolled["folds"], rolled["computed"]) == (6, 2)
+
+    def test_default_arguments_fit_a_year(self, processed_stock_data):
+        """Test that the configured minimum training rows shrink for a 1y period"""
+        assert len(processed_stock_data) < backtest.defaultMinTrain
+        result = backtest.runBacktest(processed_stock_data, "lightgbm")
+
+        assert result["folds"] > 1
+        assert list(result["table"]) == backtest.defaultHorizons
+
+    def test_prophet_folds(self, processed_stock_data):
+        """Test that Prophet is backtested on the same folds"""
+        result = run(processed_stock_data, "prophet", folds=2)
+
+        assert result["table"][1]["predictions"] == 14
+        assert result["table"][5]["rmse"] > 0
+
+    def test_folds_in_worker_processes(
+        self, processed_stock_data, monkeypatch, tmp_path
+    ):
+        """Test that folds run as training jobs give the same table"""
+        inline = run(processed_stock_data)
+        backtest.clearFolds()
+        monkeypatch.setitem(backtest.backtestConfig, "dir", str(tmp_path / "workers"))
+        monkeypatch.setitem(executor.executorConfig, "workers", 2)
+        submitted = executor.getStats()["submitted"]
+
+        parallel = run(processed_stock_data)
+
+        assert executor.getStats()["submitted"] == submitted + 4
+        for horizon, row in inline["table"].items():
+            assert parallel["table"][horizon] == pytest.approx(row)
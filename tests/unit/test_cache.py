@@ -0,0 +1,269 @@
+import pandas as pd
+from unittest.mock import patch
+
+import cache
+import features
+import ingestion
+import storage
+
+
+class TestSeriesCache:
+    def test_hit_and_miss_counts(self, sample_stock_data):
+        """Test that lookups are counted as hits or misses"""
+        assert cache.getSeries("AAPL", "1y", "1d") is None
+
+        cache.putSeries("AAPL", "1y", "1d", sample_stock_data)
+        assert cache.getSeries("aapl", "1y", "1d") is sample_stock_data
+
+        stats = cache.getStats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hitRate"] == 0.5
+        assert stats["entries"] == 1
+
+    def test_entries_expire_by_interval(self, sample_stock_data):
+        """Test that intraday series go stale sooner than daily series"""
+        cache.putSeries("AAPL", "1d", "1m", sample_stock_data, fetchedAt=1000)
+        cache.putSeries("AAPL", "1y", "1d", sample_stock_data, fetchedAt=1000)
+
+        later = 1000 + cache.getTtl("1m") + 1
+        assert cache.getSeries("AAPL", "1d", "1m", now=later) is None
+        assert cache.getSeries("AAPL", "1y", "1d", now=later) is sample_stock_data
+
+    def test_least_recently_used_is_evicted(self, sample_stock_data):
+        """Test that the cache is bounded by max_entries"""
+        with patch.dict(cache.cacheConfig, {"max_entries": 2, "persistent": False}):
+            cache.putSeries("AAPL", "1y", "1d", sample_stock_data)
+            cache.putSeries("MSFT", "1y", "1d", sample_stock_data)
+            cache.getSeries("AAPL", "1y", "1d")
+            cache.putSeries("GOOG", "1y", "1d", sample_stock_data)
+
+            assert cache.getSeries("MSFT", "1y", "1d") is None
+            assert cache.getSeries("AAPL", "1y", "1d") is not None
+            assert cache.getStats()["evictions"] == 1
+
+
+class TestCachedFetch:
+    @patch("storage.saveSeries")
+    @patch("yfinance.download")
+    def test_repeat_fetch_skips_download(
+        self, mock_download, mock_save, raw_download_data
+    ):
+        """Test that a second fetch of the same key is served from the cache"""
+        mock_download.return_value = raw_download_data
+
+        with patch("os.path.exists", return_value=True):
+            first = ingestion.fetchStock("AAPL", "1y", "1d")
+            second = ingestion.fetchStock("AAPL", "1y", "1d")
+
+        assert mock_download.call_count == 1
+        assert mock_save.call_count == 1
+        assert second is first
+        assert cache.getStats()["hits"] == 1
+
+
+class TestIncrementalFetch:
+    @patch("storage.saveSeries")
+    @patch("yfinance.download")
+    def test_only_new_bars_are_requested(self, mock_download, mock_save):
+        """Test that an incremental fetch requests bars after the stored history"""
+        index = pd.date_range("2024-01-01", periods=5, freq="D")
+        stored = pd.DataFrame(
+            {"Open": [1.0, 2.0, 3.0, 4.0, 5.0], "Close": [1.0, 2.0, 3.0, 4.0, 5.0]},
+            index=index,
+        )
+        delta = pd.DataFrame(
+            {"Open": [5.0, 6.0], "Close": [5.5, 6.0]},
+            index=pd.date_range("2024-01-05", periods=2),
+        )
+        mock_download.return_value = delta
+
+        with patch("ingestion.loadStoredHistory", return_value=stored):
+            result = ingestion.fetchStock(
+                "AAPL", "max", "1d", useCache=False, incremental=True
+            )
+
+        mock_download.assert_called_once_with("AAPL", start=index[-1], interval="1d")
+        assert list(result["Close"]) == [1.0, 2.0, 3.0, 4.0, 5.5, 6.0]
+        assert result.index.is_unique
+        mock_save.assert_called_once()
+
+    def test_trim_to_period(self):
+        """Test that merged history is cut back to the rolling period"""
+        index = pd.date_range("2023-01-01", "2024-06-30", freq="D")
+        data = pd.DataFrame({"Close": range(len(index))}, index=index)
+
+        trimmed = ingestion.trimToPeriod(data, "1y", now=pd.Timestamp("2024-06-30"))
+
+        assert trimmed.index[0] == pd.Timestamp("2023-06-30")
+        assert trimmed.index[-1] == index[-1]
+
+
+class TestPersistentCache:
+    def test_series_survive_restart(self, raw_download_data, persistent_cache_dir):
+        """Test that a new process serves cached series from the manifest"""
+        cache.putSeries("AAPL", "1y", "1d", raw_download_data)
+        assert (persistent_cache_dir / "manifest.json").exists()
+
+        cache.clearCache()  # simulate a restart
+        assert cache.loadManifest() == 1
+
+        warm = cache.getSeries("AAPL", "1y", "1d")
+        pd.testing.assert_frame_equal(
+            warm, raw_download_data, check_freq=False, check_index_type=False
+        )
+        stats = cache.getStats()
+        assert stats["hits"] == 1
+        assert stats["diskEntries"] == 1
+        assert stats["diskBytes"] > 0
+
+    def test_intraday_series_survive_restart(
+        self, raw_download_data, persistent_cache_dir
+    ):
+        """Test that a series with a New York index is served warm after a restart"""
+        index = pd.date_range(
+            "2024-03-01 09:30",
+            periods=len(raw_download_data),
+            freq="1min",
+            tz="America/New_York",
+        )
+        intraday = raw_download_data.set_axis(index.rename("Datetime"))
+        cache.putSeries("AAPL", "1d", "1m", intraday)
+
+        cache.clearCache()  # simulate a restart
+        assert cache.loadManifest() == 1
+
+        warm = cache.getSeries("AAPL", "1d", "1m")
+        assert warm.index[0] == pd.Timestamp("2024-03-01 09:30", tz="America/New_York")
+        pd.testing.assert_frame_equal(
+            warm, intraday, check_freq=False, check_index_type=False
+        )
+
+    def test_evicted_series_come_back_from_disk(self, raw_download_data):
+        """Test that series evicted from memory are reloaded from the volume"""
+        with patch.dict(cache.cacheConfig, {"max_entries": 1}):
+            cache.putSeries("AAPL", "1y", "1d", raw_download_data)
+            cache.putSeries("MSFT", "1y", "1d", raw_download_data)
+
+            assert cache.getSeries("AAPL", "1y", "1d") is not None
+            assert cache.getStats()["diskHits"] == 1
+
+    def test_corrupt_entries_are_dropped(self, raw_download_data, persistent_cache_dir):
+        """Test that entries whose content no longer matches the hash are removed"""
+        cache.putSeries("AAPL", "1y", "1d", raw_download_data)
+        cache.putSeries("MSFT", "1y", "1d", raw_download_data)
+        tampered = raw_download_data.copy()
+        tampered.iloc[0, 0] = -1.0
+        storage.saveFrame(tampered, str(persistent_cache_dir / "MSFT_1y_1d"))
+
+        cache.clearCache()
+
+        assert cache.loadManifest() == 1
+        assert cache.peekSeries("MSFT", "1y", "1d") is None
+        assert not (persistent_cache_dir / "MSFT_1y_1d.json").exists()
+
+    def test_disk_budget_evicts_oldest(self, raw_download_data):
+        """Test that the volume budget drops the oldest downloads first"""
+        cache.putSeries("AAPL", "1y", "1d", raw_download_data, fetchedAt=1)
+        size = cache.getStats()["diskBytes"]
+
+        with patch.dict(cache.cacheConfig, {"disk_max_bytes": size}):
+            cache.putSeries("MSFT", "1y", "1d", raw_download_data, fetchedAt=2)
+
+        cache.clearCache()
+        cache.loadManifest()
+        assert cache.peekSeries("AAPL", "1y", "1d") is None
+        assert cache.peekSeries("MSFT", "1y", "1d") is not None
+
+
+def daily_history(years):
+    index = pd.date_range(
+        end=pd.Timestamp.now().normalize(), periods=365 * years, freq="D"
+    )
+    return pd.DataFrame({"Close": range(len(index))}, index=index, dtype=float)
+
+
+class TestPeriodContainment:
+    def test_wider_periods(self):
+        """Test which cached periods may answer a request, widest first"""
+        assert cache.widerPeriods("1y") == ["max", "10y", "5y", "2y"]
+        assert cache.widerPeriods("ytd")[-1] == "1y"
+        assert "6mo" not in cache.widerPeriods("ytd")
+        assert cache.widerPeriods("max") == []
+
+    @patch("yfinance.download")
+    def test_shorter_period_is_sliced(self, mock_download):
+        """Test that a 1y request is answered from a cached 5y series"""
+        history = daily_history(5)
+        cache.putSeries("AAPL", "5y", "1d", history)
+
+        result = ingestion.fetchStock("AAPL", "1y", "1d", persist=False)
+
+        mock_download.assert_not_called()
+        assert result.index[-1] == history.index[-1]
+        assert result.index[0] == history.index[-1] - pd.DateOffset(years=1)
+        assert cache.getStats()["sliceHits"] == 1
+
+    @patch("yfinance.download")
+    def test_shorter_series_does_not_cover_longer(self, mock_download):
+        """Test that a 5y request is not answered from a cached 1y series"""
+        cache.putSeries("AAPL", "1y", "1d", daily_history(1))
+        mock_download.return_value = daily_history(5)
+
+        ingestion.fetchStock("AAPL", "5y", "1d", persist=False)
+
+        mock_download.assert_called_once_with("AAPL", period="5y", interval="1d")
+
+    @patch("yfinance.download")
+    def test_stale_covering_series_is_refreshed(self, mock_download):
+        """Test that only the bars after a stale covering series are downloaded"""
+        history = daily_history(5)
+        cache.putSeries("AAPL", "5y", "1d", history, fetchedAt=0)
+        mock_download.return_value = history.iloc[-1:] + 1
+
+        result = ingestion.fetchStock(
+            "AAPL", "1y", "1d", incremental=True, persist=False
+        )
+
+        mock_download.assert_called_once_with(
+            "AAPL", start=history.index[-1], interval="1d"
+        )
+        assert result["Close"].iloc[-1] == history["Close"].iloc[-1] + 1
+        assert cache.getSeries("AAPL", "5y", "1d") is not None
+        assert cache.peekSeries("AAPL", "1y", "1d") is None
+
+
+class TestFeatureStateCache:
+    def test_state_survives_restart(self, raw_download_data):
+        """Test that the feature state is restored with the cached series"""
+        state = features.FeatureState.fromSeries(
+            raw_download_data["Close"], raw_download_data["Volume"]
+        )
+        cache.putSeries("AAPL", "1y", "1d", raw_download_data)
+        cache.putFeatureState("AAPL", "1y", "1d", state)
+        assert cache.getFeatureState("AAPL", "1y", "1d") is state
+
+        cache.clearCache()
+        cache.loadManifest()
+
+        restored = cache.getFeatureState("AAPL", "1y", "1d")
+        assert restored.bars == state.bars
+        assert restored.update(200.0, 1e6) == state.update(200.0, 1e6)
+
+    def test_state_counts_towards_disk_budget(self, raw_download_data):
+        """Test that a saved state is part of the volume budget of its series"""
+        state = features.FeatureState.fromSeries(
+            raw_download_data["Close"], raw_download_data["Volume"]
+        )
+        cache.putSeries("AAPL", "1y", "1d", raw_download_data, fetchedAt=1)
+        cache.putSeries("MSFT", "1y", "1d", raw_download_data, fetchedAt=2)
+        size = cache.getStats()["diskBytes"]
+
+        with patch.dict(cache.cacheConfig, {"disk_max_bytes": size}):
+            cache.putFeatureState("MSFT", "1y", "1d", state)
+
+        assert cache.getStats()["diskBytes"] < size
+        cache.clearCache()
+        cache.loadManifest()
+        assert cache.peekSeries("AAPL", "1y", "1d") is None
+        assert cache.getFeatureState("MSFT", "1y", "1d").bars == state.bars
@@ -0,0 +1,119 @@
+import ctypes
+import os
+import time
+import pytest
+
+import executor
+import modelregistry
+import pipeline
+
+
+@pytest.fixture(autouse=True)
+def worker_processes(monkeypatch):
+    monkeypatch.setitem(executor.executorConfig, "workers", 2)
+
+
+class TestExecutor:
+    def test_job_runs_in_another_process(self):
+        """Test that a job runs in a worker process and returns its result"""
+        assert executor.run(os.getpid) != os.getpid()
+        assert executor.getStats()["completed"] >= 1
+
+    def test_job_exception_is_raised(self):
+        """Test that an exception in the job reaches the caller"""
+        with pytest.raises(ValueError):
+            executor.run(int, "not a number")
+
+    def test_timeout_kills_the_worker(self):
+        """Test that a job running over its timeout is stopped"""
+        start = time.monotonic()
+        with pytest.raises(executor.JobTimeout):
+            executor.run(time.sleep, 30, timeout=0.5)
+        assert time.monotonic() - start < 10
+
+    def test_crash_only_fails_its_job(self):
+        """Test that a segfaulting or exiting worker leaves other jobs running"""
+        other = executor.submit(os.getpid)
+        with pytest.raises(executor.WorkerCrashed):
+            executor.run(ctypes.string_at, 0)
+        with pytest.raises(executor.WorkerCrashed):
+            executor.run(os._exit, 3)
+
+        assert other.result() != os.getpid()
+        assert executor.run(abs, -2) == 2
+
+    def test_cancel_running_and_queued(self):
+        """Test that running and queued jobs can be cancelled"""
+        jobs = [executor.submit(time.sleep, 30) for _ in range(3)]
+        time.sleep(0.5)
+        assert [job.state for job in jobs] == ["running", "running", "queued"]
+
+        for job in reversed(jobs):
+            assert executor.cancel(job.id)
+        for job in jobs:
+            with pytest.raises(executor.JobCancelled):
+                job.result(timeout=10)
+        assert executor.listJobs() == []
+        assert not executor.cancel(jobs[0].id)
+
+    def test_workers_are_reused(self, monkeypatch):
+        """Test that jobs run one after another share a worker until its job limit"""
+        first = executor.run(os.getpid)
+        assert executor.run(os.getpid) == first
+
+        monkeypatch.setitem(executor.executorConfig, "max_jobs_per_worker", 1)
+        started = executor.getStats()["workersStarted"]
+        pids = {executor.run(os.getpid) for _ in range(3)}
+        assert len(pids) == 3
+        assert executor.getStats()["workersStarted"] >= started + 2
+
+    def test_killed_worker_is_replaced(self):
+        """Test that the worker of a timed out job is not handed the next one"""
+        before = executor.run(os.getpid)
+        with pytest.raises(executor.JobTimeout):
+            executor.run(time.sleep, 30, timeout=0.5)
+        assert executor.run(os.getpid) != before
+
+    def test_inline_without_workers(self, monkeypatch):
+        """Test that 0 workers runs the job in the calling process"""
+        monkeypatch.setitem(executor.executorConfig, "workers", 0)
+        assert executor.run(os.getpid) == os.getpid()
+
+
+class TestTrainingWorkers:
+    def test_pipeline_trains_in_a_worker(self, processed_stock_data):
+        """Test that a model trained by a worker is registered in the bot process"""
+        completed = executor.getStats()["completed"]
+        stockPipeline = pipeline.StockPipeline("AAPL", "1y", "1d")
+        stockPipeline.features = processed_stock_data
+        result = stockPipeline.train("xgboost", 5, 0.2, warmStart=False)
+
+        assert result["daysAhead"] == 5
+        assert executor.getStats()["completed"] == completed + 1
+        assert modelregistry.getStats()["entries"] == 1
+        assert modelregistry.getStats()["misses"] == 1
+
+    def test_registered_model_is_served_by_the_worker(self, processed_stock_data):
+        """Test that a registry hit is predicted by the running worker, not the bot"""
+        stockPipeline = pipeline.StockPipeline("AAPL", "1y", "1d")
+        stockPipeline.features = processed_stock_data
+        first = stockPipeline.train("xgboost", 5, 0.2, warmStart=False)
+        started = executor.getStats()["workersStarted"]
+
+        second = pipeline.StockPipeline("AAPL", "1y", "1d")
+        second.features = processed_stock_data
+        result = second.train("xgboost", 5, 0.2, warmStart=False)
+
+        assert executor.getStats()["workersStarted"] == started
+        assert result["prediction"] == pytest.approx(first["prediction"])
+        assert modelregistry.getStats()["hits"] == 1
+
+    def test_worker_counts_are_merged_once(self, processed_stock_data):
+        """Test that a reused worker hands back the counts of each job only"""
+        for rows in (len(processed_stock_data) - 1, len(processed_stock_data)):
+            stockPipeline = pipeline.StockPipeline("AAPL", "1y", "1d")
+            stockPipeline.features = processed_stock_data.iloc[:rows]
+            stockPipeline.train("xgboost", 5, 0.2, warmStart=False)
+
+        stats = modelregistry.getStats()
+        assert (stats["misses"], stats["stored"], stats["refits"]) == (2, 2, 2)
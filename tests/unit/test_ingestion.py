@@ -0,0 +1,96 @@
+import pandas as pd
+import numpy as np
+from unittest.mock import patch
+
+import cache
+import ingestion
+
+
+def grouped_download(tickers, periods=5):
+    """Build a frame shaped like yf.download(..., group_by="ticker")"""
+    index = pd.date_range("2024-01-01", periods=periods, freq="D")
+    columns = pd.MultiIndex.from_product(
+        [tickers, ["Open", "High", "Low", "Close", "Volume"]],
+        names=["Ticker", "Price"],
+    )
+    values = np.arange(periods * len(columns), dtype=float).reshape(periods, -1)
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+class TestFetchMany:
+    @patch("storage.saveSeries")
+    @patch("yfinance.download")
+    def test_grouped_download_is_split(self, mock_download, mock_save):
+        """Test that one grouped request is split into per-ticker series"""
+        mock_download.return_value = grouped_download(["AAPL", "MSFT"])
+
+        results = ingestion.fetchMany(["AAPL", "msft"], "1y", "1d")
+
+        mock_download.assert_called_once()
+        assert mock_download.call_args[0][0] == ["AAPL", "MSFT"]
+        assert set(results) == {"AAPL", "MSFT"}
+        assert list(results["MSFT"].columns) == [
+            "Close",
+            "High",
+            "Low",
+            "Open",
+            "Volume",
+        ]
+        assert cache.getSeries("MSFT", "1y", "1d") is results["MSFT"]
+        assert mock_save.call_count == 2
+
+    @patch("storage.saveSeries")
+    @patch("yfinance.download")
+    def test_chunks_and_cached_tickers(self, mock_download, mock_save):
+        """Test that cached tickers are skipped and the rest is chunked"""
+        cache.putSeries("AAPL", "1y", "1d", pd.DataFrame({"Close": [1.0]}))
+        mock_download.side_effect = lambda chunk, **kwargs: grouped_download(chunk)
+
+        results = ingestion.fetchMany(
+            ["AAPL", "MSFT", "GOOG", "AMZN"], "1y", "1d", chunkSize=2
+        )
+
+        assert mock_download.call_count == 2
+        assert mock_download.call_args_list[0][0][0] == ["MSFT", "GOOG"]
+        assert mock_download.call_args_list[1][0][0] == ["AMZN"]
+        assert len(results) == 4
+
+    @patch("storage.saveSeries")
+    @patch("yfinance.download")
+    def test_persist_and_compact(self, mock_download, mock_save):
+        """Test that persist and compact are handled as in fetchStock"""
+        mock_download.return_value = grouped_download(["AAPL", "MSFT"])
+
+        results = ingestion.fetchMany(
+            ["AAPL", "MSFT"], "1y", "1d", persist=False, compact=True
+        )
+
+        mock_save.assert_not_called()
+        assert results["AAPL"]["Close"].dtype == np.float32
+        assert cache.getSeries("AAPL", "1y", "1d")["Close"].dtype == np.float32
+
+    @patch("storage.loadSeries", return_value=None)
+    @patch("yfinance.download")
+    def test_incremental_downloads_new_bars(self, mock_download, mock_load):
+        """Test that stored histories are extended by one grouped delta download"""
+        history = grouped_download(["AAPL", "MSFT"], periods=8)
+        for symbol in ("AAPL", "MSFT"):
+            cache.putSeries(symbol, "max", "1d", history[symbol].iloc[:6], fetchedAt=0)
+        mock_download.return_value = history.iloc[5:]
+
+        results = ingestion.fetchMany(
+            ["AAPL", "MSFT"], "max", "1d", incremental=True, persist=False
+        )
+
+        mock_download.assert_called_once()
+        assert mock_download.call_args.kwargs["start"] == history.index[5]
+        assert "period" not in mock_download.call_args.kwargs
+        assert len(results["MSFT"]) == 8
+        assert results["MSFT"]["Close"].iloc[-1] == history["MSFT"]["Close"].iloc[-1]
+
+    def test_missing_ticker_is_empty(self):
+        """Test that tickers absent from the download come back empty"""
+        series = ingestion.splitGrouped(grouped_download(["AAPL"]), ["AAPL", "XXXX"])
+
+        assert not series["AAPL"].empty
+        assert series["XXXX"].empty
@@ -0,0 +1,289 @@
+import pytest
+from unittest.mock import patch
+import lightgbm
+import xgboost
+
+import cache
+import model
+import modelregistry
+
+
+@pytest.fixture(autouse=True)
+def no_sentiment():
+    cache.clearCache()
+    with patch("model.news.getSentimentData", return_value=({"sentimentScore": 0}, [])):
+        yield
+    cache.clearCache()
+
+
+def train(trainer, data, testSize=0.2):
+    return trainer(data, "AAPL", "1y", "1d", 5, testSize, return_result=True)
+
+
+class TestModelRegistry:
+    def test_repeated_request_skips_training(self, processed_stock_data):
+        """Test that the same request is answered by the registered model"""
+        with patch("xgboost.train", side_effect=xgboost.train) as mock_train:
+            first = train(model.trainXGBoost, processed_stock_data)
+            second = train(model.trainXGBoost, processed_stock_data)
+
+        assert mock_train.call_count == 1
+        assert second["originalPrediction"] == first["originalPrediction"]
+        assert second["error"] == pytest.approx(first["error"])
+        assert modelregistry.getStats()["hits"] == 1
+
+    def test_changed_request_trains_again(self, processed_stock_data):
+        """Test that another test size or other data is a different model"""
+        with patch("xgboost.train", side_effect=xgboost.train) as mock_train:
+            train(model.trainXGBoost, processed_stock_data)
+            train(model.trainXGBoost, processed_stock_data, testSize=0.3)
+            train(model.trainXGBoost, processed_stock_data.iloc[:-1])
+
+        assert mock_train.call_count == 3
+
+    def test_models_survive_restart(self, processed_stock_data, model_registry_dir):
+        """Test that stored models are loaded from the volume after a restart"""
+        first = train(model.trainLightGBM, processed_stock_data)
+        modelregistry.clearRegistry()
+        cache.clearCache()
+
+        assert modelregistry.loadManifest() == 1
+        with patch("lightgbm.train") as mock_train:
+            second = train(model.trainLightGBM, processed_stock_data)
+
+        mock_train.assert_not_called()
+        assert second["originalPrediction"] == pytest.approx(
+            first["originalPrediction"]
+        )
+        assert second["error"] == pytest.approx(first["error"])
+
+    def test_unreadable_model_is_retrained(self, processed_stock_data):
+        """Test that a damaged artifact is dropped and the model fitted again"""
+        train(model.trainLightGBM, processed_stock_data)
+        modelregistry.clearRegistry()
+        modelregistry.loadManifest()
+        for entry in modelregistry._entries.values():
+            with open(entry["path"], "wb") as f:
+                f.write(b"x" * entry["bytes"])
+
+        with patch("lightgbm.train", side_effect=lightgbm.train) as mock_train:
+            train(model.trainLightGBM, processed_stock_data)
+
+        assert mock_train.call_count == 1
+
+    def test_eviction_by_count_and_size(self, monkeypatch):
+        """Test that least recently used models go first when a limit is exceeded"""
+        monkeypatch.setitem(modelregistry.registryConfig, "max_entries", 3)
+        monkeypatch.setitem(modelregistry.registryConfig, "max_bytes", 250)
+        for key in "abc":
+            modelregistry.putModel(key, key, b"x" * 100, {"rmse": 1.0}, {})
+        assert modelregistry.getStats()["entries"] == 2  # 300 bytes > 250
+
+        modelregistry.getModel("b", bytes)  # b is now the most recently used
+        modelregistry.putModel("d", "d", b"x" * 10, {"rmse": 1.0}, {})
+        modelregistry.putModel("e", "e", b"x" * 10, {"rmse": 1.0}, {})  # 4 > 3
+
+        assert modelregistry.getModel("c", bytes) is None
+        for key in "bde":
+            assert modelregistry.getModel(key, bytes) is not None
+        assert modelregistry.getStats()["evictions"] == 2
+
+
+class TestWarmStart:
+    def test_new_bars_continue_the_booster(self, processed_stock_data):
+        """Test that a few new bars add a few trees to the registered booster"""
+        train(model.trainXGBoost, processed_stock_data.iloc[:-3])
+        with patch("xgboost.train", side_effect=xgboost.train) as mock_train:
+            result = model.trainXGBoost(
+                processed_stock_data, "AAPL", "1y", "1d", 5, 0.2, True, warmStart=True
+            )
+
+        assert result["warmStart"]
+        rounds = mock_train.call_args.kwargs["num_boost_round"]
+        assert 0 < rounds < 20
+        assert mock_train.call_args.kwargs["xgb_model"] is not None
+        assert modelregistry.getStats()["warmStarts"] == 1
+
+    def test_lightgbm_continues(self, processed_stock_data):
+        """Test that LightGBM continues from its init model"""
+        train(model.trainLightGBM, processed_stock_data.iloc[:-3])
+        result = model.trainLightGBM(
+            processed_stock_data,
+            "AAPL",
+            "1y",
+            "1d",
+            5,
+            0.2,
+            warmStart=True,
+            return_result=True,
+        )
+
+        assert result["warmStart"]
+        assert result["error"] > 0
+
+    def test_changed_history_refits(self, processed_stock_data):
+        """Test that revised old bars are not continued from"""
+        train(model.trainXGBoost, processed_stock_data.iloc[:-3])
+        revised = processed_stock_data.copy()
+        revised.loc[revised.index[10], "Close"] += 1
+
+        result = model.trainXGBoost(
+            revised, "AAPL", "1y", "1d", 5, 0.2, True, warmStart=True
+        )
+
+        assert not result["warmStart"]
+        assert result["drift"] is None
+
+    def test_rolling_period_continues(self, processed_stock_data):
+        """Test that bars trimmed from the front and a revised last bar still continue"""
+        train(model.trainXGBoost, processed_stock_data.iloc[:-3])
+        rolled = processed_stock_data.iloc[3:].copy()
+        # the last bar of the first fit was still forming
+        rolled.loc[rolled.index[-4], "Close"] += 1
+
+        result = model.trainXGBoost(
+            rolled, "AAPL", "1y", "1d", 5, 0.2, True, warmStart=True
+        )
+
+        assert result["warmStart"]
+        assert modelregistry.getStats()["warmStarts"] == 1
+
+    def test_missing_bars_refit(self, processed_stock_data):
+        """Test that a series ending before the earlier one is not continued from"""
+        train(model.trainXGBoost, processed_stock_data)
+        result = model.trainXGBoost(
+            processed_stock_data.iloc[:-2],
+            "AAPL",
+            "1y",
+            "1d",
+            5,
+            0.2,
+            True,
+            warmStart=True,
+        )
+
+        assert not result["warmStart"]
+        assert result["drift"] is None  # not even compared against a continuation
+
+    def test_update_limit_refits_and_measures_drift(
+        self, processed_stock_data, monkeypatch
+    ):
+        """Test that the refit after the update limit reports the drift"""
+        monkeypatch.setitem(modelregistry.registryConfig, "max_updates", 1)
+        results = [
+            model.trainXGBoost(
+                processed_stock_data.iloc[: len(processed_stock_data) - cut],
+                "AAPL",
+                "1y",
+                "1d",
+                5,
+                0.2,
+                True,
+                warmStart=True,
+            )
+            for cut in (4, 2, 0)
+        ]
+
+        assert [r["warmStart"] for r in results] == [False, True, False]
+        assert results[2]["drift"] is not None
+        assert modelregistry.getStats()["drift"] == pytest.approx(results[2]["drift"])
+
+
+class TestMultiHorizon:
+    def test_horizons_fitted_in_one_job(self, processed_stock_data):
+        """Test that every horizon of the set is fitted once and then served from it"""
+        with patch("xgboost.train", side_effect=xgboost.train) as mock_train:
+            first = model.trainXGBoost(
+                processed_stock_data,
+                "AAPL",
+                "1y",
+                "1d",
+                5,
+                0.2,
+                True,
+                horizons=[1, 5, 10],
+            )
+            tenth = model.trainXGBoost(
+                processed_stock_data,
+                "AAPL",
+                "1y",
+                "1d",
+                10,
+                0.2,
+                True,
+                horizons=[1, 5, 10],
+            )
+
+        assert mock_train.call_count == 3
+        assert first["horizonFit"] == tenth["horizonFit"] == "set"
+        assert modelregistry.getStats()["entries"] == 3
+
+    def test_set_matches_direct_fit(self, processed_stock_data):
+        """Test that a horizon binned like the shortest one stays close to a direct fit"""
+        fromSet = model.trainLightGBM(
+            processed_stock_data,
+            "AAPL",
+            "1y",
+            "1d",
+            5,
+            0.2,
+            return_result=True,
+            horizons=[1, 5],
+        )
+        modelregistry.clearRegistry()
+        cache.clearCache()
+        direct = model.trainLightGBM(
+            processed_stock_data,
+            "AAPL",
+            "1y",
+            "1d",
+            5,
+            0.2,
+            return_result=True,
+            horizons=[],
+        )
+
+        assert direct["horizonFit"] == "direct"
+        assert fromSet["originalPrediction"] == pytest.approx(
+            direct["originalPrediction"], rel=0.01
+        )
+        assert fromSet["error"] == pytest.approx(direct["error"], rel=0.1)
+
+    def test_missing_horizon_is_interpolated(self, processed_stock_data):
+        """Test that a horizon between two trained ones needs no fit of its own"""
+        results = {
+            days: model.trainXGBoost(
+                processed_stock_data,
+                "AAPL",
+                "1y",
+                "1d",
+                days,
+                0.2,
+                True,
+                horizons=[2, 6],
+            )
+            for days in (2, 6)
+        }
+        with patch("xgboost.train") as mock_train:
+            middle = model.trainXGBoost(
+                processed_stock_data, "AAPL", "1y", "1d", 4, 0.2, True, horizons=[2, 6]
+            )
+
+        mock_train.assert_not_called()
+        assert middle["horizonFit"] == "interpolated"
+        expected = (
+            results[2]["originalPrediction"] + results[6]["originalPrediction"]
+        ) / 2
+        assert middle["originalPrediction"] == pytest.approx(expected)
+        assert middle["error"] == pytest.approx(
+            (results[2]["error"] + results[6]["error"]) / 2
+        )
+
+    def test_outside_horizon_fits_directly(self, processed_stock_data, monkeypatch):
+        """Test that configured horizons apply and others fall back to a direct fit"""
+        monkeypatch.setitem(modelregistry.registryConfig, "multi_horizon", True)
+        monkeypatch.setitem(modelregistry.registryConfig, "horizons", [1, 3])
+        result = train(model.trainXGBoost, processed_stock_data)
+
+        assert result["horizonFit"] == "direct"
+        assert modelregistry.getStats()["entries"] == 1
@@ -3,19 +3,19 @@ from unittest.mock import patch, MagicMock
 import pandas as pd
 import numpy as np
 
+import cache
 import model
 import news
+import trainset
 
 
 class TestXGBoostModel:
     @patch("pandas.read_csv")
     @patch("model.news.getSentimentData")
     @patch("model.news.adjustPredictionWithSentiment")
-    @patch("xgboost.XGBRegressor")
-    @patch("sklearn.model_selection.train_test_split")
+    @patch("xgboost.train")
     def test_train_xgboost(
         self,
-        mock_train_test_split,
         mock_xgb,
         mock_adjust,
         mock_get_sentiment,
@@ -34,16 +34,10 @@ class TestXGBoostModel:
         # Mock the pandas read_csv call
         mock_read_csv.return_value = processed_stock_data
 
-        # Mock train/test split
-        x_train = processed_stock_data.drop(columns=["Price"])
-        y_train = pd.Series([150.0] * len(processed_stock_data))
-        x_test = x_train.copy()
-        y_test = pd.Series([155.0] * len(processed_stock_data))
-        mock_train_test_split.return_value = (x_train, x_test, y_train, y_test)
-
-        # Mock XGBoost model
+        # Mock XGBoost booster, one prediction per row it is given
         mock_model = MagicMock()
-        mock_model.predict.return_value = np.array([prediction] * len(x_test))
+        mock_model.inplace_predict.side_effect = lambda x: np.full(len(x), prediction)
+        mock_model.save_raw.return_value = bytearray(b"ubj")
         mock_xgb.return_value = mock_model
 
         # Mock sentiment data
@@ -83,11 +77,9 @@ class TestLightGBMModel:
     @patch("pandas.read_csv")
     @patch("model.news.getSentimentData")
     @patch("model.news.adjustPredictionWithSentiment")
-    @patch("lightgbm.LGBMRegressor")
-    @patch("sklearn.model_selection.train_test_split")
+    @patch("lightgbm.train")
     def test_train_lightgbm(
         self,
-        mock_train_test_split,
         mock_lgbm,
         mock_adjust,
         mock_get_sentiment,
@@ -106,16 +98,10 @@ class TestLightGBMModel:
         # Mock the pandas read_csv call
         mock_read_csv.return_value = processed_stock_data
 
-        # Mock train/test split
-        x_train = processed_stock_data.drop(columns=["Price"])
-        y_train = pd.Series([270.0] * len(processed_stock_data))
-        x_test = x_train.copy()
-        y_test = pd.Series([275.0] * len(processed_stock_data))
-        mock_train_test_split.return_value = (x_train, x_test, y_train, y_test)
-
-        # Mock LightGBM model
+        # Mock LightGBM booster, one prediction per row it is given
         mock_model = MagicMock()
-        mock_model.predict.return_value = np.array([prediction] * len(x_test))
+        mock_model.predict.side_effect = lambda x: np.full(len(x), prediction)
+        mock_model.model_to_string.return_value = "tree"
         mock_lgbm.return_value = mock_model
 
         # Mock sentiment data
@@ -151,6 +137,61 @@ class TestLightGBMModel:
         assert "error" in result
 
 
+class TestTrainingSet:
+    def test_split_matches_train_test_split(self, processed_stock_data):
+        """Test that the rows and target are those of the old shift and split"""
+        from sklearn.model_selection import train_test_split
+
+        data = processed_stock_data.assign(
+            Price=pd.to_datetime(processed_stock_data["Price"])
+        )
+        dataset = trainset.TrainingSet(data, 5, 0.2)
+
+        labelled = data.assign(Target=data["Close"].shift(-5)).dropna(subset=["Target"])
+        x = labelled.drop(columns=["Price", "Target"])
+        XTrain, XTest, YTrain, YTest = train_test_split(
+            x, labelled["Target"], test_size=0.2, shuffle=False
+        )
+        np.testing.assert_array_equal(dataset.trainX, XTrain.to_numpy())
+        np.testing.assert_array_equal(dataset.testY, YTest.to_numpy())
+        np.testing.assert_array_equal(dataset.future, x.iloc[[-1]].to_numpy())
+        assert dataset.featureNames == list(x.columns)
+
+    def test_parts_are_views(self, processed_stock_data):
+        """Test that train, test and future rows share the one matrix"""
+        dataset = trainset.TrainingSet(processed_stock_data, 5, 0.2)
+
+        assert dataset.matrix.flags["C_CONTIGUOUS"]
+        for part in (dataset.trainX, dataset.testX, dataset.future):
+            assert np.shares_memory(part, dataset.matrix)
+
+    def test_native_dataset_is_reused(self, processed_stock_data):
+        """Test that training again on the same frame reuses the binned dataset"""
+        first = trainset.getTrainingSet(processed_stock_data, 5, 0.2)
+        second = trainset.getTrainingSet(processed_stock_data.copy(), 5, 0.2)
+
+        assert second is first
+        assert second.xgbTrain() is first.xgbTrain()
+        params = {"objective": "regression", "verbosity": -1}
+        assert second.lgbTrain(params) is first.lgbTrain(params)
+        assert cache.getStats()["datasetHits"] == 1
+
+    def test_horizon_sets_are_kept_together(self, processed_stock_data, monkeypatch):
+        """Test that every horizon of a frame survives while newer frames are fewer"""
+        monkeypatch.setitem(cache.cacheConfig, "dataset_entries", 2)
+        horizons = [1, 5, 10, 20, 30, 60]
+        for horizon in horizons:
+            trainset.getTrainingSet(processed_stock_data, horizon, 0.2)
+        trainset.getTrainingSet(processed_stock_data.iloc[:-1], 5, 0.2)
+        for horizon in horizons:
+            trainset.getTrainingSet(processed_stock_data, horizon, 0.2)
+        assert cache.getStats()["datasetHits"] == len(horizons)
+
+        trainset.getTrainingSet(processed_stock_data.iloc[:-2], 5, 0.2)
+        trainset.getTrainingSet(processed_stock_data.iloc[:-3], 5, 0.2)
+        assert cache.getStats()["datasetEntries"] == 2
+
+
 class TestProphetModel:
     @patch("pandas.read_csv")
     @patch("model.news.getSentimentData")
@@ -0,0 +1,210 @@
+import os
+import subprocess
+import sys
+import pytest
+import numpy as np
+import pandas as pd
+from unittest.mock import patch, MagicMock
+
+import cache
+import features
+import pipeline
+import processing
+import storage
+
+
+class TestStockPipeline:
+    @patch("pandas.read_csv", side_effect=AssertionError("pipeline read from disk"))
+    @patch("storage.loadSeries", side_effect=AssertionError("pipeline read from disk"))
+    @patch("storage.saveSeries")
+    @patch("yfinance.download")
+    def test_stages_stay_in_memory(
+        self,
+        mock_download,
+        mock_save,
+        mock_load,
+        mock_read_csv,
+        raw_download_data,
+        processed_stock_data,
+    ):
+        """Test that fetch, clean and features never touch ./data without persist"""
+        mock_download.return_value = raw_download_data
+
+        stockPipeline = pipeline.StockPipeline("AAPL", "1y", "1d")
+        features = stockPipeline.withFeatures()
+
+        mock_save.assert_not_called()
+        assert list(features.columns) == list(processed_stock_data.columns)
+        np.testing.assert_allclose(
+            features["RSI"].to_numpy(), processed_stock_data["RSI"].to_numpy()
+        )
+        # stages are computed once per pipeline
+        assert stockPipeline.withFeatures() is features
+        assert mock_download.call_count == 1
+
+    @patch("storage.saveSeries")
+    @patch("yfinance.download")
+    def test_persist_writes_each_stage(
+        self, mock_download, mock_save, raw_download_data
+    ):
+        """Test that persist=True stores raw and processed series"""
+        mock_download.return_value = raw_download_data
+
+        pipeline.StockPipeline("AAPL", "1y", "1d", persist=True).withFeatures()
+
+        kinds = [c.args[1] for c in mock_save.call_args_list]
+        assert kinds == ["raw", "processed", "processed"]
+
+    def test_train_receives_feature_frame(self, processed_stock_data):
+        """Test that the model gets the in-memory feature frame"""
+        stockPipeline = pipeline.StockPipeline("AAPL", "1y", "1d")
+        stockPipeline.features = processed_stock_data
+        trainer = MagicMock(return_value={"prediction": 1.0})
+
+        with patch("model.trainXGBoost", trainer):
+            result = stockPipeline.train("XGBoost", 30, 0.2, shuffle=True)
+
+        assert result == {"prediction": 1.0}
+        assert trainer.call_args.args[0] is processed_stock_data
+        assert trainer.call_args.kwargs == {"return_result": True, "shuffle": True}
+
+    @patch("yfinance.download", return_value=pd.DataFrame())
+    def test_empty_download_raises(self, mock_download):
+        """Test that an unknown ticker stops the pipeline early"""
+        with pytest.raises(ValueError):
+            pipeline.StockPipeline("XXXX", "1y", "1d").fetch()
+
+
+class TestBotProcess:
+    def test_bot_does_not_load_model_libraries(self):
+        """Test that the bot leaves xgboost, lightgbm and prophet to the workers"""
+        src = os.path.dirname(pipeline.__file__)
+        loaded = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, discord_bot; "
+                "print(sorted({'xgboost', 'lightgbm', 'prophet'} & set(sys.modules)))",
+            ],
+            cwd=src,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert loaded.stdout.strip().splitlines()[-1] == "[]"
+
+
+class TestIncrementalFeatures:
+    @patch("storage.loadSeries", return_value=None)
+    @patch("yfinance.download")
+    def test_refresh_extends_saved_state(
+        self, mock_download, mock_load, raw_download_data, monkeypatch
+    ):
+        """Test that new bars of an incremental fetch extend the previous features"""
+        monkeypatch.setitem(cache.cacheConfig, "ttl", {"1d": 0})
+        mock_download.return_value = raw_download_data.iloc[:-5]
+        first = pipeline.StockPipeline("AAPL", "max", "1d", incremental=True)
+        first.withFeatures()
+        # the last bar is requested again, it may have been an unfinished bar
+        mock_download.return_value = raw_download_data.iloc[-6:]
+        second = pipeline.StockPipeline("AAPL", "max", "1d", incremental=True)
+
+        with patch("features.computeFeatures", side_effect=AssertionError("kernel")):
+            refreshed = second.withFeatures()
+
+        expected = processing.addFeatures(
+            second.cleaned(), None, None, None, persist=False
+        )
+        pd.testing.assert_frame_equal(refreshed, expected, rtol=1e-9)
+        state = cache.getFeatureState("AAPL", "max", "1d")
+        assert state.bars == len(raw_download_data) - 1
+
+    @patch("storage.loadSeries", return_value=None)
+    @patch("yfinance.download")
+    def test_revised_history_is_recomputed(
+        self, mock_download, mock_load, raw_download_data, monkeypatch
+    ):
+        """Test that changed older bars fall back to the full kernel"""
+        monkeypatch.setitem(cache.cacheConfig, "ttl", {"1d": 0})
+        mock_download.return_value = raw_download_data.iloc[:-5]
+        pipeline.StockPipeline("AAPL", "max", "1d", incremental=True).withFeatures()
+        cache.putSeries("AAPL", "max", "1d", raw_download_data.iloc[1:-5])
+        mock_download.return_value = raw_download_data.iloc[-6:]
+        second = pipeline.StockPipeline("AAPL", "max", "1d", incremental=True)
+
+        with patch(
+            "features.computeFeatures", wraps=features.computeFeatures
+        ) as kernel:
+            refreshed = second.withFeatures()
+
+        assert kernel.call_count == 1
+        assert len(refreshed) == len(raw_download_data) - 1 - 49
+
+
+class TestChunkedPipeline:
+    @patch("yfinance.download")
+    def test_large_series_use_the_cached_copy(
+        self, mock_download, raw_download_data, persistent_cache_dir, monkeypatch
+    ):
+        """Test that a frame over max_frame_bytes is computed block by block"""
+        monkeypatch.chdir(persistent_cache_dir.parent)
+        monkeypatch.setitem(storage.storageConfig, "max_frame_bytes", 1)
+        monkeypatch.setattr(processing, "defaultChunkRows", 64)
+        mock_download.return_value = raw_download_data
+        stockPipeline = pipeline.StockPipeline("AAPL", "1y", "1d")
+
+        with patch("processing.addFeatures", side_effect=AssertionError("in memory")):
+            result = stockPipeline.withFeatures()
+
+        expected = processing.addFeatures(
+            stockPipeline.cleaned(), None, None, None, persist=False
+        )
+        pd.testing.assert_frame_equal(
+            result, expected.reset_index(drop=True), check_dtype=False, rtol=1e-9
+        )
+        assert list(persistent_cache_dir.glob("AAPL_1y_1d.features*"))
+        assert not os.path.exists("data")
+
+
+class TestPanelFeatures:
+    @patch("storage.saveSeries")
+    @patch("yfinance.download")
+    def test_grouped_download_to_features(
+        self, mock_download, mock_save, raw_download_data, processed_stock_data
+    ):
+        """Test that one grouped download yields per-ticker feature frames"""
+        grouped = pd.concat(
+            {"AAPL": raw_download_data, "MSFT": raw_download_data}, axis=1
+        )
+        mock_download.return_value = grouped
+
+        panel = pipeline.panelFeatures(["AAPL", "MSFT", "NONE"], "1y", "1d")
+
+        assert set(panel) == {"AAPL", "MSFT"}
+        np.testing.assert_allclose(
+            panel["MSFT"]["RSI"].to_numpy(), processed_stock_data["RSI"].to_numpy()
+        )
+
+
+class TestCompactPipeline:
+    @patch("yfinance.download")
+    def test_compact_stages(
+        self, mock_download, raw_download_data, processed_stock_data
+    ):
+        """Test that compact mode carries float32 through every stage at half the memory"""
+        mock_download.return_value = raw_download_data
+        full = pipeline.StockPipeline("AAPL", "1y", "1d")
+        full.withFeatures()
+        cache.clearCache()
+        compact = pipeline.StockPipeline("AAPL", "1y", "1d", compact=True)
+
+        features = compact.withFeatures()
+
+        assert features["RSI"].dtype == np.float32
+        assert features["Volume"].dtype == np.uint32
+        np.testing.assert_allclose(
+            features["RSI"], processed_stock_data["RSI"], rtol=1e-6
+        )
+        fullReport, compactReport = full.memoryReport(), compact.memoryReport()
+        assert list(compactReport) == ["raw", "clean", "features"]
+        assert compactReport["features"] < 0.6 * fullReport["features"]
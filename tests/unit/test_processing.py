@@ -0,0 +1,270 @@
+import json
+import pytest
+import numpy as np
+import pandas as pd
+from unittest.mock import patch
+
+import cache
+import features
+import preprocessing
+import processing
+import storage
+
+
+def random_walk(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, rows)))
+    return pd.DataFrame(
+        {
+            "Price": pd.date_range("2020-01-01", periods=rows, freq="D"),
+            "Close": close,
+            "High": close * 1.01,
+            "Low": close * 0.99,
+            "Open": close,
+            "Volume": rng.integers(1_000_000, 100_000_000, rows),
+        }
+    )
+
+
+class TestFeatureKernel:
+    def test_matches_processed_fixture(self, raw_download_data, processed_stock_data):
+        """Test that features of the raw fixture match the stored processed fixture"""
+        clean = preprocessing.cleanData(raw_download_data, "AAPL", "1y", "1d", False)
+        result = processing.addFeatures(clean, "AAPL", "1y", "1d", persist=False)
+
+        assert list(result.columns) == list(processed_stock_data.columns)
+        columns = processed_stock_data.columns.drop("Price")
+        np.testing.assert_allclose(
+            result[columns].to_numpy(),
+            processed_stock_data[columns].to_numpy(),
+            rtol=1e-9,
+        )
+
+    def test_matches_pandas_reference(self):
+        """Test that the kernel agrees with one pandas call per indicator"""
+        data = random_walk(5000)
+
+        result = processing.addFeatures(data, None, None, None, persist=False)
+        expected = processing.addFeaturesPandas(data).dropna()
+
+        pd.testing.assert_frame_equal(result, expected, rtol=1e-9)
+
+    def test_missing_close_uses_pandas(self):
+        """Test that series with missing closes still get features"""
+        data = random_walk(200)
+        data.loc[120, "Close"] = np.nan
+
+        result = processing.addFeatures(data, None, None, None, persist=False)
+        expected = processing.addFeaturesPandas(data).dropna()
+
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_rows_of_series_are_independent(self):
+        """Test that 2-D input gives each row the features of its own series"""
+        first, second = random_walk(300, seed=1), random_walk(300, seed=2)
+        close = np.stack([first["Close"], second["Close"]])
+        volume = np.stack([first["Volume"], second["Volume"]]).astype(float)
+
+        panel = features.computeFeatures(close, volume)
+        single = features.computeFeatures(close[1], volume[1])
+
+        for name in features.featureColumns:
+            np.testing.assert_allclose(panel[name][1], single[name], rtol=1e-12)
+
+
+class TestFeatureState:
+    def test_streamed_rows_match_batch(self):
+        """Test that bar-by-bar updates give the same rows as the full recompute"""
+        data = random_walk(400)
+        expected = processing.addFeatures(data, None, None, None, persist=False)
+
+        state = features.FeatureState.fromSeries(
+            data["Close"][:300], data["Volume"][:300]
+        )
+        rows = [
+            state.update(c, v)
+            for c, v in zip(data["Close"][300:], data["Volume"][300:])
+        ]
+
+        streamed = pd.DataFrame(rows, index=range(300, 400))
+        columns = [c for c in features.featureColumns if c != "timeFeature"]
+        np.testing.assert_allclose(
+            streamed[columns].to_numpy(),
+            expected.loc[300:, columns].to_numpy(),
+            rtol=1e-9,
+        )
+
+    def test_state_from_first_bar(self):
+        """Test that a state started empty warms up like the batch kernel"""
+        data = random_walk(120)
+        expected = processing.addFeatures(data, None, None, None, persist=False)
+
+        state = features.FeatureState()
+        rows = [state.update(c, v) for c, v in zip(data["Close"], data["Volume"])]
+
+        streamed = pd.DataFrame(rows).dropna()
+        assert list(streamed.index) == list(expected.index)
+        np.testing.assert_allclose(streamed["RSI"], expected["RSI"], rtol=1e-9)
+
+    def test_extend_features_after_restore(self):
+        """Test that a serialized state extends a feature frame like addFeatures"""
+        data = random_walk(300)
+        head = data.iloc[:250]
+        frame = processing.addFeatures(head, None, None, None, persist=False)
+        saved = json.loads(json.dumps(processing.featureState(head).toDict()))
+
+        state = features.FeatureState.fromDict(saved)
+        extended = processing.extendFeatures(frame, data.iloc[250:], state)
+
+        expected = processing.addFeatures(data, None, None, None, persist=False)
+        pd.testing.assert_frame_equal(extended, expected, rtol=1e-9)
+        assert state.lastTimestamp == data["Price"].iloc[-1].isoformat()
+
+
+class TestFeatureRegistry:
+    def test_subset_computes_only_its_subgraph(self):
+        """Test that requesting moving averages never runs the ewm filters"""
+        data = random_walk(100)
+
+        with patch("features.ewm", side_effect=AssertionError("ewm computed")):
+            result = processing.addFeatures(
+                data, None, None, None, persist=False, names=["ma10", "volma10"]
+            )
+
+        assert list(result.columns) == list(data.columns) + ["ma10", "volma10"]
+        assert len(result) == 100 - 9
+
+    def test_warmup_is_derived_from_dependencies(self):
+        """Test that warm-up rows follow the longest window in the subgraph"""
+        assert features.warmup(features.featureColumns) == 49
+        assert features.warmup(["volitStd1w"]) == 7
+        assert features.warmup(["macdSignal", "RSI"]) == 0
+
+    def test_unknown_feature(self):
+        """Test that unregistered names are rejected"""
+        with pytest.raises(ValueError):
+            features.resolve(["ma10", "sma200"])
+
+    def test_obv(self):
+        """Test on-balance volume against its pandas definition"""
+        data = random_walk(50)
+        diff = data["Close"].diff()
+        expected = (np.sign(diff) * data["Volume"]).where(diff != 0).fillna(0).cumsum()
+
+        result = processing.addFeatures(data, None, None, None, False, names=["OBV"])
+
+        np.testing.assert_allclose(result["OBV"], expected)
+
+
+class TestPanelFeatures:
+    def test_panel_matches_single_ticker(self):
+        """Test that listing dates and gaps give every ticker its own features"""
+        full = random_walk(200, seed=1)
+        listed = random_walk(200, seed=2).iloc[60:]  # listed later
+        gappy = random_walk(200, seed=3).drop(index=[100, 101, 150])  # own holidays
+        series = {"AAA": full, "BBB": listed, "CCC": gappy}
+
+        panel = processing.addPanelFeatures(series)
+
+        for ticker, data in series.items():
+            expected = processing.addFeatures(data, None, None, None, persist=False)
+            pd.testing.assert_frame_equal(panel[ticker], expected, rtol=1e-9)
+
+    def test_panel_subset(self):
+        """Test that a panel computes only the requested features"""
+        series = {"AAA": random_walk(80, seed=1), "BBB": random_walk(40, seed=2)}
+
+        panel = processing.addPanelFeatures(series, names=["ma10", "RSI"])
+
+        assert list(panel["BBB"].columns[-2:]) == ["ma10", "RSI"]
+        assert len(panel["BBB"]) == 40 - 9
+
+
+class TestChunkedFeatures:
+    @pytest.fixture
+    def stored_raw(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        # one minute bars of a New York session, stored stamps must keep the offset
+        raw = random_walk(1000).set_index("Price").rename_axis("Datetime")
+        raw.index = pd.date_range(
+            "2024-03-01 09:30",
+            periods=len(raw),
+            freq="1min",
+            tz="America/New_York",
+            name="Datetime",
+        )
+        storage.saveSeries(raw, "raw", "AAA", "1mo", "1m")
+        return raw
+
+    @pytest.mark.parametrize("chunkRows", [20, 128, 5000])
+    def test_chunks_match_whole_series(self, stored_raw, chunkRows):
+        """Test that blocks smaller and larger than the warm-up give the same rows"""
+        clean = preprocessing.cleanData(stored_raw, "AAA", "1mo", "1m", False)
+        expected = processing.addFeatures(clean, None, None, None, persist=False)
+
+        rows = processing.addFeaturesChunked("AAA", "1mo", "1m", chunkRows=chunkRows)
+        result = storage.loadSeries("processed", "AAA", "1mo", "1m")
+
+        assert rows == len(expected) == len(result)
+        assert (result["Price"] == stored_raw.index[-rows:]).all()
+        pd.testing.assert_frame_equal(
+            result, expected.reset_index(drop=True), check_dtype=False, rtol=1e-9
+        )
+
+    def test_running_features_continue(self, stored_raw):
+        """Test that EMA based and cumulative features carry across blocks"""
+        names = ["RSI", "macdSignal", "OBV"]
+        clean = preprocessing.cleanData(stored_raw, "AAA", "1mo", "1m", False)
+        expected = processing.addFeatures(clean, None, None, None, False, names=names)
+
+        processing.addFeaturesChunked("AAA", "1mo", "1m", names=names, chunkRows=64)
+        result = storage.loadSeries("processed", "AAA", "1mo", "1m")
+
+        np.testing.assert_allclose(result[names], expected[names], rtol=1e-9)
+
+    def test_csv_written_in_blocks(self, stored_raw):
+        """Test that the csv format is appended block by block"""
+        with patch.dict(storage.storageConfig, {"format": "csv"}):
+            storage.saveSeries(stored_raw, "raw", "AAA", "1mo", "1m")
+            rows = processing.addFeaturesChunked("AAA", "1mo", "1m", chunkRows=100)
+            result = storage.loadSeries("processed", "AAA", "1mo", "1m")
+
+        assert len(result) == rows == 1000 - features.warmup(features.featureColumns)
+
+    def test_missing_raw_series(self, tmp_path, monkeypatch):
+        """Test that nothing is computed without a stored raw series"""
+        monkeypatch.chdir(tmp_path)
+        with pytest.raises(ValueError):
+            processing.addFeaturesChunked("AAA", "1mo", "1m")
+
+
+class TestFeatureCache:
+    def test_identical_input_is_not_recomputed(self):
+        """Test that the same cleaned data reuses the computed features"""
+        first = processing.addFeatures(random_walk(100), None, None, None, False)
+
+        with patch("features.computeFeatures") as mock_compute:
+            second = processing.addFeatures(random_walk(100), None, None, None, False)
+
+        mock_compute.assert_not_called()
+        assert second is first
+        assert cache.getStats()["featureHits"] == 1
+
+    def test_changed_data_is_recomputed(self):
+        """Test that a new bar changes the key"""
+        processing.addFeatures(random_walk(100), None, None, None, False)
+        processing.addFeatures(random_walk(101), None, None, None, False)
+
+        assert cache.getStats()["featureMisses"] == 2
+
+    def test_changed_formula_invalidates(self):
+        """Test that redefining a feature changes the spec version"""
+        before = features.specVersion(features.featureColumns)
+        original = features.registry["volma10"]
+        try:
+            features.register("volma10", features.rolling("Volume", 20))
+            assert features.specVersion(features.featureColumns) != before
+            assert features.specVersion(["ma10"]) == features.specVersion(["ma10"])
+        finally:
+            features.register("volma10", original)
+        assert features.specVersion(features.featureColumns) == before
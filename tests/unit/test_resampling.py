@@ -0,0 +1,78 @@
+import pandas as pd
+from unittest.mock import patch
+
+import cache
+import ingestion
+import resampling
+
+
+def daily_bars(start, end):
+    index = pd.bdate_range(start, end, name="Date")
+    values = [float(i) for i in range(len(index))]
+    return pd.DataFrame(
+        {
+            "Close": values,
+            "High": [v + 1 for v in values],
+            "Low": [v - 1 for v in values],
+            "Open": values,
+            "Volume": 100,
+        },
+        index=index,
+    )
+
+
+class TestResampleBars:
+    def test_weekly_ohlcv_rules(self):
+        """Test that open/high/low/close/volume fold into one weekly bar each"""
+        daily = daily_bars("2024-01-01", "2024-01-12")
+
+        weekly = resampling.resampleBars(daily, "1wk")
+
+        assert list(weekly.columns) == list(daily.columns)
+        assert list(weekly.index) == [
+            pd.Timestamp("2024-01-01"),
+            pd.Timestamp("2024-01-08"),
+        ]
+        first = weekly.iloc[0]
+        assert first["Open"] == 0.0
+        assert first["High"] == 5.0
+        assert first["Low"] == -1.0
+        assert first["Close"] == 4.0
+        assert first["Volume"] == 500
+
+    def test_buckets_follow_trading_sessions(self):
+        """Test that holidays shift bar labels instead of creating empty bars"""
+        daily = daily_bars("2024-01-01", "2024-03-29").drop(pd.Timestamp("2024-01-01"))
+
+        monthly = resampling.resampleBars(daily, "1mo")
+        fiveDay = resampling.resampleBars(daily, "5d")
+
+        assert monthly.index[0] == pd.Timestamp("2024-01-02")
+        assert len(monthly) == 3
+        assert (fiveDay["Volume"].iloc[:-1] == 500).all()
+        assert fiveDay.index[1] == pd.Timestamp("2024-01-09")
+
+
+class TestResampledFetch:
+    @patch("yfinance.download")
+    def test_coarse_interval_built_from_cached_daily(self, mock_download):
+        """Test that a weekly request is answered from cached daily bars"""
+        daily = daily_bars("2024-01-01", "2024-03-29")
+        cache.putSeries("AAPL", "1y", "1d", daily, persist=False)
+
+        weekly = ingestion.fetchStock("AAPL", "1y", "1wk", persist=False, resample=True)
+
+        mock_download.assert_not_called()
+        assert len(weekly) == 13
+        assert weekly["Volume"].sum() == daily["Volume"].sum()
+
+    @patch("yfinance.download")
+    def test_flag_falls_back_to_remote(self, mock_download):
+        """Test that with resampling off the coarse interval is downloaded"""
+        daily = daily_bars("2024-01-01", "2024-03-29")
+        cache.putSeries("AAPL", "1y", "1d", daily, persist=False)
+        mock_download.return_value = resampling.resampleBars(daily, "1wk")
+
+        ingestion.fetchStock("AAPL", "1y", "1wk", persist=False, resample=False)
+
+        mock_download.assert_called_once_with("AAPL", period="1y", interval="1wk")
@@ -0,0 +1,126 @@
+import os
+import pytest
+
+import executor
+import model
+import resources
+
+
+def cgroup(root, files):
+    for name, value in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"{value}\n")
+    return str(root)
+
+
+@pytest.fixture(autouse=True)
+def governed(monkeypatch):
+    # govern() changes the environment and the thread pools of the test process
+    monkeypatch.setattr(os, "environ", dict(os.environ))
+    os.environ.pop("OMP_NUM_THREADS", None)
+    monkeypatch.setattr(resources, "_settings", None)
+    monkeypatch.setattr(resources, "_limitLoaded", lambda threads: None)
+    monkeypatch.setattr(resources, "hostCpus", lambda: 8)
+    monkeypatch.setattr(resources, "resourceConfig", {})
+    monkeypatch.setitem(executor.executorConfig, "workers", 4)
+
+
+class TestLimits:
+    def test_cgroup_v2(self, tmp_path):
+        """Test reading the CPU quota and memory limit of cgroup v2"""
+        root = cgroup(tmp_path, {"cpu.max": "10000 100000", "memory.max": 471859200})
+        assert resources.cpuQuota(root) == 0.1
+        assert resources.memoryLimit(root) == 471859200
+
+    def test_cgroup_v1(self, tmp_path):
+        """Test reading the CPU quota and memory limit of cgroup v1"""
+        root = cgroup(
+            tmp_path,
+            {
+                "cpu/cpu.cfs_quota_us": 250000,
+                "cpu/cpu.cfs_period_us": 100000,
+                "memory/memory.limit_in_bytes": 1073741824,
+            },
+        )
+        assert resources.cpuQuota(root) == 2.5
+        assert resources.memoryLimit(root) == 1073741824
+
+    def test_no_limits(self, tmp_path):
+        """Test that unlimited and missing cgroup files mean no limit"""
+        assert resources.cpuQuota(str(tmp_path)) is None
+        assert resources.memoryLimit(str(tmp_path)) is None
+
+        root = cgroup(tmp_path, {"cpu.max": "max 100000", "memory.max": "max"})
+        assert resources.cpuQuota(root) is None
+        assert resources.memoryLimit(root) is None
+
+        v1 = cgroup(
+            tmp_path / "v1",
+            {
+                "cpu/cpu.cfs_quota_us": -1,
+                "cpu/cpu.cfs_period_us": 100000,
+                "memory/memory.limit_in_bytes": 9223372036854771712,
+            },
+        )
+        assert resources.cpuQuota(v1) is None
+        assert resources.memoryLimit(v1) is None
+
+
+class TestGovern:
+    def test_fractional_quota(self, tmp_path):
+        """Test that a 100m pod trains one job with one thread"""
+        root = cgroup(tmp_path, {"cpu.max": "10000 100000", "memory.max": 471859200})
+        limits = resources.govern(root)
+
+        assert limits["workers"] == 1 and limits["threads"] == 1
+        assert limits["source"] == "cgroup"
+        assert executor.workerCount() == 1
+        assert os.environ["OMP_NUM_THREADS"] == "1"
+        assert os.environ["OPENBLAS_NUM_THREADS"] == "1"
+        assert resources.threads() == 1
+
+    def test_cpus_are_shared_by_workers(self, tmp_path):
+        """Test that the workers split the CPUs of the quota"""
+        root = cgroup(tmp_path, {"cpu.max": "400000 100000"})
+        limits = resources.govern(root)
+        assert (limits["workers"], limits["threads"]) == (4, 1)
+
+        root = cgroup(tmp_path, {"cpu.max": "400000 100000", "memory.max": 1 << 30})
+        limits = resources.govern(root)
+        # 1 GiB leaves room for the bot, the fork server and 4 workers of 150 MiB
+        assert (limits["workers"], limits["threads"]) == (4, 1)
+
+        root = cgroup(tmp_path, {"cpu.max": "400000 100000", "memory.max": 3 << 28})
+        limits = resources.govern(root)
+        assert (limits["workers"], limits["threads"]) == (3, 1)
+
+        root = cgroup(tmp_path, {"cpu.max": "400000 100000", "memory.max": 1 << 29})
+        limits = resources.govern(root)
+        assert (limits["workers"], limits["threads"]) == (1, 4)
+
+    def test_host_without_limits(self, tmp_path):
+        """Test that without a cgroup the host CPUs are used"""
+        limits = resources.govern(str(tmp_path))
+        assert (limits["workers"], limits["threads"]) == (4, 2)
+        assert limits["source"] == "host"
+
+    def test_config_overrides(self, tmp_path, monkeypatch):
+        """Test that configured workers and threads win over the cgroup"""
+        monkeypatch.setattr(resources, "resourceConfig", {"workers": 0, "threads": 3})
+        root = cgroup(tmp_path, {"cpu.max": "10000 100000"})
+        limits = resources.govern(root)
+
+        assert (limits["workers"], limits["threads"]) == (0, 3)
+        assert limits["source"] == "config"
+        assert executor.workerCount() == 0
+
+    def test_threads_reach_the_boosters(self, tmp_path):
+        """Test that the thread count is passed to every fit"""
+        assert model.withThreads({"eta": 0.1}, "nthread") == {"eta": 0.1}
+
+        resources.govern(cgroup(tmp_path, {"cpu.max": "10000 100000"}))
+        assert model.withThreads({"eta": 0.1}, "nthread") == {
+            "eta": 0.1,
+            "nthread": 1,
+        }
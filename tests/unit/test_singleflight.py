@@ -0,0 +1,84 @@
+import pytest
+import threading
+import time
+from unittest.mock import MagicMock
+
+import singleflight
+
+
+@pytest.fixture(autouse=True)
+def reset_stats():
+    singleflight.resetStats()
+    yield
+    singleflight.resetStats()
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def worker(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+class TestSingleFlight:
+    def test_concurrent_callers_share_one_computation(self):
+        """Test that callers with the same key wait for the first one's result"""
+        release = threading.Event()
+        computation = MagicMock(side_effect=lambda: release.wait(5) and {"rmse": 1.0})
+        key = ("train", "AAPL", "1y", "1d")
+
+        threads, results, errors = run_concurrently(
+            5, lambda: singleflight.do(key, computation)
+        )
+        # let every caller join before the computation finishes
+        while singleflight.getStats()["stages"].get("train", {}).get("merged", 0) < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        computation.assert_called_once()
+        assert errors == [None] * 5
+        assert all(result is results[0] for result in results)
+        stats = singleflight.getStats()
+        assert stats["stages"]["train"] == {"executions": 1, "merged": 4}
+        assert singleflight.inflightCount() == 0
+
+    def test_errors_reach_every_waiter(self):
+        """Test that a failed computation raises for all coalesced callers"""
+        release = threading.Event()
+
+        def failing():
+            release.wait(5)
+            raise ValueError("download failed")
+
+        threads, results, errors = run_concurrently(
+            3, lambda: singleflight.do(("fetch", "AAPL"), failing)
+        )
+        while singleflight.getStats()["merged"] < 2:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert all(isinstance(e, ValueError) for e in errors)
+        assert singleflight.getStats()["executions"] == 1
+
+    def test_sequential_calls_recompute(self):
+        """Test that a finished computation is not reused as a cache"""
+        computation = MagicMock(return_value=1)
+
+        singleflight.do(("fetch", "AAPL"), computation)
+        singleflight.do(("fetch", "AAPL"), computation)
+
+        assert computation.call_count == 2
+        assert singleflight.getStats()["merged"] == 0
@@ -0,0 +1,155 @@
+import pytest
+import io
+import os
+import numpy as np
+import pandas as pd
+
+import storage
+import preprocessing
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def intraday_data(raw_download_data):
+    """The raw bars as one minute bars of a New York session"""
+    index = pd.date_range(
+        "2024-03-01 09:30",
+        periods=len(raw_download_data),
+        freq="1min",
+        tz="America/New_York",
+    )
+    return raw_download_data.set_axis(index.rename("Datetime"))
+
+
+class TestFrameStorage:
+    @pytest.mark.parametrize("fmt", ["npy", "csv", "parquet"])
+    def test_round_trip(self, data_dir, raw_download_data, fmt):
+        """Test that every backend restores values, dtypes and the datetime index"""
+        if fmt == "parquet" and not storage.parquetAvailable:
+            pytest.skip("pyarrow not installed")
+        base = str(data_dir / "AAPL_1y_1d")
+
+        storage.saveFrame(raw_download_data, base, fmt=fmt)
+        loaded = storage.loadFrame(base, fmt=fmt)
+
+        assert isinstance(loaded.index, pd.DatetimeIndex)
+        assert list(loaded.columns) == list(raw_download_data.columns)
+        assert loaded["Volume"].dtype == raw_download_data["Volume"].dtype
+        np.testing.assert_allclose(
+            loaded["Close"].to_numpy(), raw_download_data["Close"].to_numpy()
+        )
+
+    def test_npy_is_memory_mapped(self, data_dir, raw_download_data):
+        """Test that npy values are served from a memory map"""
+        base = str(data_dir / "AAPL_1y_1d")
+        storage.saveFrame(raw_download_data, base, fmt="npy")
+
+        loaded = storage.loadFrame(base, fmt="npy")
+
+        assert isinstance(np.load(f"{base}.npy", mmap_mode="r"), np.memmap)
+        assert not loaded["Close"].to_numpy().flags.writeable
+
+    def test_processed_frames_keep_price_column(self, data_dir, processed_stock_data):
+        """Test that the Price date column survives a round trip"""
+        storage.saveSeries(processed_stock_data, "processed", "AAPL", "1y", "1d")
+
+        loaded = storage.loadSeries("processed", "AAPL", "1y", "1d")
+
+        assert list(loaded.columns) == list(processed_stock_data.columns)
+        assert loaded["Price"].iloc[0] == pd.Timestamp(
+            processed_stock_data["Price"].iloc[0]
+        )
+
+    def test_export_csv_to_buffer(self, processed_stock_data):
+        """Test that an export keeps the Price column and no index column"""
+        buffer = io.StringIO()
+
+        storage.exportCsv(processed_stock_data.tail(10), buffer)
+
+        exported = pd.read_csv(io.StringIO(buffer.getvalue()))
+        assert list(exported.columns) == list(processed_stock_data.columns)
+        assert len(exported) == 10
+
+    @pytest.mark.parametrize("fmt", ["npy", "csv"])
+    def test_timezone_round_trip(self, data_dir, intraday_data, fmt):
+        """Test that a tz-aware index comes back at the same instants"""
+        base = str(data_dir / "AAPL_1d_1m")
+        storage.saveFrame(intraday_data, base, fmt=fmt)
+
+        loaded = storage.loadFrame(base, fmt=fmt)
+
+        assert loaded.index[0] == pd.Timestamp(
+            "2024-03-01 09:30", tz="America/New_York"
+        )
+        assert (loaded.index == intraday_data.index).all()
+        if fmt == "npy":
+            assert str(loaded.index.tz) == "America/New_York"
+            assert storage.hashFrame(loaded) == storage.hashFrame(intraday_data)
+
+    def test_series_writer_keeps_timezone(self, data_dir, intraday_data):
+        """Test that blocks written by SeriesWriter reload at the same instants"""
+        base = str(data_dir / "AAPL_1d_1m")
+        with storage.SeriesWriter(base, fmt="npy") as writer:
+            writer.write(intraday_data.iloc[:100])
+            writer.write(intraday_data.iloc[100:])
+
+        loaded = storage.loadFrame(base, fmt="npy")
+
+        assert loaded.index.equals(intraday_data.index)
+        assert storage.hashFrame(loaded) == storage.hashFrame(intraday_data)
+
+    def test_incomplete_series_is_ignored(self, data_dir, raw_download_data):
+        """Test that a series without its sidecar is treated as missing"""
+        base = str(data_dir / "AAPL_1y_1d")
+        storage.saveFrame(raw_download_data, base, fmt="npy")
+        os.remove(f"{base}.json")
+
+        assert storage.loadFrame(base, fmt="npy") is None
+
+    def test_hash_frame_detects_changes(self, raw_download_data):
+        """Test that hashFrame depends on values and index"""
+        original = storage.hashFrame(raw_download_data)
+
+        assert storage.hashFrame(raw_download_data.copy()) == original
+        assert storage.hashFrame(raw_download_data.iloc[:-1]) != original
+
+
+class TestCompactFrames:
+    def test_compact_dtypes(self, raw_download_data):
+        """Test that prices become float32 and volume the smallest integer type"""
+        compact = storage.compactFrame(raw_download_data)
+
+        assert (compact.drop(columns="Volume").dtypes == np.float32).all()
+        assert compact["Volume"].dtype == np.uint32
+        assert storage.compactFrame(compact) is compact
+        np.testing.assert_allclose(
+            compact["Close"], raw_download_data["Close"], rtol=2**-24
+        )
+
+    def test_compact_enforced_on_load(self, data_dir, raw_download_data):
+        """Test that compact loading casts stored float64 series"""
+        base = str(data_dir / "AAPL_1y_1d")
+        storage.saveFrame(raw_download_data, base, fmt="npy")
+
+        loaded = storage.loadFrame(base, fmt="npy", compact=True)
+
+        assert loaded["Close"].dtype == np.float32
+        assert isinstance(loaded.index, pd.DatetimeIndex)
+
+
+class TestCleanData:
+    def test_legacy_csv_and_download_agree(
+        self, data_dir, sample_stock_data, raw_download_data
+    ):
+        """Test that csv header rows and binary downloads clean to the same frame"""
+        fromCsv = preprocessing.cleanData(sample_stock_data, "AAPL", "1y", "1d")
+        fromDownload = preprocessing.cleanData(raw_download_data, "AAPL", "1y", "1d")
+
+        assert len(fromCsv) == len(sample_stock_data) - 2
+        assert fromCsv["Price"].dtype.kind == "M"
+        pd.testing.assert_frame_equal(fromCsv, fromDownload, check_dtype=False)
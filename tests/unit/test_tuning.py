@@ -0,0 +1,84 @@
+import pytest
+import time
+from unittest.mock import patch
+import lightgbm
+
+import cache
+import model
+import modelregistry
+import tuning
+
+
+@pytest.fixture(autouse=True)
+def no_sentiment():
+    cache.clearCache()
+    with patch("model.news.getSentimentData", return_value=({"sentimentScore": 0}, [])):
+        yield
+    cache.clearCache()
+
+
+def tuned(rmse, defaultRmse=2.0):
+    return {
+        "params": {"num_leaves": 7, "learning_rate": 0.1},
+        "rounds": 40,
+        "rmse": rmse,
+        "defaultRmse": defaultRmse,
+    }
+
+
+class TestTuning:
+    def test_successive_halving(self, processed_stock_data, monkeypatch):
+        """Test that each rung keeps a third of the candidates"""
+        monkeypatch.setitem(tuning.tuningConfig, "max_rounds", 225)
+        entry = tuning.tune(
+            processed_stock_data, "lightgbm", "AAPL", "1d", budget=300, candidates=9
+        )
+
+        assert entry["fits"] == 9 + 3 + 1
+        assert 0 < entry["rounds"] <= 225
+        assert entry["rmse"] > 0 and entry["defaultRmse"] > 0
+        assert modelregistry.getTuned("lightgbm", "aapl", "1d") == (
+            entry if entry["rmse"] < entry["defaultRmse"] else None
+        )
+
+    def test_budget_stops_the_search(self, processed_stock_data):
+        """Test that no fit starts once the time budget is used up"""
+        fit = tuning._fit
+
+        def slowFit(*args):
+            time.sleep(0.2)
+            return fit(*args)
+
+        with patch("tuning._fit", side_effect=slowFit):
+            entry = tuning.tune(
+                processed_stock_data, "xgboost", "AAPL", "1d", budget=0.5
+            )
+        assert entry["fits"] <= 4
+
+    def test_predictions_use_better_settings(self, processed_stock_data):
+        """Test that predictions train with the stored settings when they won"""
+        modelregistry.putTuned("lightgbm", "AAPL", "1d", tuned(1.0))
+        with patch("lightgbm.train", side_effect=lightgbm.train) as mock_train:
+            model.trainLightGBM(
+                processed_stock_data, "AAPL", "1y", "1d", 5, 0.2, return_result=True
+            )
+
+        params = mock_train.call_args.args[0]
+        assert params["num_leaves"] == 7
+        assert params["random_state"] == 42
+        assert mock_train.call_args.kwargs["num_boost_round"] == 40
+
+    def test_worse_settings_are_ignored(self):
+        """Test that a tuning result that lost to the default is not used"""
+        modelregistry.putTuned("lightgbm", "AAPL", "1d", tuned(3.0))
+        params, rounds = model.boosterConfig("lightgbm", "AAPL", "1d")
+        assert params == model.boosterParams["lightgbm"]
+        assert rounds == model.boostRounds
+
+    def test_settings_survive_restart(self):
+        """Test that tuned settings are read back from the registry directory"""
+        modelregistry.putTuned("xgboost", "AAPL", "1h", tuned(1.0))
+        modelregistry.clearRegistry()
+
+        assert modelregistry.getTuned("xgboost", "AAPL", "1h")["rounds"] == 40
+        assert modelregistry.getTuned("xgboost", "AAPL", "1d") is None
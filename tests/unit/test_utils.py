@@ -123,3 +123,25 @@ class TestGeneratePredictionChart:
                     modelName="TestModel",
                 )
                 # No assertion needed - we're just checking it doesn't raise an exception
+
+
+class TestGenerateStockChart:
+    def test_chart_is_cached_by_content(self, tmp_path, monkeypatch, raw_download_data):
+        """Test that the chart is rendered once per distinct data content"""
+        monkeypatch.chdir(tmp_path)
+
+        with patch("matplotlib.pyplot.savefig") as mock_savefig:
+            mock_savefig.side_effect = lambda path: open(path, "wb").close()
+            first = utils.generateStockChart(raw_download_data, "AAPL", "1y", "1d")
+            second = utils.generateStockChart(raw_download_data, "AAPL", "1y", "1d")
+
+            changed = raw_download_data.copy()
+            changed.iloc[-1, 0] += 1.0
+            third = utils.generateStockChart(changed, "AAPL", "1y", "1d")
+
+        assert first == second
+        assert third != first
+        assert mock_savefig.call_count == 2
+        # the chart of the outdated data is removed
+        assert not os.path.exists(first)
+        assert os.path.exists(third)